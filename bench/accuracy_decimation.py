@@ -0,0 +1,100 @@
+"""
+Reports how far decimated cell points are from full resolution points, next to the time each setting takes.
+
+    python bench/accuracy_decimation.py --replay session/
+    python bench/accuracy_decimation.py --factors 2,4 --methods min --output decimation.json
+
+Every frame is processed at full resolution and at each decimation factor and method. Point errors are the
+absolute differences in millimetres over all frames and cells; "closer" counts points that moved closer than
+full resolution, the safe direction for obstacle feedback.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from stereo_scene import ScenePlan, DECIMATIONS
+from frame_source import SyntheticSource, load_session
+
+FACTORS = (2, 4, 8)
+
+
+def session_frames(path, count):
+    depth = load_session(path)["depth"]
+    return [np.array(depth_map) for depth_map in depth[:count]]
+
+
+def synthetic_frames(shape, count):
+    source = SyntheticSource(*shape, color=False)
+    return [source.read()[0] for _ in range(count)]
+
+
+def time_points(plan, frames):
+    """
+    :return: ((2D int64 array, 1D float array)) FRAMES, CELLS points and per frame seconds
+    """
+    points = np.empty((len(frames), plan.ver_cells * plan.hor_cells), np.int64)
+    seconds = np.empty(len(frames))
+    for index, depth_map in enumerate(frames):
+        start = time.perf_counter()
+        plan.process(depth_map, out=points[index])
+        seconds[index] = time.perf_counter() - start
+    return points, seconds
+
+
+def accuracy(frames, grid, factors, methods):
+    """
+    :return: ([dict]) one record per factor and method, the full resolution record first
+    """
+    reference, seconds = time_points(ScenePlan(frames[0].shape, *grid), frames)
+    records = [{"factor": 1, "method": "full", "median_ms": float(np.median(seconds)) * 1000,
+                "mean_error_mm": 0.0, "p95_error_mm": 0.0, "max_error_mm": 0.0, "closer": 0.0}]
+    for factor in factors:
+        for method in methods:
+            plan = ScenePlan(frames[0].shape, *grid, decimation=factor, decimation_method=method)
+            points, seconds = time_points(plan, frames)
+            error = np.abs(points - reference)
+            records.append({"factor": factor, "method": method, "median_ms": float(np.median(seconds)) * 1000,
+                            "mean_error_mm": float(error.mean()), "p95_error_mm": float(np.percentile(error, 95)),
+                            "max_error_mm": float(error.max()), "closer": float(np.mean(points < reference))})
+    return records
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Decimation accuracy against full resolution cell points")
+    parser.add_argument("--replay", metavar="PATH", help="recorded session directory, synthetic frames otherwise")
+    parser.add_argument("--frames", type=int, default=100, help="frames compared")
+    parser.add_argument("--grid", type=lambda text: tuple(int(cells) for cells in text.lower().split("x")),
+                        default=(3, 5), help="VERxHOR cells")
+    parser.add_argument("--factors", type=lambda text: [int(factor) for factor in text.split(",")],
+                        default=FACTORS, help="comma separated decimation factors")
+    parser.add_argument("--methods", type=lambda text: text.split(","), default=DECIMATIONS,
+                        help="comma separated pooling methods, from %s" % ",".join(DECIMATIONS))
+    parser.add_argument("--output", help="JSON results file")
+    args = parser.parse_args()
+
+    if args.replay:
+        frames = session_frames(args.replay, args.frames)
+    else:
+        frames = synthetic_frames((480, 640), args.frames)
+    records = accuracy(frames, args.grid, args.factors, args.methods)
+
+    print("%6s %-8s %9s %10s %10s %10s %7s" % ("factor", "method", "median_ms", "mean_mm", "p95_mm", "max_mm",
+                                                "closer"))
+    for record in records:
+        print("%6d %-8s %9.3f %10.1f %10.1f %10.1f %6.0f%%" % (
+            record["factor"], record["method"], record["median_ms"], record["mean_error_mm"],
+            record["p95_error_mm"], record["max_error_mm"], record["closer"] * 100))
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump({"frames": len(frames), "shape": list(frames[0].shape), "grid": list(args.grid),
+                       "results": records}, file, indent=1)
+
+
+if __name__ == "__main__":
+    main()
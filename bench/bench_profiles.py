@@ -0,0 +1,98 @@
+"""
+Times every capture profile's software post-processing and cell processing against the default profile.
+
+    python bench/bench_profiles.py
+    python bench/bench_profiles.py --replay session/ --profiles default,fast,decimated --output profiles.json
+
+Frames are generated (or replayed) at each profile's resolution and run through ProfileSource, a software
+approximation of the RealSense post-processing chain, then through a ScenePlan. A camera does the
+post-processing on the device, so "filter_ms" is an upper bound for camera profiles.
+"""
+import argparse
+import functools
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from stereo_scene import ScenePlan, decimate
+from frame_source import PROFILES, FrameSource, ProfileSource, ReplaySource, SyntheticSource
+
+
+class FrameList(FrameSource):
+    """
+    Frames read ahead of time, so generating or paging them in is not timed.
+    """
+
+    def __init__(self, frames):
+        self.frames = iter(frames)
+
+    def read(self):
+        return next(self.frames)
+
+
+def time_profile(profile, count, grid, replay=None):
+    """
+    :return: ((1D float array, 1D float array)) per frame seconds of post-processing and of the plan
+    """
+    if replay:
+        frames = ReplaySource(replay, realtime=False, loop=True)
+    else:
+        frames = SyntheticSource(profile.height, profile.width, color=False)
+    frames = [(np.array(depth_map), None) for depth_map, _ in (frames.read() for _ in range(count))]
+    source = ProfileSource(FrameList(frames), profile, functools.partial(decimate, method="median"))
+
+    plan = ScenePlan(source.shape, *grid)
+    filtering = np.empty(count)
+    processing = np.empty(count)
+    for index in range(count):
+        start = time.perf_counter()
+        depth_map, _ = source.read()
+        filtered = time.perf_counter()
+        plan.process(depth_map)
+        filtering[index] = filtered - start
+        processing[index] = time.perf_counter() - filtered
+    return filtering, processing
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Capture profile benchmark")
+    parser.add_argument("--profiles", type=lambda text: text.split(","), default=list(PROFILES),
+                        help="comma separated profiles, from %s" % ",".join(PROFILES))
+    parser.add_argument("--replay", metavar="PATH", help="recorded session directory, synthetic frames otherwise")
+    parser.add_argument("--frames", type=int, default=60, help="frames timed per profile")
+    parser.add_argument("--grid", type=lambda text: tuple(int(cells) for cells in text.lower().split("x")),
+                        default=(3, 5), help="VERxHOR cells")
+    parser.add_argument("--output", help="JSON results file")
+    args = parser.parse_args()
+
+    records = []
+    for name in args.profiles:
+        profile = PROFILES[name]
+        filtering, processing = time_profile(profile, args.frames, args.grid, args.replay)
+        total = (filtering + processing) * 1000
+        records.append({"profile": name, "resolution": "%dx%d" % (profile.width, profile.height),
+                        "fps": profile.fps, "shape": list(profile.shape()),
+                        "filter_ms": float(np.median(filtering) * 1000),
+                        "process_ms": float(np.median(processing) * 1000),
+                        "median_ms": float(np.median(total)), "p95_ms": float(np.percentile(total, 95))})
+
+    default = next((record for record in records if record["profile"] == "default"), None)
+    print("%-15s %9s %4s %9s %10s %9s %7s %8s" % ("profile", "stream", "fps", "filter_ms", "process_ms",
+                                                  "median_ms", "p95_ms", "vs_default"))
+    for record in records:
+        ratio = record["median_ms"] / default["median_ms"] if default else float("nan")
+        print("%-15s %9s %4d %9.3f %10.3f %9.3f %7.3f %7.2fx" % (
+            record["profile"], record["resolution"], record["fps"], record["filter_ms"], record["process_ms"],
+            record["median_ms"], record["p95_ms"], ratio))
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump({"frames": args.frames, "grid": list(args.grid), "results": records}, file, indent=1)
+
+
+if __name__ == "__main__":
+    main()
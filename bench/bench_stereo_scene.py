@@ -0,0 +1,182 @@
+"""
+Times every StereoScene stage and the whole per-frame pipeline over depth map resolutions and grid sizes.
+
+    python bench/bench_stereo_scene.py --output bench_results.json
+    python bench/bench_stereo_scene.py --replay session/ --baseline bench_results.json
+
+Results are written as JSON, one record per (source, resolution, grid, stage). With --baseline the run
+exits with status 1 when a stage median is slower than the baseline by more than the tolerance.
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+
+import cv2
+import numpy as np
+
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+from stereo_scene import StereoScene, ScenePlan, GridAggregator
+from frame_source import SyntheticSource, load_session
+from powermap import Powermap
+
+RESOLUTIONS = ((240, 424), (480, 640), (480, 848), (720, 1280))  # HEIGHT, WIDTH
+GRIDS = ((1, 4), (2, 4), (3, 5), (4, 4), (4, 8), (8, 8))  # VER_CELLS, HOR_CELLS
+STAGES = ("scene_reduce", "get_cells", "get_points", "powermap", "template_match", "render", "frame", "plan",
+          "grid", "powermap_table")
+
+
+def synthetic_frames(shape, count):
+    source = SyntheticSource(*shape)
+    return [source.read() for _ in range(count)]
+
+
+def recorded_frames(path, shape, count):
+    """
+    Recorded frames resized to shape, so recordings compare against synthetic frames at every resolution.
+    """
+    session = load_session(path)
+    frames = []
+    for index in range(min(count, len(session["depth"]))):
+        depth_map = cv2.resize(np.array(session["depth"][index]), (shape[1], shape[0]),
+                               interpolation=cv2.INTER_NEAREST)
+        color_map = None
+        if session["color"] is not None:
+            color_map = cv2.resize(np.array(session["color"][index]), (shape[1], shape[0]))
+        frames.append((depth_map, color_map))
+    return frames
+
+
+def time_stages(frames, ver_cells, hor_cells, stages):
+    """
+    :return: ({str: [float]}) per frame seconds of each stage
+    """
+    times = {stage: [] for stage in stages}
+    plan = ScenePlan(frames[0][0].shape, ver_cells, hor_cells)
+    grid = GridAggregator(frames[0][0].shape, ver_cells, hor_cells)
+    powermap = Powermap(ver_cells * hor_cells)
+    for depth_map, color_map in frames:
+        if color_map is None:
+            color_map = np.zeros(depth_map.shape + (3,), np.uint8)
+        scene = StereoScene(depth_map, color_map, ver_cells, hor_cells)
+
+        start = time.perf_counter()
+        scene.scene_reduce()
+        reduced = time.perf_counter()
+        scene.get_cells()
+        celled = time.perf_counter()
+        scene.get_points()
+        pointed = time.perf_counter()
+        [scene.powermap(point) for point in scene.points]
+        mapped = time.perf_counter()
+
+        for stage, seconds in (("scene_reduce", reduced - start), ("get_cells", celled - reduced),
+                               ("get_points", pointed - celled), ("powermap", mapped - pointed),
+                               ("frame", mapped - start)):
+            if stage in times:
+                times[stage].append(seconds)
+
+        if "template_match" in times:
+            start = time.perf_counter()
+            scene.template_match(0.1, 1e9, 250)
+            times["template_match"].append(time.perf_counter() - start)
+        if "plan" in times:
+            start = time.perf_counter()
+            plan.process(depth_map)
+            times["plan"].append(time.perf_counter() - start)
+        if "grid" in times:
+            start = time.perf_counter()
+            grid.get_points(depth_map)
+            times["grid"].append(time.perf_counter() - start)
+        if "powermap_table" in times:
+            start = time.perf_counter()
+            powermap.map(scene.points)
+            times["powermap_table"].append(time.perf_counter() - start)
+        if "render" in times:
+            start = time.perf_counter()
+            scene.render()
+            times["render"].append(time.perf_counter() - start)
+    return times
+
+
+def summarize(source, shape, grid, times):
+    records = []
+    for stage, seconds in times.items():
+        milliseconds = np.array(seconds) * 1000
+        records.append({
+            "source": source,
+            "resolution": "%dx%d" % (shape[1], shape[0]),
+            "grid": "%dx%d" % grid,
+            "stage": stage,
+            "frames": len(milliseconds),
+            "median_ms": float(np.median(milliseconds)),
+            "p95_ms": float(np.percentile(milliseconds, 95)),
+            "min_ms": float(milliseconds.min()),
+        })
+    return records
+
+
+def compare(records, baseline, tolerance):
+    """
+    :return: ([str]) stages slower than baseline median by more than tolerance
+    """
+    key = lambda record: (record["source"], record["resolution"], record["grid"], record["stage"])
+    reference = {key(record): record for record in baseline["results"]}
+    regressions = []
+    for record in records:
+        base = reference.get(key(record))
+        if base is not None and record["median_ms"] > base["median_ms"] * (1 + tolerance):
+            regressions.append("%s %s %s %s: %.3f ms, baseline %.3f ms" % (
+                key(record) + (record["median_ms"], base["median_ms"])))
+    return regressions
+
+
+def parse_size(text):
+    first, second = text.lower().split("x")
+    return int(first), int(second)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="StereoScene stage benchmark")
+    parser.add_argument("--resolutions", type=lambda text: [parse_size(size)[::-1] for size in text.split(",")],
+                        default=RESOLUTIONS, help="comma separated WIDTHxHEIGHT list")
+    parser.add_argument("--grids", type=lambda text: [parse_size(size) for size in text.split(",")],
+                        default=GRIDS, help="comma separated VERxHOR cell list")
+    parser.add_argument("--stages", type=lambda text: text.split(","), default=STAGES,
+                        help="comma separated stages, from %s" % ",".join(STAGES))
+    parser.add_argument("--frames", type=int, default=30, help="frames timed per configuration")
+    parser.add_argument("--replay", metavar="PATH", help="also time recorded session frames")
+    parser.add_argument("--output", default="bench_results.json", help="JSON results file")
+    parser.add_argument("--baseline", help="JSON results to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed slowdown over baseline median")
+    args = parser.parse_args()
+
+    records = []
+    for shape in args.resolutions:
+        sources = [("synthetic", synthetic_frames(shape, args.frames))]
+        if args.replay:
+            sources.append(("replay", recorded_frames(args.replay, shape, args.frames)))
+        for source, frames in sources:
+            for grid in args.grids:
+                records.extend(summarize(source, shape, grid, time_stages(frames, *grid, args.stages)))
+                print("%-9s %9s %4s  %s" % (source, records[-1]["resolution"], records[-1]["grid"],
+                      "  ".join("%s %.2f ms" % (record["stage"], record["median_ms"])
+                                for record in records[-len(args.stages):])))
+
+    with open(args.output, "w") as file:
+        json.dump({"platform": platform.platform(), "python": platform.python_version(),
+                   "numpy": np.__version__, "opencv": cv2.__version__, "results": records}, file, indent=1)
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            regressions = compare(records, json.load(file), args.tolerance)
+        for regression in regressions:
+            print("REGRESSION " + regression)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,814 @@
+import json
+import os
+import queue
+import threading
+import time
+import zlib
+
+import cv2
+import numpy as np
+
+SESSION_META = "meta.json"
+SESSION_DEPTH = "depth.u16"
+SESSION_TIMESTAMPS = "timestamps.f64"
+SESSION_COLOR = "color.u8"
+SESSION_COMPRESSED = "depth.z"
+SESSION_INDEX = "depth.idx"  # uint64 offset, length of every compressed frame
+COMPRESSIONS = ("none", "zlib", "delta")
+META_INTERVAL = 300  # frames between session metadata updates while recording
+
+FRAME_SOURCES = ("camera", "replay", "synthetic", "stereo")
+
+
+class CaptureProfile:
+    """
+    Depth stream resolution and rate with the post-processing chain applied to it: decimation, then
+    edge preserving spatial smoothing, then temporal smoothing, the RealSense recommended order.
+    """
+
+    def __init__(self, width, height, fps, decimation=1, spatial=False, temporal=False):
+        """
+        :param width: (int) depth stream width
+        :param height: (int) depth stream height
+        :param fps: (int) stream rate
+        :param decimation: (int > 0) depth map shrink factor, RealSense supports 1 to 8
+        :param spatial: (bool) spatial smoothing filter
+        :param temporal: (bool) temporal smoothing filter
+        """
+        if decimation <= 0:
+            raise ValueError("Decimation must be greater than 0")
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.decimation = decimation
+        self.spatial = spatial
+        self.temporal = temporal
+
+    def shape(self):
+        """
+        :return: ((int, int)) HEIGHT, WIDTH of processed depth maps
+        """
+        return self.height // self.decimation, self.width // self.decimation
+
+
+PROFILES = {
+    "default": CaptureProfile(640, 480, 30),
+    "fast": CaptureProfile(424, 240, 90),  # lowest latency between frames
+    "decimated": CaptureProfile(640, 480, 30, decimation=2),  # full field of view, a quarter of the pixels
+    "filtered": CaptureProfile(640, 480, 30, spatial=True, temporal=True),  # fewer holes and less flicker
+    "fast_decimated": CaptureProfile(848, 480, 90, decimation=2),
+}
+
+
+class FrameSource:
+    """
+    Base frame source. read() returns (depth_map, color_map), a uint16 millimetre depth map and a BGR
+    color map or None. Sources raise StopIteration once no frames are left.
+    """
+
+    shape = (0, 0)  # HEIGHT, WIDTH of depth maps
+
+    def read(self):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class RealSenseSource(FrameSource):
+    """
+    Live RealSense D400/L500 camera.
+    """
+
+    def __init__(self, width=640, height=480, fps=30, serial=None, color=True, profile=None):
+        """
+        :param width: (int) depth stream width
+        :param height: (int) depth stream height
+        :param fps: (int) stream rate
+        :param serial: (str) serial number of the camera to open, any connected camera by default
+        :param color: (bool) stream color too, depth only saves USB bandwidth and a frame conversion
+        :param profile: (CaptureProfile) stream and on-device post-processing, replaces width, height and fps
+        """
+        import pyrealsense2 as rs
+
+        if profile is not None:
+            width, height, fps = profile.width, profile.height, profile.fps
+
+        # Configure depth and color streams
+        self.pipeline = rs.pipeline()
+        config = rs.config()
+        if serial is not None:
+            config.enable_device(serial)
+
+        # Get device product line for setting a supporting resolution
+        pipeline_wrapper = rs.pipeline_wrapper(self.pipeline)
+        pipeline_profile = config.resolve(pipeline_wrapper)
+        device = pipeline_profile.get_device()
+        device_product_line = str(device.get_info(rs.camera_info.product_line))
+
+        config.enable_stream(rs.stream.depth, width, height, rs.format.z16, fps)
+
+        self.color = color
+        if color:
+            color_size = (960, 540) if device_product_line == "L500" else (width, height)
+            config.enable_stream(rs.stream.color, *color_size, rs.format.bgr8, fps)
+
+        # post-processing runs in librealsense, off the GIL
+        self.filters = []
+        self.decimation = 1 if profile is None else profile.decimation
+        if profile is not None:
+            if profile.decimation > 1:
+                decimation = rs.decimation_filter()
+                decimation.set_option(rs.option.filter_magnitude, profile.decimation)
+                self.filters.append(decimation)
+            if profile.spatial:
+                self.filters.append(rs.spatial_filter())
+            if profile.temporal:
+                self.filters.append(rs.temporal_filter())
+
+        # Start streaming
+        self.pipeline.start(config)
+        self.shape = (height, width) if profile is None else profile.shape()
+
+    def read(self):
+        # Wait for a coherent pair of frames: depth and color
+        frames = self.pipeline.wait_for_frames()
+        depth_frame = frames.get_depth_frame()
+        for depth_filter in self.filters:
+            depth_frame = depth_filter.process(depth_frame)
+
+        # Convert images to numpy arrays
+        depth_map = np.asanyarray(depth_frame.get_data())
+        color_map = None
+        if self.color:
+            color_map = np.asanyarray(frames.get_color_frame().get_data())
+            if self.decimation > 1:
+                # strided like the decimated depth map, as ProfileSource does, so both cover the same pixels
+                factor = self.decimation
+                color_map = color_map[:depth_map.shape[0] * factor:factor, :depth_map.shape[1] * factor:factor]
+        return depth_map, color_map
+
+    def close(self):
+        self.pipeline.stop()
+
+
+class ReplaySource(FrameSource):
+    """
+    Replays a recorded session, depth frames are memory-mapped and paged in as they are read.
+    Frames are read-only views of the recording.
+    """
+
+    def __init__(self, path, realtime=True, loop=False):
+        """
+        :param path: (str) session directory
+        :param realtime: (bool) replay at the recorded pace, False replays as fast as possible
+        :param loop: (bool) start over after the last frame
+        """
+        self.session = load_session(path)
+        self.depth = self.session["depth"]
+        self.color = self.session["color"]
+        self.timestamps = self.session["timestamps"]
+        self.shape = self.depth.shape[1:]
+        self.realtime = realtime
+        self.loop = loop
+        self.index = 0
+        self.start = None
+
+    def read(self):
+        if self.index == len(self.depth):
+            if not self.loop or len(self.depth) == 0:
+                raise StopIteration
+            self.index = 0
+            self.start = None
+
+        # hold each frame until its recorded offset from the first frame
+        if self.realtime:
+            now = time.monotonic()
+            if self.start is None:
+                self.start = now - (self.timestamps[self.index] - self.timestamps[0])
+            delay = self.start + (self.timestamps[self.index] - self.timestamps[0]) - now
+            if delay > 0:
+                time.sleep(delay)
+
+        depth_map = self.depth[self.index]
+        color_map = None if self.color is None else self.color[self.index]
+        if color_map is not None and color_map.shape[:2] != self.shape:
+            # recorded downsampled, scaled back so color stays aligned with depth
+            color_map = cv2.resize(np.asarray(color_map), (self.shape[1], self.shape[0]),
+                                   interpolation=cv2.INTER_NEAREST)
+        self.index += 1
+        return depth_map, color_map
+
+
+class SyntheticSource(FrameSource):
+    """
+    Generated scenes: a floor receding towards a back wall and an obstacle moving through the view,
+    with sensor noise and depth shadows.
+    """
+
+    def __init__(self, height=480, width=640, fps=None, seed=0, color=True):
+        """
+        :param height: (int) depth map height
+        :param width: (int) depth map width
+        :param fps: (float) frame rate to pace reads at, None generates as fast as possible
+        :param seed: (int) random seed, equal seeds generate equal scenes
+        :param color: (bool) generate a color map with each depth map
+        """
+        self.shape = (height, width)
+        self.fps = fps
+        self.color = color
+        self.rng = np.random.default_rng(seed)
+        self.index = 0
+        self.last = None
+
+        # static background, floor closes in from 6 m at the horizon to 1.5 m at the bottom row
+        rows = np.linspace(0, 1, height)[:, None]
+        horizon = height // 3
+        self.background = np.full((height, width), 6000, np.float64)
+        self.background[horizon:] = 6000 - 4500 * (rows[horizon:] - rows[horizon]) / (1 - rows[horizon])
+
+    def read(self):
+        if self.fps:
+            now = time.monotonic()
+            if self.last is not None and self.last + 1 / self.fps > now:
+                time.sleep(self.last + 1 / self.fps - now)
+            self.last = time.monotonic()
+
+        height, width = self.shape
+        depth = self.background.copy()
+
+        # obstacle sweeping across the view while approaching and receding between 0.3 and 3 m
+        phase = self.index / 90
+        distance = 1650 + 1350 * np.cos(2 * np.pi * phase)
+        size = int(min(height, width) * 300 / distance) + 1
+        top = max(0, (height - size) // 2)
+        left = int((width - size) * (0.5 + 0.5 * np.sin(2 * np.pi * phase / 2)))
+        depth[top:top + size, left:left + size] = distance
+
+        # sensor noise and depth shadows
+        depth *= 1 + self.rng.normal(0, 0.01, depth.shape)
+        depth[self.rng.random(depth.shape) < 0.02] = 0
+        depth_map = depth.clip(0, 65535).astype(np.uint16)
+
+        color_map = None
+        if self.color:
+            color_map = np.repeat((255 - depth_map // 40).clip(0, 255).astype(np.uint8)[:, :, None], 3, axis=2)
+        self.index += 1
+        return depth_map, color_map
+
+
+class StereoSource(FrameSource):
+    """
+    Passive stereo pair, two cameras or a still image pair, turned into depth maps by a disparity engine.
+    The color map is the left image.
+    """
+
+    def __init__(self, left, right, engine, rectifier=None, fps=None):
+        """
+        :param left: (int or str) left camera index, video or image path
+        :param right: (int or str) right camera index, video or image path
+        :param engine: (callable) builds the disparity engine for the image shape,
+                       e.g. functools.partial(DisparityEngine, focal_length=700, baseline=60)
+        :param rectifier: (callable) optional, builds the rectifier for the image shape,
+                          e.g. functools.partial(Rectifier.load, "calibration.npz")
+        :param fps: (float) frame rate to pace still pairs at, None reads as fast as possible
+        """
+        self.fps = fps
+        self.last = None
+        self.captures = None
+        self.still = None
+        if isinstance(left, str) and isinstance(right, str):
+            self.still = cv2.imread(left), cv2.imread(right)
+        if self.still is None or self.still[0] is None or self.still[1] is None:
+            self.still = None
+            self.captures = cv2.VideoCapture(left), cv2.VideoCapture(right)
+            if not all(capture.isOpened() for capture in self.captures):
+                self.close()
+                raise ValueError("Stereo inputs %s and %s could not be opened" % (left, right))
+
+        left_image, right_image = self.grab()
+        if left_image.shape != right_image.shape:
+            self.close()
+            raise ValueError("Stereo images differ in shape: %s, %s" % (left_image.shape, right_image.shape))
+        self.shape = left_image.shape[:2]
+        self.left = np.empty(self.shape, np.uint8)
+        self.right = np.empty(self.shape, np.uint8)
+        self.pending = (left_image, right_image)  # first pair is returned by the first read
+
+        self.rectifier = None if rectifier is None else rectifier(self.shape)
+        self.engine = engine(self.shape)
+        if self.rectifier is not None:
+            self.engine.calibrate(self.rectifier.focal_length, self.rectifier.baseline)
+
+    def grab(self):
+        if self.still is not None:
+            return self.still
+        # grab both before decoding so the pair is as close in time as the cameras allow
+        if not all(capture.grab() for capture in self.captures):
+            raise StopIteration
+        images = tuple(capture.retrieve()[1] for capture in self.captures)
+        if any(image is None for image in images):
+            raise StopIteration
+        return images
+
+    def read(self):
+        if self.fps:
+            now = time.monotonic()
+            if self.last is not None and self.last + 1 / self.fps > now:
+                time.sleep(self.last + 1 / self.fps - now)
+            self.last = time.monotonic()
+
+        if self.pending is not None:
+            (left_image, right_image), self.pending = self.pending, None
+        else:
+            left_image, right_image = self.grab()
+        for image, gray in ((left_image, self.left), (right_image, self.right)):
+            if image.ndim == 2:
+                np.copyto(gray, image)
+            else:
+                cv2.cvtColor(image, cv2.COLOR_BGR2GRAY, dst=gray)
+
+        left, right = self.left, self.right
+        if self.rectifier is not None:
+            left, right = self.rectifier.rectify(left, right)
+        return self.engine.depth_map(left, right), left_image
+
+    def close(self):
+        if self.captures is not None:
+            for capture in self.captures:
+                capture.release()
+        if getattr(self, "engine", None) is not None:
+            self.engine.close()
+
+
+class ProfileSource(FrameSource):
+    """
+    Software approximation of the RealSense post-processing chain of a profile, so replayed, synthetic and
+    stereo frames can be compared with camera profiles. Frames are resized to the profile resolution,
+    then decimated, spatially smoothed with a 5x5 median and temporally smoothed with an average that
+    restarts wherever depth changes by more than delta. Color maps keep every decimated block's top left pixel.
+    Decimation pools with the given function at every factor, while the RealSense filter averages
+    blocks of 4x4 and larger, so median pooling only matches the camera for factors 2 and 3.
+    """
+
+    def __init__(self, source, profile, decimate=None, alpha=0.4, delta=20):
+        """
+        :param source: (FrameSource) undecimated frames
+        :param profile: (CaptureProfile) resolution and filters
+        :param decimate: (callable) decimate(depth_map, factor, out=out) pooling, needed when the profile
+                         decimates, e.g. functools.partial(stereo_scene.decimate, method="median")
+        :param alpha: (float 0-1) temporal weight of the newest frame, the RealSense default
+        :param delta: (int) millimetres of change that restart temporal averaging, the RealSense default
+        """
+        if profile.decimation > 1 and decimate is None:
+            raise ValueError("Profile decimation needs a decimate function")
+        self.source = source
+        self.profile = profile
+        self.decimate = decimate
+        self.alpha = alpha
+        self.delta = delta
+        self.shape = profile.shape()
+        self.resized = np.empty((profile.height, profile.width), np.uint16)
+        self.depth = np.empty(self.shape, np.uint16)
+        self.previous = None
+        self.smooth = np.empty(self.shape, np.float32)
+        self.change = np.empty(self.shape, np.float32)
+
+    def read(self):
+        depth_map, color_map = self.source.read()
+        if np.shape(depth_map) != self.resized.shape:
+            cv2.resize(np.asarray(depth_map), (self.profile.width, self.profile.height), dst=self.resized,
+                       interpolation=cv2.INTER_NEAREST)
+            depth_map = self.resized
+            if color_map is not None:
+                color_map = cv2.resize(np.asarray(color_map), (self.profile.width, self.profile.height))
+
+        factor = self.profile.decimation
+        if factor > 1:
+            depth_map = self.decimate(depth_map, factor, out=self.depth)
+            if color_map is not None:
+                color_map = color_map[:self.shape[0] * factor:factor, :self.shape[1] * factor:factor]
+        else:
+            np.copyto(self.depth, depth_map)
+        depth_map = self.depth
+
+        if self.profile.spatial:
+            cv2.medianBlur(depth_map, 5, dst=depth_map)
+        if self.profile.temporal:
+            self.filter_temporal(depth_map)
+        return depth_map, color_map
+
+    def filter_temporal(self, depth_map):
+        """
+        Averages depth_map in place with the previous output where both are valid and within delta.
+        """
+        if self.previous is None:
+            self.previous = depth_map.astype(np.float32)
+            return
+        np.subtract(depth_map, self.previous, out=self.change, dtype=np.float32)
+        np.multiply(self.change, self.alpha, out=self.smooth)
+        self.smooth += self.previous
+        # restart where the scene moved or either frame is a depth shadow
+        restart = (np.abs(self.change) > self.delta) | (depth_map == 0) | (self.previous == 0)
+        np.copyto(self.smooth, depth_map, where=restart)
+        np.copyto(self.previous, self.smooth)
+        np.rint(self.smooth, out=self.smooth)
+        np.copyto(depth_map, self.smooth, casting="unsafe")
+
+    def close(self):
+        self.source.close()
+
+
+class FrameRing:
+    """
+    Preallocated frame buffers handed out from a free list. Frames are copied out of the source into a free
+    slot, which stays taken until its last consumer releases it, so a slow stage never sees its frame
+    overwritten. Frames are dropped while every slot is taken.
+    """
+
+    def __init__(self, shape, size=5, dtype=np.uint16):
+        """
+        :param shape: ((int, int)) depth map HEIGHT, WIDTH
+        :param size: (int > 0) slots, frames beyond it held by the pipeline at once are dropped
+        :param dtype: (numpy dtype) depth map type
+        """
+        if size <= 0:
+            raise ValueError("Ring size must be greater than 0")
+        self.depth = np.zeros((size,) + tuple(shape), dtype)
+        self.color = None  # allocated with the first color frame
+        self.free = queue.SimpleQueue()
+        for slot in range(size):
+            self.free.put(slot)
+        self.dropped = 0
+
+    def store(self, depth_map, color_map=None):
+        """
+        :param depth_map: (2D array) depth map of the ring shape
+        :param color_map: (3D array) color map, None skips the copy
+        :return: ((int, 2D array, 3D array)) slot and its copies, color None when not given,
+                 None when every slot is taken
+        """
+        try:
+            slot = self.free.get_nowait()
+        except queue.Empty:
+            self.dropped += 1
+            return None
+        np.copyto(self.depth[slot], depth_map)
+        if color_map is None:
+            return slot, self.depth[slot], None
+        if self.color is None or self.color.shape[1:] != np.shape(color_map):
+            self.color = np.zeros((len(self.depth),) + np.shape(color_map), np.uint8)
+        np.copyto(self.color[slot], color_map)
+        return slot, self.depth[slot], self.color[slot]
+
+    def release(self, slot):
+        """
+        Returns a slot once its frame is no longer used.
+        :param slot: (int) slot from store
+        """
+        self.free.put(slot)
+
+
+class FrameEncoder:
+    """
+    Compresses depth frames for a session. "delta" stores every frame but keyframes as its wrapping uint16
+    difference to the previous frame, mostly zeros for a still scene, before zlib.
+    """
+
+    def __init__(self, compression="zlib", keyframe=30, level=1):
+        """
+        :param compression: (str) "zlib" or "delta"
+        :param keyframe: (int > 0) frames between delta keyframes, the most frames decoded to seek
+        :param level: (int 0-9) zlib level, 1 keeps up with the camera on one core
+        """
+        if compression not in COMPRESSIONS[1:]:
+            raise ValueError("Compression must be one of %s" % (COMPRESSIONS[1:],))
+        if keyframe <= 0:
+            raise ValueError("Keyframe interval must be greater than 0")
+        self.compression = compression
+        self.keyframe = keyframe
+        self.level = level
+        self.count = 0
+        self.previous = None
+        self.difference = None
+
+    def encode(self, depth_map):
+        """
+        :param depth_map: (2D uint16 array) depth map
+        :return: (bytes) compressed frame
+        """
+        data = depth_map
+        if self.compression == "delta":
+            if self.previous is None:
+                self.previous = np.empty_like(depth_map)
+                self.difference = np.empty_like(depth_map)
+            if self.count % self.keyframe:
+                data = np.subtract(depth_map, self.previous, out=self.difference)
+            np.copyto(self.previous, depth_map)
+        self.count += 1
+        # zlib releases the GIL while compressing
+        return zlib.compress(np.ascontiguousarray(data), self.level)
+
+
+class CompressedFrames:
+    """
+    Compressed session depth frames, decompressed on access from a memory-mapped file. Indexing with an
+    int returns one frame, with a slice a FRAMES, HEIGHT, WIDTH array. The last frame is kept so
+    sequential delta reads decode one frame each.
+    """
+
+    def __init__(self, path, frames, shape, compression, keyframe):
+        """
+        :param path: (str) session directory
+        :param frames: (int) frames recorded
+        :param shape: ((int, int)) HEIGHT, WIDTH
+        :param compression: (str) "zlib" or "delta"
+        :param keyframe: (int) frames between delta keyframes
+        """
+        self.shape = (frames,) + tuple(shape)
+        self.dtype = np.dtype(np.uint16)
+        self.compression = compression
+        self.keyframe = keyframe
+        self.index = np.fromfile(os.path.join(path, SESSION_INDEX), np.uint64, count=frames * 2).reshape(-1, 2)
+        self.data = None
+        if frames and os.path.getsize(os.path.join(path, SESSION_COMPRESSED)):
+            self.data = np.memmap(os.path.join(path, SESSION_COMPRESSED), np.uint8, mode="r")
+        self.last = None  # (index, frame) of the last decoded frame
+
+    def __len__(self):
+        return self.shape[0]
+
+    def decompress(self, index):
+        offset, length = (int(value) for value in self.index[index])
+        data = zlib.decompress(self.data[offset:offset + length])
+        return np.frombuffer(data, np.uint16).reshape(self.shape[1:])
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            frames = [self[frame] for frame in range(*index.indices(len(self)))]
+            return np.array(frames).reshape((len(frames),) + self.shape[1:])
+        index = range(len(self))[index]
+        if self.compression != "delta":
+            return self.decompress(index)
+
+        # decode forward from the last decoded frame when possible, otherwise from the keyframe
+        start = index - index % self.keyframe
+        if self.last is not None and start <= self.last[0] <= index:
+            start, frame = self.last[0] + 1, self.last[1].copy()
+        else:
+            frame = self.decompress(start).copy()
+            start += 1
+        for position in range(start, index + 1):
+            frame += self.decompress(position)  # wraps like the encoder's subtraction
+        self.last = index, frame
+        return frame.copy()
+
+
+class SessionRecorder:
+    """
+    Records frames into a session on a background thread. Frames are copied into a fixed pool of slots and
+    the writer thread frees them once on disk; when the disk falls behind and every slot is waiting, new
+    frames are dropped and counted, so recording never stalls the capture loop.
+    """
+
+    def __init__(self, path, shape, color=False, compression="none", color_scale=4, slots=32, keyframe=30,
+                 level=1):
+        """
+        :param path: (str) session directory, created if missing
+        :param shape: ((int, int)) depth map HEIGHT, WIDTH
+        :param color: (bool) record color maps, their shape is taken from the first frame, which must have one
+        :param compression: (str) one of COMPRESSIONS, "none" records raw uint16 frames
+        :param color_scale: (int > 0) color is recorded at every color_scale-th row and column
+        :param slots: (int > 0) frames held in memory while the writer is behind
+        :param keyframe: (int > 0) frames between delta keyframes
+        :param level: (int 0-9) zlib level
+        """
+        if compression not in COMPRESSIONS:
+            raise ValueError("Compression must be one of %s" % (COMPRESSIONS,))
+        if slots <= 0 or color_scale <= 0:
+            raise ValueError("Slots and color scale must be greater than 0")
+        self.path = path
+        self.shape = tuple(shape)
+        self.compression = compression
+        self.keyframe = keyframe
+        self.color_scale = color_scale
+        self.encoder = None if compression == "none" else FrameEncoder(compression, keyframe, level)
+
+        self.depth = np.empty((slots,) + self.shape, np.uint16)
+        self.timestamps = np.empty(slots, np.float64)
+        self.record_color = color
+        self.color = None  # color slots, allocated for the first frame's color shape
+        self.color_shape = None
+
+        self.free = queue.SimpleQueue()
+        for slot in range(slots):
+            self.free.put(slot)
+        self.pending = queue.SimpleQueue()
+        self.frames = 0
+        self.dropped = 0
+        self.error = None
+
+        os.makedirs(path, exist_ok=True)
+        self.files = {name: open(os.path.join(path, name), "wb") for name in self.file_names()}
+        self.offset = 0
+        self.write_meta()
+        self.thread = threading.Thread(target=self.run, name="recorder", daemon=True)
+        self.thread.start()
+
+    def file_names(self):
+        names = [SESSION_TIMESTAMPS]
+        names += [SESSION_DEPTH] if self.encoder is None else [SESSION_COMPRESSED, SESSION_INDEX]
+        if self.record_color:
+            names.append(SESSION_COLOR)
+        return names
+
+    def record(self, depth_map, timestamp, color_map=None, block=False):
+        """
+        Copies a frame for the writer thread.
+        :param depth_map: (2D uint16 array) depth map
+        :param timestamp: (float) seconds the frame arrived from the source, replays are paced by them
+        :param color_map: (3D array) color map, recorded downsampled when the recorder has a color shape
+        :param block: (bool) wait for a free slot instead of dropping the frame, for offline writes
+        :return: (bool) True if the frame was queued, False if it was dropped
+        """
+        try:
+            slot = self.free.get(block)
+        except queue.Empty:
+            self.dropped += 1
+            return False
+        np.copyto(self.depth[slot], depth_map)
+        self.timestamps[slot] = timestamp
+        if self.record_color and self.color is None:
+            # decided on the first frame, a session without color there records none
+            self.record_color = color_map is not None
+            if self.record_color:
+                height, width = np.shape(color_map)[:2]
+                self.color_shape = (height // self.color_scale, width // self.color_scale) + np.shape(color_map)[2:]
+                self.color = np.empty((len(self.depth),) + self.color_shape, np.uint8)
+        if self.color is not None:
+            if color_map is None:
+                self.color[slot] = 0
+            else:
+                # nearest resize picks every color_scale-th pixel, many times faster than a strided copy
+                cv2.resize(np.asarray(color_map), self.color_shape[1::-1], dst=self.color[slot],
+                           interpolation=cv2.INTER_NEAREST)
+        self.pending.put(slot)
+        return True
+
+    def run(self):
+        try:
+            while True:
+                slot = self.pending.get()
+                if slot is None:
+                    break
+                self.write(slot)
+                self.free.put(slot)
+        except Exception as error:
+            self.error = error  # later frames pile up in the slots and are dropped
+
+    def write(self, slot):
+        if self.encoder is None:
+            self.files[SESSION_DEPTH].write(self.depth[slot])
+        else:
+            data = self.encoder.encode(self.depth[slot])
+            self.files[SESSION_COMPRESSED].write(data)
+            self.files[SESSION_INDEX].write(np.array([self.offset, len(data)], np.uint64))
+            self.offset += len(data)
+        self.files[SESSION_TIMESTAMPS].write(self.timestamps[slot])
+        if self.color is not None:
+            self.files[SESSION_COLOR].write(self.color[slot])
+        self.frames += 1
+        if self.frames % META_INTERVAL == 0:
+            # a run cut short by power loss still replays up to here
+            for file in self.files.values():
+                file.flush()
+            self.write_meta()
+
+    def write_meta(self):
+        meta = {"frames": self.frames, "shape": list(self.shape), "color_shape": None,
+                "compression": self.compression, "keyframe": self.keyframe}
+        if self.color is not None:
+            meta["color_shape"] = list(self.color_shape)
+        with open(os.path.join(self.path, SESSION_META), "w") as file:
+            json.dump(meta, file)
+
+    def close(self, timeout=None):
+        """
+        Writes the queued frames and the session metadata.
+        :param timeout: (float) seconds to wait for queued frames, None waits for all of them
+        :return: None
+        """
+        self.pending.put(None)
+        self.thread.join(timeout)
+        for file in self.files.values():
+            file.close()
+        self.write_meta()
+        if self.error is not None:
+            raise RuntimeError("Recording failed after %d frames: %r" % (self.frames, self.error))
+
+
+def save_session(path, depth_frames, timestamps=None, color_frames=None, compression="none"):
+    """
+    Writes frames in the session format read by ReplaySource.
+    :param path: (str) session directory, created if missing
+    :param depth_frames: (3D array) uint16 depth maps - FRAMES, HEIGHT, WIDTH
+    :param timestamps: (1D array) capture time of each frame in seconds, 30 fps spacing if None
+    :param color_frames: (4D array) uint8 color maps - FRAMES, HEIGHT, WIDTH, 3, or None
+    :param compression: (str) one of COMPRESSIONS
+    :return: None
+    """
+    depth_frames = np.asarray(depth_frames, dtype=np.uint16)
+    if depth_frames.ndim != 3:
+        raise ValueError("Depth frames must be a 3D array")
+    if timestamps is None:
+        timestamps = np.arange(len(depth_frames)) / 30
+    timestamps = np.asarray(timestamps, dtype=np.float64)
+    if len(timestamps) != len(depth_frames):
+        raise ValueError("Expected one timestamp per frame")
+
+    if color_frames is not None:
+        color_frames = np.asarray(color_frames, dtype=np.uint8)
+    recorder = SessionRecorder(path, depth_frames.shape[1:], color_frames is not None, compression, color_scale=1,
+                               slots=1)
+    for index, depth_map in enumerate(depth_frames):
+        recorder.record(depth_map, timestamps[index], None if color_frames is None else color_frames[index],
+                        block=True)
+    recorder.close()
+
+
+def load_session(path):
+    """
+    Memory-maps a recorded session.
+    :param path: (str) session directory
+    :return: ({str: array}) "depth", "timestamps" and "color" (None when not recorded) arrays, compressed
+             depth frames are a CompressedFrames decoding frames on access
+    """
+    with open(os.path.join(path, SESSION_META)) as file:
+        meta = json.load(file)
+    frames = meta["frames"]
+
+    def open_map(name, dtype, shape):
+        if frames == 0:
+            return np.zeros((0,) + tuple(shape), dtype)
+        return np.memmap(os.path.join(path, name), dtype=dtype, mode="r", shape=(frames,) + tuple(shape))
+
+    compression = meta.get("compression", "none")
+    if compression == "none":
+        depth = open_map(SESSION_DEPTH, np.uint16, meta["shape"])
+    else:
+        depth = CompressedFrames(path, frames, meta["shape"], compression, meta["keyframe"])
+    session = {
+        "depth": depth,
+        "timestamps": open_map(SESSION_TIMESTAMPS, np.float64, ()),
+        "color": None,
+    }
+    if meta["color_shape"] is not None:
+        session["color"] = open_map(SESSION_COLOR, np.uint8, meta["color_shape"])
+    return session
+
+
+def open_source(name, path=None, realtime=True, height=480, width=640, fps=30, stereo=None, engine=None,
+                rectifier=None, serial=None, seed=0, color=True, profile=None, decimate=None):
+    """
+    :param name: (str) "camera", "replay", "synthetic" or "stereo"
+    :param path: (str) session directory for replay
+    :param realtime: (bool) pace replayed and synthetic frames at their frame rate
+    :param height: (int) depth map height for camera and synthetic sources
+    :param width: (int) depth map width for camera and synthetic sources
+    :param fps: (int) camera and synthetic frame rate
+    :param stereo: ((int or str, int or str)) left and right inputs of the stereo source
+    :param engine: (callable) builds the stereo source disparity engine for the image shape
+    :param rectifier: (callable) optional, builds the stereo source rectifier for the image shape
+    :param serial: (str) camera serial number when several cameras are connected
+    :param seed: (int) synthetic scene seed, so several synthetic cameras see different scenes
+    :param color: (bool) camera and synthetic sources produce color maps, False for depth only
+    :param profile: (CaptureProfile) camera stream and post-processing, other sources get the software
+                    equivalent from ProfileSource, replaces height, width and fps
+    :param decimate: (callable) ProfileSource decimation for profiles that decimate
+    :return: (FrameSource)
+    """
+    if profile is not None:
+        if name == "camera":
+            return RealSenseSource(serial=serial, color=color, profile=profile)
+        source = open_source(name, path, realtime, profile.height, profile.width, profile.fps, stereo, engine,
+                             rectifier, serial, seed, color)
+        return ProfileSource(source, profile, decimate)
+    if name == "camera":
+        return RealSenseSource(width, height, fps, serial, color)
+    if name == "replay":
+        if path is None:
+            raise ValueError("Replay source needs a session path")
+        return ReplaySource(path, realtime)
+    if name == "synthetic":
+        return SyntheticSource(height, width, fps if realtime else None, seed, color)
+    if name == "stereo":
+        if stereo is None or engine is None:
+            raise ValueError("Stereo source needs a left and right input and a disparity engine")
+        return StereoSource(stereo[0], stereo[1], engine, rectifier, fps if realtime else None)
+    raise ValueError("Unknown frame source %s" % name)
@@ -0,0 +1,241 @@
+import threading
+import time
+
+import numpy as np
+
+PCA9685_CHANNELS = 16
+LED0_ON_L = 0x06  # first channel register, each channel has ON_L, ON_H, OFF_L, OFF_H
+MODE1_AI = 0x20  # MODE1 register auto-increment bit
+FULL_ON = 0x1000  # bit 12 of ON/OFF counts forces the output fully on/off
+
+
+def duty_registers(duties):
+    """
+    Converts 16 bit duty cycles into PCA9685 channel registers, the same counts adafruit_pca9685 writes.
+    :param duties: (1D array) duty cycles 0-65535
+    :return: (bytes) ON_L, ON_H, OFF_L, OFF_H per channel
+    """
+    duties = np.asarray(duties, dtype=np.int64)
+    full_on = duties == 0xFFFF
+    counts = np.empty((len(duties), 2), dtype="<u2")  # ON, OFF
+    counts[:, 0] = np.where(full_on, FULL_ON, 0)
+    counts[:, 1] = np.where(full_on, 0, np.where(duties < 0x0010, FULL_ON, duties >> 4))
+    return counts.tobytes()
+
+
+class PCA9685Bus:
+    """
+    Writes register blocks to a PCA9685 in one I2C transaction each.
+    """
+
+    def __init__(self, pca):
+        """
+        :param pca: (adafruit_pca9685.PCA9685) initialized board
+        """
+        self.device = pca.i2c_device
+        # block writes need auto-increment, adafruit sets it with the frequency but check anyway
+        mode = pca.mode1_reg
+        if not mode & MODE1_AI:
+            pca.mode1_reg = mode | MODE1_AI
+
+    def write(self, register, data):
+        """
+        :param register: (int) first register address
+        :param data: (bytes) register values written from the first register on
+        :return: None
+        """
+        with self.device as i2c:
+            i2c.write(bytes([register]) + data)
+
+
+class FakeI2C:
+    """
+    In-memory PCA9685 register file that counts I2C transactions and bytes, to measure writes without hardware.
+    """
+
+    def __init__(self):
+        self.registers = bytearray(256)
+        self.transactions = 0
+        self.bytes = 0
+
+    def write(self, register, data):
+        """
+        :param register: (int) first register address
+        :param data: (bytes) register values written from the first register on
+        :return: None
+        """
+        self.transactions += 1
+        self.bytes += 1 + len(data)  # register address + data
+        self.registers[register:register + len(data)] = data
+
+    def counts(self, channel):
+        """
+        :param channel: (int) PCA9685 channel
+        :return: ((int, int)) ON, OFF counts held for the channel
+        """
+        start = LED0_ON_L + 4 * channel
+        on, off = np.frombuffer(self.registers, dtype="<u2", count=2, offset=start)
+        return int(on), int(off)
+
+
+class HapticOutput:
+    """
+    Motor output layer over a PCA9685 bus. Keeps the last duty cycle of each channel and writes
+    only the changed channels, as one auto-increment block from the first to the last change.
+    A failed write keeps the last written duty cycles, so the next update retries the whole changed span.
+    """
+
+    def __init__(self, bus, channels, stats=None):
+        """
+        :param bus: (PCA9685Bus or FakeI2C) register writer
+        :param channels: (int) motors, connected to channels 0 through channels - 1
+        :param stats: (Instrumentation) counts failed writes as "i2c_errors", None keeps no record
+        """
+        if channels <= 0 or channels > PCA9685_CHANNELS:
+            raise ValueError("Channels must be between 1 and %d" % PCA9685_CHANNELS)
+        self.bus = bus
+        self.stats = stats
+        self.duty = np.full(channels, -1, dtype=np.int64)  # unknown until first write
+        self.errors = 0  # failed writes
+        self.failures = 0  # failed writes since the last successful one
+        self.error = None  # last write error
+
+    def update(self, duties):
+        """
+        :param duties: (1D array) duty cycle 0-65535 per channel
+        :return: (int) channels changed, 0 when the write failed
+        """
+        duties = np.asarray(duties, dtype=np.int64)
+        if duties.shape != self.duty.shape:
+            raise ValueError("Expected %d duty cycles" % len(self.duty))
+
+        changed = np.flatnonzero(duties != self.duty)
+        if len(changed) == 0:
+            return 0
+        first, last = changed[0], changed[-1] + 1
+        try:
+            self.bus.write(LED0_ON_L + 4 * first, duty_registers(duties[first:last]))
+        except OSError as error:
+            # transient I2C glitches must not stop the frame loop, the duty cycles stay as they were
+            self.errors += 1
+            self.failures += 1
+            self.error = error
+            if self.stats is not None:
+                self.stats.add("i2c_errors")
+            return 0
+        self.failures = 0
+        self.duty[first:last] = duties[first:last]
+        return len(changed)
+
+    def stop(self):
+        """
+        Turns every motor off.
+        :return: None
+        """
+        self.update(np.zeros(len(self.duty)))
+
+
+class HapticScheduler(threading.Thread):
+    """
+    Drives a HapticOutput at a fixed rate, ramping every channel towards the latest target duty cycles with a
+    bounded slew rate. Targets are double buffered: the writer fills the back buffer and publishes it by
+    swapping one index, so neither side takes a lock. Frames only move the targets, a processing hiccup
+    leaves the motors ramping instead of frozen mid step.
+    """
+
+    def __init__(self, output, rate=100, slew=650000, stale=None, stats=None, clock=time.perf_counter,
+                 max_failures=50, on_error=None):
+        """
+        :param output: (HapticOutput) motor output written every tick
+        :param rate: (float > 0) ticks per second, e.g. the PCA9685 PWM frequency
+        :param slew: (float) largest duty cycle change per second, None jumps straight to the target. A step
+                     reaches the motors up to step / slew seconds after set_target, on top of frame latency
+        :param stale: (float) seconds without a new target after which motors ramp off, None holds the target
+        :param stats: (Instrumentation) records tick jitter as "haptic_jitter", None keeps no record
+        :param clock: (callable) monotonic seconds
+        :param max_failures: (int > 0) failed writes in a row after which the scheduler gives up
+        :param on_error: (callable) called with the error when the scheduler gives up, e.g. Runtime.fail,
+                         None raises it in the scheduler thread
+        """
+        if rate <= 0:
+            raise ValueError("Haptic rate must be greater than 0")
+        super().__init__(name="haptics", daemon=True)
+        self.output = output
+        self.period = 1 / rate
+        self.step = np.inf if slew is None else slew * self.period
+        self.stale = stale
+        self.stats = stats
+        self.clock = clock
+        self.max_failures = max_failures
+        self.on_error = on_error
+        self.stopped = threading.Event()
+
+        channels = len(output.duty)
+        self.targets = np.zeros((2, channels), np.int64)
+        self.front = 0  # published buffer, swapped by set_target only
+        self.published = clock()
+        self.duty = np.zeros(channels, np.float64)  # ramped duty cycles, fractional between ticks
+        self.delta = np.empty(channels, np.float64)
+        self.ticks = 0
+        self.late = 0  # ticks skipped because a tick overran its period
+
+    def set_target(self, duties):
+        """
+        Publishes the duty cycles the motors ramp towards, called from one writer thread.
+        :param duties: (1D array) duty cycle 0-65535 per channel
+        :return: None
+        """
+        back = 1 - self.front
+        np.copyto(self.targets[back], duties)
+        # a single attribute store, the ticking thread reads either the old or the new complete buffer,
+        # unless the writer publishes twice within one tick's read of a few microseconds
+        self.front = back
+        self.published = self.clock()
+
+    def tick(self):
+        """
+        Moves every channel at most one slew step towards its target and writes changed channels.
+        :return: (int) channels changed
+        """
+        target = self.targets[self.front]
+        if self.stale is not None and self.clock() - self.published > self.stale:
+            target = 0
+        np.subtract(target, self.duty, out=self.delta)
+        np.clip(self.delta, -self.step, self.step, out=self.delta)
+        self.duty += self.delta
+        self.ticks += 1
+        return self.output.update(np.round(self.duty))
+
+    def run(self):
+        deadline = self.clock()
+        while not self.stopped.is_set():
+            now = self.clock()
+            if self.stats is not None and self.ticks:
+                self.stats.record("haptic_jitter", now - deadline)  # lateness against the fixed schedule
+            self.tick()
+            # failed writes are counted by the output and retried next tick, only a dead bus stops the motors
+            if self.output.failures >= self.max_failures:
+                error = RuntimeError("%d motor writes failed in a row" % self.output.failures)
+                error.__cause__ = self.output.error
+                if self.on_error is None:
+                    raise error
+                self.on_error(error)
+                return
+            deadline += self.period
+            now = self.clock()
+            if now - deadline > self.period:
+                # overran by whole periods, skip them instead of ticking in a burst to catch up
+                skipped = int((now - deadline) / self.period)
+                self.late += skipped
+                deadline += skipped * self.period
+            self.stopped.wait(max(deadline - now, 0))
+
+    def stop(self, timeout=1.0):
+        """
+        Stops ticking, motors keep their last duty cycles until the output is stopped.
+        :param timeout: (float) seconds to wait for the thread
+        :return: None
+        """
+        self.stopped.set()
+        if self.is_alive():
+            self.join(timeout)
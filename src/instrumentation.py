@@ -0,0 +1,198 @@
+import csv
+import json
+import os
+import threading
+import time
+import tracemalloc
+
+import numpy as np
+
+PERCENTILES = (50, 95, 99)
+
+
+class LatencyRing:
+    """
+    Fixed memory ring of the latest latency samples of one stage, recorded from one thread.
+    """
+
+    def __init__(self, size=1024):
+        """
+        :param size: (int > 0) samples kept, older samples are overwritten
+        """
+        if size <= 0:
+            raise ValueError("Ring size must be greater than 0")
+        self.samples = np.zeros(size, np.float64)
+        self.count = 0  # samples recorded, including overwritten ones
+        self.peak = 0.0  # session maximum
+
+    def record(self, seconds):
+        self.samples[self.count % len(self.samples)] = seconds
+        self.count += 1
+        if seconds > self.peak:
+            self.peak = seconds
+
+    def window(self):
+        """
+        :return: (1D array) samples currently held
+        """
+        return self.samples[:min(self.count, len(self.samples))]
+
+
+class StageTimer:
+    """
+    Context manager recording the monotonic time spent in a block.
+    """
+
+    __slots__ = ("ring", "start")
+
+    def __init__(self, ring):
+        self.ring = ring
+        self.start = 0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.ring.record(time.perf_counter() - self.start)
+
+
+class Instrumentation:
+    """
+    Per-stage latency tracking with p50/p95/p99/max summaries, exported periodically to a CSV or JSON lines log.
+    """
+
+    def __init__(self, size=1024, path=None, interval=10.0):
+        """
+        :param size: (int > 0) samples kept per stage
+        :param path: (str) log file, ".csv" writes CSV rows and any other extension JSON lines, None disables
+        :param interval: (float) seconds between log exports
+        """
+        self.size = size
+        self.path = path
+        self.interval = interval
+        self.rings = {}
+        self.counters = {}  # running totals, e.g. cells skipped by change detection
+        self.lock = threading.Lock()
+        self.started = time.monotonic()
+        self.exported = self.started
+
+    def ring(self, stage):
+        ring = self.rings.get(stage)
+        if ring is None:
+            with self.lock:
+                ring = self.rings.setdefault(stage, LatencyRing(self.size))
+        return ring
+
+    def time(self, stage):
+        """
+        :param stage: (str) stage name
+        :return: (StageTimer) context manager recording the block into the stage
+        """
+        return StageTimer(self.ring(stage))
+
+    def record(self, stage, seconds):
+        """
+        :param stage: (str) stage name
+        :param seconds: (float) latency sample
+        :return: None
+        """
+        self.ring(stage).record(seconds)
+
+    def add(self, counter, value=1):
+        """
+        :param counter: (str) counter name
+        :param value: (int) amount added to the running total
+        :return: None
+        """
+        # counters are shared between stage threads, e.g. frames dropped by every camera
+        with self.lock:
+            self.counters[counter] = self.counters.get(counter, 0) + value
+
+    def count(self, stage):
+        """
+        :return: (int) samples recorded for the stage
+        """
+        ring = self.rings.get(stage)
+        return 0 if ring is None else ring.count
+
+    def summary(self):
+        """
+        :return: ({str: {str: float}}) per stage sample count and p50/p95/p99/max latency in milliseconds
+        """
+        summary = {}
+        for stage, ring in list(self.rings.items()):
+            window = ring.window()
+            if len(window) == 0:
+                continue
+            p50, p95, p99 = np.percentile(window, PERCENTILES) * 1000
+            summary[stage] = {"count": ring.count, "p50_ms": p50, "p95_ms": p95, "p99_ms": p99,
+                              "max_ms": ring.peak * 1000}
+        return summary
+
+    def export(self):
+        """
+        Appends the current summary to the log.
+        :return: None
+        """
+        if self.path is None:
+            return
+        elapsed = round(time.monotonic() - self.started, 3)
+        summary = self.summary()
+        if self.path.endswith(".csv"):
+            new_file = not os.path.exists(self.path)
+            with open(self.path, "a", newline="") as file:
+                writer = csv.writer(file)
+                if new_file:
+                    writer.writerow(["elapsed_s", "stage", "count", "p50_ms", "p95_ms", "p99_ms", "max_ms"])
+                for stage, stats in summary.items():
+                    writer.writerow([elapsed, stage, stats["count"]] +
+                                    ["%.3f" % stats[key] for key in ("p50_ms", "p95_ms", "p99_ms", "max_ms")])
+                for counter, total in list(self.counters.items()):
+                    writer.writerow([elapsed, counter, total, "", "", "", ""])
+        else:
+            with open(self.path, "a") as file:
+                file.write(json.dumps({"elapsed_s": elapsed, "stages": summary,
+                                       "counters": dict(self.counters)}) + "\n")
+
+    def tick(self):
+        """
+        Exports the summary when the export interval has passed, cheap to call every frame.
+        :return: None
+        """
+        now = time.monotonic()
+        if now - self.exported >= self.interval:
+            self.exported = now
+            self.export()
+
+
+class AllocationGuard:
+    """
+    Debug check that a block allocates no large memory, traced with tracemalloc. Temporaries freed inside
+    the block count too, since the traced peak is compared. Tracing is process wide, so only guard blocks
+    while no other thread allocates.
+    """
+
+    def __init__(self, limit=128 * 1024, warmup=1):
+        """
+        :param limit: (int) bytes a guarded block may allocate at its peak, NumPy keeps up to 64 KiB of
+                      scratch buffers for casting and strided operations
+        :param warmup: (int) first guarded blocks that are not checked, e.g. first frame buffer setup
+        """
+        self.limit = limit
+        self.warmup = warmup
+        self.blocks = 0
+        self.before = 0
+
+    def __enter__(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        self.before = tracemalloc.get_traced_memory()[0]
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        peak = tracemalloc.get_traced_memory()[1] - self.before
+        self.blocks += 1
+        if exc_type is None and self.blocks > self.warmup and peak > self.limit:
+            raise AssertionError("Guarded block allocated %d bytes, limit is %d" % (peak, self.limit))
@@ -1,127 +1,447 @@
-from stereo_scene import StereoScene
+from stereo_scene import StereoScene, ScenePlan, GridAggregator, DECIMATIONS, decimate
+from runtime import Runtime
+from haptics import FakeI2C, HapticOutput, HapticScheduler, PCA9685Bus
+from frame_source import open_source, FrameRing, SessionRecorder, COMPRESSIONS, FRAME_SOURCES, PROFILES
+from instrumentation import AllocationGuard, Instrumentation
+from terminal import StatusRenderer
+from temporal import BandHysteresis, EmaFilter, FilterChain, MedianFilter
+from stereo_depth import DisparityEngine, Rectifier, STEREO_MATCHERS
+from reducers import CellReduction, named_reducer
+from multicam import MultiCamera
+from powermap import Powermap, response_curve, CURVES, STEPPED_EDGES
 
 import sys
 sys.path.insert(1, '/home/sdmay24-27/librealsense/release')
-import pyrealsense2 as rs
 
 import numpy as np
 import cv2
 
+import argparse
+import contextlib
+import functools
+import signal
 import time
 import math
-import os
 
-import board
-import busio
-import adafruit_pca9685
 
-from adafruit_pca9685 import PCA9685
+def parse_args():
+    parser = argparse.ArgumentParser(description="Depth camera to haptic feedback")
+    parser.add_argument("--source", choices=FRAME_SOURCES, default="camera",
+                        help="frame source, replay and synthetic run without a camera")
+    parser.add_argument("--replay", metavar="PATH", help="recorded session directory for the replay source")
+    parser.add_argument("--fast", action="store_true",
+                        help="replay and generate frames as fast as possible instead of at the frame rate")
+    parser.add_argument("--stereo", nargs=2, metavar=("LEFT", "RIGHT"),
+                        help="stereo source camera indexes, videos or still images")
+    parser.add_argument("--calibration", metavar="PATH", help="stereo calibration .npz, rectifies the pairs")
+    parser.add_argument("--focal-length", type=float, default=700,
+                        help="stereo focal length in pixels when there is no calibration")
+    parser.add_argument("--baseline", type=float, default=60,
+                        help="stereo camera distance in millimetres when there is no calibration")
+    parser.add_argument("--matcher", choices=STEREO_MATCHERS, default="bm", help="stereo disparity matcher")
+    parser.add_argument("--cameras", type=int, default=1,
+                        help="cameras processed in their own worker processes and merged into one motor map")
+    parser.add_argument("--serials", nargs="+", metavar="SERIAL",
+                        help="serial numbers of the cameras to open, one camera per serial")
+    parser.add_argument("--profile", choices=PROFILES,
+                        help="named camera resolution, rate and post-processing, replaces --width, --height and "
+                             "--fps, replayed and generated frames get the same processing in software")
+    parser.add_argument("--width", type=int, default=640, help="depth map width")
+    parser.add_argument("--height", type=int, default=480, help="depth map height")
+    parser.add_argument("--fps", type=int, default=30, help="camera and synthetic frame rate")
+    parser.add_argument("--record", metavar="PATH",
+                        help="record depth frames to a session directory on a background thread, replayable "
+                             "with --source replay")
+    parser.add_argument("--record-compression", choices=COMPRESSIONS, default="none",
+                        help="recorded depth compression, delta stores frame to frame changes before zlib")
+    parser.add_argument("--record-color", type=int, default=0, metavar="SCALE",
+                        help="also record color at every SCALE-th row and column, 0 records depth only")
+    parser.add_argument("--visualize", action="store_true",
+                        help="show the color map with cell points, enables the color stream")
+    parser.add_argument("--fake-haptics", action="store_true", help="write motors to an in-memory PCA9685")
+    parser.add_argument("--stats-log", metavar="PATH", help="per-stage latency log, .csv or JSON lines")
+    parser.add_argument("--status-rate", type=float, default=10, help="terminal status redraws per second")
+    parser.add_argument("--headless", action="store_true", help="no terminal status output")
+    parser.add_argument("--stats-interval", type=float, default=10.0, help="seconds between latency log exports")
+    parser.add_argument("--ema", type=float, metavar="ALPHA",
+                        help="smooth cell points with a moving average, weight of the newest frame in (0, 1]")
+    parser.add_argument("--median", type=int, metavar="FRAMES", help="median of cell points over the last frames")
+    parser.add_argument("--hysteresis", type=int, metavar="MM",
+                        help="millimetres a cell point must pass a motor band edge by to change intensity, "
+                             "stepped curves only")
+    parser.add_argument("--change-threshold", type=float, metavar="MM",
+                        help="recompute only cells whose decimated mean changed by more than this")
+    parser.add_argument("--refresh", type=int, default=30,
+                        help="frames between full recomputes when change detection is on")
+    parser.add_argument("--decimate", type=int, choices=(1, 2, 4, 8), default=1,
+                        help="shrink depth maps by this factor before cells are processed")
+    parser.add_argument("--decimate-method", choices=DECIMATIONS, default="min",
+                        help="pooling of decimated blocks, min keeps the closest non shadow depth")
+    parser.add_argument("--statistic", metavar="NAME",
+                        help="cell statistic driving the motors instead of the closest 5%% mean: closest, mean, "
+                             "mode, trimmed, min or p<percentile> such as p10")
+    parser.add_argument("--full-frame", action="store_true",
+                        help="cover the whole depth map with uneven cells instead of cropping to an even grid")
+    parser.add_argument("--curve", default="stepped",
+                        help="depth to motor intensity curve, one of %s or a JSON curve file" % ", ".join(CURVES))
+    parser.add_argument("--curve-range", nargs=2, type=int, metavar=("NEAR", "FAR"),
+                        help="millimetres of full intensity and of silence for the linear and log curves")
+    parser.add_argument("--gains", nargs="+", type=float, metavar="GAIN",
+                        help="intensity scale of every motor, e.g. for motors of different strength")
+    parser.add_argument("--haptic-rate", type=float, default=100,
+                        help="motor updates per second, independent of the frame rate, 0 updates once per frame. "
+                             "Ramping delays the motors after the reported latency, see --slew")
+    parser.add_argument("--slew", type=float, default=650000,
+                        help="largest motor duty cycle change per second when ramping between frames, a full "
+                             "off to on step takes 65000 / SLEW seconds more than the reported latency, "
+                             "100 ms by default")
+    parser.add_argument("--debug-alloc", action="store_true",
+                        help="run stages in one thread and fail on large allocations in the frame path")
+    args = parser.parse_args()
+    if args.full_frame and (args.change_threshold is not None or args.decimate > 1):
+        parser.error("--full-frame does not support --change-threshold or --decimate")
+    if args.statistic is not None and (args.full_frame or args.change_threshold is not None):
+        parser.error("--statistic does not support --full-frame or --change-threshold")
+    if args.serials:
+        args.cameras = len(args.serials)
+    if args.cameras < 1:
+        parser.error("--cameras must be at least 1")
+    if args.cameras > 1 and args.source not in ("camera", "synthetic"):
+        parser.error("several cameras need the camera or synthetic source")
+    if args.cameras > 1 and (args.full_frame or args.statistic is not None or args.change_threshold is not None
+                             or args.debug_alloc):
+        parser.error("several cameras do not support --full-frame, --statistic, --change-threshold "
+                     "or --debug-alloc")
+    if args.visualize and args.cameras > 1:
+        # merged points have no single color map to draw on, so color would be streamed for nothing
+        parser.error("--visualize supports one camera")
+    if args.record and args.cameras > 1:
+        parser.error("--record supports one camera")
+    if args.curve_range is not None and args.curve not in ("linear", "log"):
+        parser.error("--curve-range needs the linear or log curve")
+    if args.hysteresis is not None and args.curve in ("linear", "log"):
+        parser.error("--hysteresis needs a stepped curve, the linear and log curves have no bands")
+    return args
 
 
-def config():
-    # Configure depth and color streams
-    pipeline = rs.pipeline()
-    config = rs.config()
+def config(args):
+    # stereo pairs are matched in bands on every core, tables are built once for the image shape
+    stereo = None
+    if args.stereo:
+        stereo = tuple(int(name) if name.isdigit() else name for name in args.stereo)  # digits are cameras
+    engine = functools.partial(DisparityEngine, focal_length=args.focal_length, baseline=args.baseline,
+                               matcher=args.matcher)
+    rectifier = functools.partial(Rectifier.load, args.calibration) if args.calibration else None
+    # one source per camera, synthetic cameras each get their own scene
+    # color is streamed only when visualized, depth only saves USB bandwidth and a conversion every frame
+    serials = args.serials or [None] * args.cameras
+    # profiles decimate in software with the median of every block, an approximation of the RealSense filter,
+    # which medians 2x2 and 3x3 blocks but averages blocks of 4x4 and larger
+    profile = PROFILES[args.profile] if args.profile else None
+    software_decimate = functools.partial(decimate, method="median")
+    sources = [open_source(args.source, args.replay, not args.fast, args.height, args.width, args.fps,
+                           stereo, engine, rectifier, serial, seed=camera, color=VISUALIZE or args.record_color > 0,
+                           profile=profile,
+                           decimate=software_decimate)
+               for camera, serial in enumerate(serials)]
 
-    # Get device product line for setting a supporting resolution
-    pipeline_wrapper = rs.pipeline_wrapper(pipeline)
-    pipeline_profile = config.resolve(pipeline_wrapper)
-    device = pipeline_profile.get_device()
-    device_product_line = str(device.get_info(rs.camera_info.product_line))
+    if args.fake_haptics:
+        return sources, None, HapticOutput(FakeI2C(), VER_CELLS * HOR_CELLS, STATS)
 
-    config.enable_stream(rs.stream.depth, 640, 480, rs.format.z16, 30)
+    import board
+    import busio
+    import adafruit_pca9685
 
-    if device_product_line == "L500":
-        config.enable_stream(rs.stream.color, 960, 540, rs.format.bgr8, 30)
-    else:
-        config.enable_stream(rs.stream.color, 640, 480, rs.format.bgr8, 30)
-
-    # Start streaming
-    pipeline.start(config)
+    from adafruit_pca9685 import PCA9685
 
     # Initialize the PCA9685 using the default address (0x40)
     i2c = busio.I2C(board.SCL, board.SDA)
     hat = adafruit_pca9685.PCA9685(i2c)
     pwm = PCA9685(i2c)
     pwm.frequency = 100  # in Hertz
+
+    # motor writes go out only for changed channels, as one block transaction
+    output = HapticOutput(PCA9685Bus(pwm), VER_CELLS * HOR_CELLS, STATS)
  
-    return pipeline, pwm
+    return sources, pwm, output
+
+
+def powermap(args):
+    # the curve is a table over every depth, built once so tuning never touches the frame loop
+    channels = VER_CELLS * HOR_CELLS
+    if args.curve in CURVES:
+        params = {}
+        if args.curve_range is not None:
+            params = dict(zip(("near", "far"), args.curve_range))
+        edges = STEPPED_EDGES if args.curve == "stepped" else None
+        return Powermap(channels, response_curve(args.curve, **params), args.gains, edges)
+    return Powermap.load(args.curve, channels, args.gains)
+
+
+def point_filter(args, edges):
+    # median first so single frame outliers never reach the average, hysteresis last on the smoothed points
+    filters = []
+    cells = VER_CELLS * HOR_CELLS
+    if args.median is not None:
+        filters.append(MedianFilter(cells, args.median))
+    if args.ema is not None:
+        filters.append(EmaFilter(cells, args.ema))
+    if args.hysteresis is not None:
+        filters.append(BandHysteresis(cells, edges, args.hysteresis))
+    return FilterChain(filters) if filters else None
+
+
+def capture(source):
+    with STATS.time("capture"):
+        depth_map, color_map = source.read()
+        # latency and recorded timestamps start when the frame arrives, not while waiting for the camera
+        captured = time.perf_counter()
+
+        # frames as the camera saw them and when they arrived, so replays keep the camera's spacing,
+        # copied for the recorder thread or dropped when the disk is behind
+        if RECORDER is not None and not RECORDER.record(depth_map, captured, color_map):
+            STATS.add("record_dropped")
 
+        with ALLOC_GUARD:
+            # copy out of the source into a free ring slot, color only when it is visualized
+            stored = RING.store(depth_map, color_map if VISUALIZE else None)
+            if stored is None:
+                # every slot is still held by a later stage
+                STATS.add("dropped_frames")
+                return None
+            slot, depth_map, color_map = stored
 
-def capture(pipeline):
-    # Wait for a coherent pair of frames: depth and color
-    frames = pipeline.wait_for_frames()
-    depth_frame = frames.get_depth_frame()
-    color_frame = frames.get_color_frame()
+            # Set depth upperbound
+            threshold = 9999 # ~10 meters
+            np.minimum(depth_map, threshold, out=depth_map)
 
-    # Convert images to numpy arrays
-    depth_map = np.asanyarray(depth_frame.get_data())
-    color_map = np.asanyarray(color_frame.get_data())
+    return captured, slot, depth_map, color_map
 
-    # Set depth upperbound
-    threshold = 9999 # ~10 meters
-    depth_map[depth_map > threshold] = threshold
+
+def submit(camera, source, cameras):
+    # a ring per camera, rings are recorded from one thread each
+    with STATS.time("capture%d" % camera):
+        depth_map, _ = source.read()
+    captured = time.perf_counter()
+    # copied straight into the camera's shared memory ring, dropped while its worker is behind
+    if not cameras.submit(camera, depth_map, captured):
+        STATS.add("dropped_frames")
+
+
+def merge(cameras):
+    with STATS.time("merge"):
+        frame = cameras.collect()
+    if frame is None:
+        return None
+    captured, points = frame
+
+    # merged points are a new vector, filters see the same motor map as with one camera
+    if FILTER is not None:
+        with STATS.time("filter"):
+            points = FILTER.update(points)
+    return captured, None, points, None
+
+
+def process(frame):
+    captured, slot, depth_map, color_map = frame
 
     #depth_map = np.fliplr(depth_map)  # flip on y axis
-    scene = StereoScene(depth_map, color_map, VER_CELLS, HOR_CELLS) # create scene
+    # process points through the plan built once for this resolution and grid
+    with ALLOC_GUARD:
+        if GRID is not None:
+            # no border pixels cropped
+            with STATS.time("get_points"):
+                points = GRID.get_points(depth_map)
+        elif PLAN.change_threshold is not None:
+            # unchanged cells keep their cached point
+            with STATS.time("update"):
+                points = PLAN.update(depth_map)
+            STATS.add("cells", len(points))
+            STATS.add("skipped_cells", PLAN.skipped)
+        else:
+            with STATS.time("scene_reduce"):
+                reduced = PLAN.scene_reduce(depth_map)
+            with STATS.time("get_cells"):
+                cells = PLAN.get_cells(reduced)
+            with STATS.time("get_points"):
+                if REDUCTION is None:
+                    points = PLAN.get_points(cells)
+                else:
+                    # field trial statistic, the plan's cell buffer is reordered in place
+                    statistic = REDUCTION.compute(cells, overwrite=True)[REDUCTION.reducers[0].name]
+                    points = np.round(statistic).astype(np.int64)
+
+    # temporal filtering returns a new vector, so the plan buffer is never shared with the actuate stage
+    if FILTER is not None:
+        with STATS.time("filter"):
+            points = FILTER.update(points)
 
-    # process points
-    scene.scene_reduce()
-    scene.get_cells()
-    scene.get_points()
+    # full scene only for visualization
+    scene = None
+    if VISUALIZE:
+        with STATS.time("scene"):
+            scene = StereoScene(depth_map, color_map, VER_CELLS, HOR_CELLS) # create scene
+            scene.scene_reduce()
+            scene.get_cells()
+            scene.points = points
+    else:
+        # points never share the depth map, so its slot is free once processed
+        RING.release(slot)
+        slot = None
 
-    return scene
+    return captured, slot, points, scene
 
 
-def haptic(scene, pwm):
-    for index in range(VER_CELLS * HOR_CELLS):
-        try:
-            pwm.channels[index].duty_cycle = scene.powermap(scene.points[index])
-        except:
-            continue
+def haptic(points, output):
+    with STATS.time("pwm"):
+        if SCHEDULER is not None:
+            # the scheduler thread ramps the motors towards the new duty cycles at its own rate
+            SCHEDULER.set_target(POWERMAP.map(points))
+        else:
+            output.update(POWERMAP.map(points))
 
 
-def stattrack(visualize, scene):
-    if visualize:
-        scene.visualize()
+def actuate(frame, output):
+    captured, _, points, scene = frame
+    haptic(points, output)
+    STATS.record("latency", time.perf_counter() - captured)  # capture to motor update
+    stattrack(scene, points)
+    STATS.tick()
+    release(frame)
 
-    try:
-        STATS[0] = round(1 / (time.time() - START_TIME), 1)
-    except:
-        STATS[0] = 60
-    STATS[1] += STATS[0]
-    STATS[2] += 1
 
-    os.system("clear")
-    scene.print_meter_map()
-    print("------ %3.1f fps ----- %3.1f average fps ------" % (STATS[0], STATS[1] / STATS[2]))
+def release(frame):
+    # a frame still holding a ring slot is done, either actuated or dropped between stages
+    slot = frame[1]
+    if slot is not None:
+        RING.release(slot)
 
 
-def cleanup(pipeline, pwm):
-    pipeline.stop()
-    
+def stattrack(scene, points):
+    global LAST_FRAME
+    with STATS.time("display"):
+        if scene is not None:
+            scene.visualize()
+
+        # frames leave the pipeline once per actuation, time between them is the pipeline rate
+        now = time.perf_counter()
+        fps = 0 if LAST_FRAME is None else 1 / max(now - LAST_FRAME, 1e-6)
+        if LAST_FRAME is not None:
+            STATS.record("frame", now - LAST_FRAME)
+        LAST_FRAME = now
+
+        STATUS.render(points, fps, STATS.count("frame") / max(now - START_TIME, 1e-6))
+
+
+def cleanup(sources, cameras, pwm, output, runtime):
+    # ignore repeated Ctrl+C so shutdown always reaches the motors
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    # stop stages first so no frame reaches the motors after they are zeroed
+    runtime.stop()
+    if SCHEDULER is not None:
+        SCHEDULER.stop()
+    if cameras is not None:
+        cameras.close()
+    for source in sources:
+        source.close()
+
     # stop motors
-    for index in range(VER_CELLS * HOR_CELLS):
-        try:
-            pwm.channels[index].duty_cycle = 0
-        except:
-            continue
-    pwm.deinit()
+    output.stop()
+    if pwm is not None:
+        pwm.deinit()
+
+    # queued frames are written once the motors are off, stats are exported even if writing failed
+    try:
+        if RECORDER is not None:
+            RECORDER.close()
+            STATS.add("recorded", RECORDER.frames)
+    finally:
+        STATS.export()
+        STATUS.close()
 
 
 if __name__ == "__main__":
     VER_CELLS = 3
     HOR_CELLS = 5
-    
-    # current fps, total fps, total frames
-    STATS = [0, 0, 0]
 
-    pipeline, pwm = config()
+    args = parse_args()
+    VISUALIZE = args.visualize
+
+    # curve and point filters are set up before any camera or motor is opened
+    POWERMAP = powermap(args)
+    if args.hysteresis is not None and POWERMAP.edges is None:
+        # a JSON linear or log curve, named ones are rejected by parse_args
+        sys.exit("main.py: error: --hysteresis needs a stepped curve, %s has no bands" % args.curve)
+    FILTER = point_filter(args, POWERMAP.edges)  # hysteresis holds the bands of the active curve
+
+    # per-stage latency percentiles, exported to the stats log during the run
+    STATS = Instrumentation(path=args.stats_log, interval=args.stats_interval)
+    START_TIME = time.perf_counter()
+    LAST_FRAME = None
+
+    # in place terminal display, redrawn at its own rate
+    STATUS = StatusRenderer(VER_CELLS, HOR_CELLS, args.status_rate, args.headless)
+    sources, pwm, output = config(args)
+    source = sources[0]
+
+    # crop, cell layout and buffers are fixed for the run
+    PLAN = ScenePlan(source.shape, VER_CELLS, HOR_CELLS, change_threshold=args.change_threshold,
+                     refresh=args.refresh, decimation=args.decimate, decimation_method=args.decimate_method)
+    GRID = GridAggregator(source.shape, VER_CELLS, HOR_CELLS) if args.full_frame else None
+    REDUCTION = CellReduction([named_reducer(args.statistic)]) if args.statistic else None
+
+    # recording copies frames into its own slots, a writer thread compresses and writes them
+    RECORDER = None
+    if args.record:
+        RECORDER = SessionRecorder(args.record, source.shape, args.record_color > 0, args.record_compression,
+                                   max(args.record_color, 1))
+
+    # frame buffers for every frame in flight: one per stage and one per queue, frames are dropped beyond that
+    QUEUE_SIZE = 1
+    RING = FrameRing(source.shape, size=3 + 2 * QUEUE_SIZE)
+
+    # debug mode fails the run on allocations of half a frame or more after the first frames
+    ALLOC_GUARD = contextlib.nullcontext()
+    if args.debug_alloc:
+        ALLOC_GUARD = AllocationGuard(limit=RING.depth[0].nbytes // 2, warmup=4)
+
+    # every camera is processed by its own plan in a worker process, workers start before any stage thread
+    CAMERAS = None
+    if len(sources) > 1:
+        plan = functools.partial(ScenePlan, ver_cells=VER_CELLS, hor_cells=HOR_CELLS, decimation=args.decimate,
+                                 decimation_method=args.decimate_method)
+        CAMERAS = MultiCamera([camera.shape for camera in sources], plan, VER_CELLS * HOR_CELLS,
+                              depth_limit=9999)
+        CAMERAS.start()
+
+    # motors ramp at a fixed rate between frames, so intensity never steps or freezes with frame hiccups
+    runtime = Runtime(queue_size=QUEUE_SIZE, on_drop=release)
+    SCHEDULER = None
+    if args.haptic_rate > 0:
+        SCHEDULER = HapticScheduler(output, args.haptic_rate, args.slew, stats=STATS,
+                                    on_error=functools.partial(runtime.fail, "haptics"))
+        SCHEDULER.start()
+
+    if CAMERAS is not None:
+        # one capture thread per camera feeds its worker, the merger feeds the motors
+        for camera, camera_source in enumerate(sources):
+            runtime.add_stage("capture%d" % camera, functools.partial(submit, camera, camera_source, CAMERAS),
+                              source=True)
+        runtime.add_stage("merge", functools.partial(merge, CAMERAS), source=True)
+        runtime.add_stage("actuate", lambda frame: actuate(frame, output))
+    elif args.debug_alloc:
+        # allocation tracing is process wide, so stages run one after another on one thread
+        runtime.add_stage("frame", lambda: actuate(process(capture(source)), output))
+    else:
+        # capture, process and actuate overlap on their own threads, stale frames are dropped between them
+        runtime.add_stage("capture", lambda: capture(source))
+        runtime.add_stage("process", process)
+        runtime.add_stage("actuate", lambda frame: actuate(frame, output))
     try:
-        while True:
-            START_TIME = time.time()
-            scene = capture(pipeline)
-            haptic(scene, pwm)
-            stattrack(False, scene)
+        runtime.start()
+        runtime.wait()
     except KeyboardInterrupt:
-        cleanup(pipeline, pwm)
\ No newline at end of file
+        pass
+    finally:
+        cleanup(sources, CAMERAS, pwm, output, runtime)
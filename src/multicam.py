@@ -0,0 +1,200 @@
+import multiprocessing
+import queue
+from multiprocessing import shared_memory
+
+import numpy as np
+
+FAR_POINT = 65535  # merged point of motors no camera has reported, beyond every powermap band
+
+
+def ring_views(buffer, shape, ring_size, cells, dtype):
+    """
+    :return: ((3D array, 2D int64 array)) SLOTS, HEIGHT, WIDTH frames and SLOTS, CELLS points in one buffer
+    """
+    frames = np.ndarray((ring_size,) + tuple(shape), dtype, buffer=buffer)
+    points = np.ndarray((ring_size, cells), np.int64, buffer=buffer, offset=frames.nbytes)
+    return frames, points
+
+
+def camera_worker(camera, name, shape, ring_size, cells, dtype, plan, depth_limit, ready, done):
+    """
+    Worker process loop: processes every frame slot announced on ready into the slot's points and
+    announces it on done. Frames never leave shared memory, only slot numbers are queued.
+    """
+    # workers share the parent's resource tracker, so attaching here leaves unlinking to the parent
+    block = shared_memory.SharedMemory(name=name)
+    frames, points = ring_views(block.buf, shape, ring_size, cells, dtype)
+    try:
+        processor = plan(shape)
+        while True:
+            item = ready.get()
+            if item is None:
+                break
+            slot, captured = item
+            if depth_limit is not None:
+                np.minimum(frames[slot], depth_limit, out=frames[slot])
+            processor.process(frames[slot], out=points[slot])
+            done.put((camera, slot, captured))
+    except KeyboardInterrupt:
+        pass  # the parent process shuts workers down
+    finally:
+        del frames, points
+        block.close()
+
+
+class CameraWorker:
+    """
+    Parent side of one camera: a shared memory ring of frame slots and points, and the process working on it.
+    Slots are handed out and returned only in the parent process.
+    """
+
+    def __init__(self, camera, shape, plan, cells, done, ring_size=3, dtype=np.uint16, depth_limit=None,
+                 context=None):
+        """
+        :param camera: (int) camera number
+        :param shape: ((int, int)) depth map HEIGHT, WIDTH
+        :param plan: (callable) builds the frame processor for the shape in the worker, with a
+                     process(depth_map, out) method, e.g. functools.partial(ScenePlan, ver_cells=3, hor_cells=5)
+        :param cells: (int) points per frame
+        :param done: (multiprocessing.Queue) (camera, slot, captured) of processed frames
+        :param ring_size: (int > 0) frame slots, frames are dropped while all are in use
+        :param dtype: (numpy dtype) depth map type
+        :param depth_limit: (int) depth values are clamped to this before processing, None keeps them
+        :param context: (multiprocessing context) process start method, the default context by default
+        """
+        if ring_size <= 0:
+            raise ValueError("Ring size must be greater than 0")
+        context = multiprocessing.get_context() if context is None else context
+        self.camera = camera
+        self.shape = tuple(shape)
+        frame_bytes = ring_size * int(np.prod(self.shape)) * np.dtype(dtype).itemsize
+        self.block = shared_memory.SharedMemory(create=True, size=frame_bytes + ring_size * cells * 8)
+        self.frames, self.points = ring_views(self.block.buf, self.shape, ring_size, cells, dtype)
+
+        self.free = queue.SimpleQueue()
+        for slot in range(ring_size):
+            self.free.put(slot)
+        self.dropped = 0
+        self.ready = context.Queue()
+        self.process = context.Process(
+            target=camera_worker, name="camera%d" % camera, daemon=True,
+            args=(camera, self.block.name, self.shape, ring_size, cells, dtype, plan, depth_limit, self.ready, done))
+
+    def start(self):
+        self.process.start()
+
+    def submit(self, depth_map, captured=None):
+        """
+        Copies a frame into a free slot for the worker, or drops it when the worker is behind.
+        :param depth_map: (2D array) depth map of the camera shape
+        :param captured: (float) capture time passed through to the merged result
+        :return: (bool) True if the frame was submitted
+        """
+        try:
+            slot = self.free.get_nowait()
+        except queue.Empty:
+            self.dropped += 1
+            return False
+        np.copyto(self.frames[slot], depth_map)
+        self.ready.put((slot, captured))
+        return True
+
+    def release(self, slot):
+        self.free.put(slot)
+
+    def close(self, timeout=1.0):
+        if self.process.is_alive():
+            self.ready.put(None)
+            self.process.join(timeout)
+            if self.process.is_alive():
+                self.process.terminate()
+        del self.frames, self.points
+        self.block.close()
+        self.block.unlink()
+
+
+class MultiCamera:
+    """
+    One worker process per camera, so per camera processing scales with cores instead of sharing the GIL,
+    and a merger combining the latest points of every camera into one motor map. Cameras map their cells
+    to motor channels and every motor takes the closest point mapped to it.
+    """
+
+    def __init__(self, shapes, plan, cells, channel_maps=None, motors=None, ring_size=3, depth_limit=None,
+                 context=None):
+        """
+        :param shapes: ([(int, int)]) depth map HEIGHT, WIDTH of every camera
+        :param plan: (callable) builds a camera's frame processor for its shape, see CameraWorker
+        :param cells: (int) points per frame of every camera
+        :param channel_maps: ([1D int array]) motor channel of every cell per camera, -1 for unused cells,
+                             every camera maps cell i to motor i by default
+        :param motors: (int) motor channels, cells by default
+        :param ring_size: (int > 0) frame slots per camera
+        :param depth_limit: (int) depth values are clamped to this before processing, None keeps them
+        :param context: (multiprocessing context) process start method, the default context by default
+        """
+        context = multiprocessing.get_context() if context is None else context
+        self.motors = cells if motors is None else motors
+        if channel_maps is None:
+            channel_maps = [np.arange(cells)] * len(shapes)
+        if len(channel_maps) != len(shapes) or any(len(channels) != cells for channels in channel_maps):
+            raise ValueError("Every camera needs a motor channel for each of its %d cells" % cells)
+        self.channel_maps = [np.asarray(channels) for channels in channel_maps]
+        if any((channels >= self.motors).any() for channels in self.channel_maps):
+            raise ValueError("Motor channels must be less than %d" % self.motors)
+
+        self.done = context.Queue()
+        self.workers = [CameraWorker(camera, shape, plan, cells, self.done, ring_size, depth_limit=depth_limit,
+                                     context=context) for camera, shape in enumerate(shapes)]
+        self.latest = np.full((len(shapes), cells), FAR_POINT, np.int64)
+        self.merged = np.empty(self.motors, np.int64)
+
+    def start(self):
+        for worker in self.workers:
+            worker.start()
+
+    def submit(self, camera, depth_map, captured=None):
+        """
+        :return: (bool) True if the frame was submitted, False if it was dropped
+        """
+        return self.workers[camera].submit(depth_map, captured)
+
+    def merge(self):
+        """
+        :return: (1D int64 array) closest latest point mapped to every motor, FAR_POINT where none is mapped
+        """
+        self.merged.fill(FAR_POINT)
+        for points, channels in zip(self.latest, self.channel_maps):
+            used = channels >= 0
+            np.minimum.at(self.merged, channels[used], points[used])
+        return self.merged
+
+    def collect(self, timeout=0.1):
+        """
+        Waits for the next processed frame of any camera and merges it with the latest of the others.
+        :param timeout: (float) seconds to wait
+        :return: ((float, 1D int64 array)) capture time of the frame and a merged points copy, None on timeout
+        """
+        try:
+            camera, slot, captured = self.done.get(timeout=timeout)
+        except queue.Empty:
+            for worker in self.workers:
+                if not worker.process.is_alive():
+                    raise RuntimeError("Camera %d worker exited with code %s" % (worker.camera,
+                                                                                 worker.process.exitcode))
+            return None
+        worker = self.workers[camera]
+        np.copyto(self.latest[camera], worker.points[slot])
+        worker.release(slot)
+        return captured, self.merge().copy()
+
+    def dropped(self):
+        """
+        :return: ([int]) frames dropped per camera while its worker was behind
+        """
+        return [worker.dropped for worker in self.workers]
+
+    def close(self):
+        for worker in self.workers:
+            worker.close()
+        self.done.close()
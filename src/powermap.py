@@ -0,0 +1,132 @@
+import json
+
+import numpy as np
+
+CURVES = ("stepped", "linear", "log")
+DEPTH_RANGE = 1 << 16  # every uint16 millimetre depth
+STEPPED_EDGES = (200, 400, 600, 800, 1000)  # StereoScene.powermap bands
+STEPPED_DUTIES = (65000, 55000, 45000, 35000, 25000, 0)
+
+
+def stepped_curve(edges=STEPPED_EDGES, duties=STEPPED_DUTIES):
+    """
+    :param edges: ([int]) increasing band edges in millimetres, a depth equal to an edge is in the farther band
+    :param duties: ([int]) duty cycle of every band, one more than edges
+    :return: (1D uint16 array) duty cycle of every depth
+    """
+    if len(duties) != len(edges) + 1:
+        raise ValueError("Stepped curve needs one more duty than band edges")
+    if np.any(np.diff(edges) <= 0):
+        raise ValueError("Band edges must be increasing")
+    bands = np.searchsorted(edges, np.arange(DEPTH_RANGE), side="right")
+    return np.asarray(duties, np.uint16)[bands]
+
+
+def linear_curve(near=200, far=1000, max_duty=65000, min_duty=25000):
+    """
+    Full duty up to near, falling linearly to min_duty at far, silent from far on.
+    :param near: (int) millimetres of full duty
+    :param far: (int) millimetres from which motors are off
+    :param max_duty: (int) duty cycle up to near
+    :param min_duty: (int) duty cycle just before far
+    :return: (1D uint16 array) duty cycle of every depth
+    """
+    return ramp_curve(np.arange(DEPTH_RANGE, dtype=np.float64), near, far, max_duty, min_duty)
+
+
+def log_curve(near=200, far=1000, max_duty=65000, min_duty=25000):
+    """
+    Like linear_curve on a logarithmic depth scale, so intensity changes most at close range.
+    """
+    if near <= 0:
+        raise ValueError("Logarithmic curve needs a near distance greater than 0")
+    depth = np.log(np.maximum(np.arange(DEPTH_RANGE, dtype=np.float64), near))
+    return ramp_curve(depth, np.log(near), np.log(far), max_duty, min_duty, cutoff=far)
+
+
+def ramp_curve(scale, near, far, max_duty, min_duty, cutoff=None):
+    """
+    :param scale: (1D float array) every depth on the ramp's scale
+    :param cutoff: (int) millimetres from which motors are off, far by default
+    :return: (1D uint16 array) duty cycle of every depth
+    """
+    if not 0 <= near < far:
+        raise ValueError("Curve range must have 0 <= near < far")
+    position = np.clip((scale - near) / (far - near), 0, 1)
+    duties = np.round(max_duty + (min_duty - max_duty) * position)
+    duties[int(far if cutoff is None else cutoff):] = 0
+    return duties.astype(np.uint16)
+
+
+def response_curve(curve="stepped", **params):
+    """
+    :param curve: (str) one of CURVES
+    :param params: curve parameters, see stepped_curve, linear_curve and log_curve
+    :return: (1D uint16 array) duty cycle of every depth
+    """
+    if curve == "stepped":
+        return stepped_curve(**params)
+    if curve == "linear":
+        return linear_curve(**params)
+    if curve == "log":
+        return log_curve(**params)
+    raise ValueError("Response curve must be one of %s" % (CURVES,))
+
+
+class Powermap:
+    """
+    Depth to motor duty cycle lookup table covering every uint16 depth, so a whole point vector maps with
+    one indexing operation. Per channel gains scale the table once at build time, one table row per channel.
+    """
+
+    def __init__(self, channels, curve=None, gains=None, edges=None):
+        """
+        :param channels: (int) motor channels
+        :param curve: (1D uint16 array) duty cycle of every depth, the stepped curve by default
+        :param gains: ([float]) duty cycle scale per channel, 1 by default
+        :param edges: ([int]) band edges of a stepped curve, None for a curve without bands,
+                      STEPPED_EDGES with the default curve
+        """
+        if curve is None:
+            curve, edges = stepped_curve(), STEPPED_EDGES
+        curve = np.asarray(curve)
+        if curve.shape != (DEPTH_RANGE,):
+            raise ValueError("Response curve needs a duty cycle for each of the %d depths" % DEPTH_RANGE)
+        self.channels = channels
+        self.edges = None if edges is None else np.asarray(edges)
+        if gains is None:
+            self.table = curve.astype(np.uint16)
+        else:
+            gains = np.asarray(gains, np.float64)
+            if gains.shape != (channels,):
+                raise ValueError("Expected %d channel gains" % channels)
+            scaled = np.round(curve[None, :] * gains[:, None])
+            self.table = np.clip(scaled, 0, 0xFFFF).astype(np.uint16)
+            self.rows = np.arange(channels)
+
+    @classmethod
+    def load(cls, path, channels, gains=None):
+        """
+        :param path: (str) JSON curve, e.g. {"curve": "linear", "near": 200, "far": 2000, "gains": [...]},
+                     every other key is a response_curve parameter
+        :param channels: (int) motor channels
+        :param gains: ([float]) duty cycle scale per channel, replaces the file's gains
+        :return: (Powermap)
+        """
+        with open(path) as file:
+            params = json.load(file)
+        file_gains = params.pop("gains", None)
+        edges = None
+        if params.get("curve", "stepped") == "stepped":
+            edges = params.get("edges", STEPPED_EDGES)
+        return cls(channels, response_curve(**params), file_gains if gains is None else gains, edges)
+
+    def map(self, points):
+        """
+        :param points: (1D int array) millimetre point per channel, within the uint16 depth range
+        :return: (1D uint16 array) duty cycle per channel
+        """
+        # a plain gather, clamping first would cost several times the lookup for a handful of channels
+        if self.table.ndim == 1:
+            return self.table[points]
+        return self.table[self.rows, points]
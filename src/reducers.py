@@ -0,0 +1,253 @@
+import numpy as np
+
+
+class SharedCells:
+    """
+    Cell pixels and the intermediates reducers share, each computed at most once per frame. The partitioned
+    buffer holds every order statistic requested by the reducers of a reduction, from one partition pass.
+    """
+
+    def __init__(self, cells, kth=(), overwrite=False):
+        """
+        :param cells: (3D array) CELLS, HEIGHT, WIDTH
+        :param kth: ([int]) order statistics the partitioned buffer must hold
+        :param overwrite: (bool) partition a contiguous cells array in place instead of a copy, reorders its values
+        """
+        cells = np.asarray(cells)
+        self.pixels = cells.reshape(len(cells), -1)
+        if not (overwrite and cells.flags.c_contiguous):
+            self.pixels = self.pixels.copy()
+        self.size = self.pixels.shape[1]
+        self.kth = sorted(set(kth))
+        self.partitioned = None
+        self.histograms = {}
+        self.total = None
+
+    def order(self, k):
+        """
+        :param k: (int) order statistic, one of the requested kth
+        :return: (1D array) k-th smallest value of every cell
+        """
+        return self.partition()[:, k]
+
+    def partition(self):
+        """
+        :return: (2D array) CELLS, PIXELS partitioned around every requested kth
+        """
+        if self.partitioned is None:
+            # one kth at a time from the largest down, each on the prefix below the last, is many times faster
+            # than a multiple kth partition of short rows and leaves the same order statistics in place
+            stop = self.size
+            for k in reversed(self.kth):
+                self.pixels[:, :stop].partition(k, axis=1)
+                stop = k
+            self.partitioned = self.pixels
+        return self.partitioned
+
+    def sum(self):
+        """
+        :return: (1D float64 array) sum of every cell
+        """
+        if self.total is None:
+            self.total = self.pixels.sum(axis=1, dtype=np.float64)
+        return self.total
+
+    def histogram(self, bin_width):
+        """
+        :param bin_width: (int > 0) depth bin width
+        :return: (2D int64 array) CELLS, BINS pixel count of every depth bin
+        """
+        histogram = self.histograms.get(bin_width)
+        if histogram is None:
+            # all cells binned in one bincount by offsetting every cell's bins
+            bins = int(self.pixels.max()) // bin_width + 1
+            index = self.pixels // bin_width + (np.arange(len(self.pixels)) * bins)[:, None]
+            histogram = np.bincount(index.ravel(), minlength=len(self.pixels) * bins).reshape(len(self.pixels), bins)
+            self.histograms[bin_width] = histogram
+        return histogram
+
+
+class CellReducer:
+    """
+    Base per cell statistic plugin. Subclasses name their result field and type, declare the order statistics
+    they read from the shared partition, and reduce SharedCells into one value per cell.
+    """
+
+    dtype = np.float64
+
+    def __init__(self, name):
+        """
+        :param name: (str) result field name
+        """
+        self.name = name
+
+    def order_statistics(self, size):
+        """
+        :param size: (int) pixels per cell
+        :return: ([int]) order statistics this reducer reads
+        """
+        return ()
+
+    def reduce(self, shared):
+        """
+        :param shared: (SharedCells) cell pixels and shared intermediates
+        :return: (1D array) value per cell
+        """
+        raise NotImplementedError
+
+
+class ClosestMean(CellReducer):
+    """
+    Mean of the closest fraction of values, the StereoScene get_points statistic.
+    """
+
+    dtype = np.int64
+
+    def __init__(self, closest=0.05, name="closest"):
+        """
+        :param closest: (float 0-1) fraction of closest cell values averaged
+        """
+        super().__init__(name)
+        self.closest = closest
+
+    def count(self, size):
+        return max(1, round(size * self.closest))
+
+    def order_statistics(self, size):
+        return (self.count(size) - 1,)
+
+    def reduce(self, shared):
+        count = self.count(shared.size)
+        return np.round(shared.partition()[:, :count].mean(axis=1)).astype(np.int64)
+
+
+class Percentile(CellReducer):
+    """
+    Percentile of every cell, the lower value where it falls between two. 0 is the minimum.
+    """
+
+    def __init__(self, q, name=None):
+        """
+        :param q: (float 0-100) percentile
+        """
+        super().__init__("p%g" % q if name is None else name)
+        self.q = q
+
+    def order_statistics(self, size):
+        return (int((size - 1) * self.q / 100),)
+
+    def reduce(self, shared):
+        return shared.order(self.order_statistics(shared.size)[0]).astype(np.float64)
+
+
+class TrimmedMean(CellReducer):
+    """
+    Mean of every cell without its closest and farthest fractions.
+    """
+
+    def __init__(self, low=0.1, high=0.1, name="trimmed"):
+        """
+        :param low: (float 0-1) closest fraction dropped
+        :param high: (float 0-1) farthest fraction dropped
+        """
+        if low + high >= 1:
+            raise ValueError("Trimmed fractions must leave values to average")
+        super().__init__(name)
+        self.low = low
+        self.high = high
+
+    def bounds(self, size):
+        start = int(size * self.low)
+        return start, max(size - int(size * self.high), start + 1)
+
+    def order_statistics(self, size):
+        start, stop = self.bounds(size)
+        return start, stop - 1
+
+    def reduce(self, shared):
+        start, stop = self.bounds(shared.size)
+        return shared.partition()[:, start:stop].mean(axis=1)
+
+
+class HistogramMode(CellReducer):
+    """
+    Center of the most populated depth bin of every cell, the dominant surface distance.
+    """
+
+    def __init__(self, bin_width=50, name="mode"):
+        """
+        :param bin_width: (int > 0) depth bin width
+        """
+        if bin_width <= 0:
+            raise ValueError("Bin width must be greater than 0")
+        super().__init__(name)
+        self.bin_width = bin_width
+
+    def reduce(self, shared):
+        return np.argmax(shared.histogram(self.bin_width), axis=1) * self.bin_width + self.bin_width / 2
+
+
+class Mean(CellReducer):
+    """
+    Mean of every cell.
+    """
+
+    def __init__(self, name="mean"):
+        super().__init__(name)
+
+    def reduce(self, shared):
+        return shared.sum() / shared.size
+
+
+class CellReduction:
+    """
+    Several reducers computed together over the same cells. Every reducer reads shared intermediates, so
+    order statistics cost one partition and histograms one bincount however many reducers read them.
+    """
+
+    def __init__(self, reducers):
+        """
+        :param reducers: ([CellReducer]) reducers with unique names
+        """
+        self.reducers = list(reducers)
+        names = [reducer.name for reducer in self.reducers]
+        if len(set(names)) != len(names):
+            raise ValueError("Reducer names must be unique: %s" % names)
+        self.dtype = np.dtype([(reducer.name, reducer.dtype) for reducer in self.reducers])
+
+    def compute(self, cells, overwrite=False):
+        """
+        :param cells: (3D array) CELLS, HEIGHT, WIDTH
+        :param overwrite: (bool) partition a contiguous cells array in place instead of a copy, reorders its values
+        :return: (1D structured array) one field per reducer name, one record per cell
+        """
+        size = np.asarray(cells)[0].size
+        kth = [k for reducer in self.reducers for k in reducer.order_statistics(size)]
+        shared = SharedCells(cells, kth, overwrite)
+        results = np.empty(len(shared.pixels), self.dtype)
+        for reducer in self.reducers:
+            results[reducer.name] = reducer.reduce(shared)
+        return results
+
+
+def named_reducer(name):
+    """
+    :param name: (str) "closest", "mean", "mode", "trimmed", "min" or "p<percentile>", e.g. "p10"
+    :return: (CellReducer)
+    """
+    if name == "closest":
+        return ClosestMean()
+    if name == "mean":
+        return Mean()
+    if name == "mode":
+        return HistogramMode()
+    if name == "trimmed":
+        return TrimmedMean()
+    if name == "min":
+        return Percentile(0, name)
+    if name.startswith("p"):
+        try:
+            return Percentile(float(name[1:]), name)
+        except ValueError:
+            pass
+    raise ValueError("Unknown cell reducer %s" % name)
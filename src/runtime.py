@@ -0,0 +1,190 @@
+import threading
+from collections import deque
+
+
+class LatestQueue:
+    """
+    Bounded queue between two stages. When full, a put drops the oldest item so the
+    consumer always receives the latest value instead of working through a backlog.
+    """
+
+    def __init__(self, maxsize=1, on_drop=None):
+        """
+        :param maxsize: (int > 0) items held before the oldest is dropped
+        :param on_drop: (callable) called with every dropped item, e.g. to release its buffers
+        """
+        if maxsize <= 0:
+            raise ValueError("Queue size must be greater than 0")
+        self.items = deque(maxlen=maxsize)
+        self.on_drop = on_drop
+        self.dropped = 0
+        self.closed = False
+        self.ready = threading.Condition()
+
+    def put(self, item):
+        """
+        :param item: value for the consumer
+        :return: (bool) True if a stale item was dropped to make room
+        """
+        with self.ready:
+            dropped = len(self.items) == self.items.maxlen
+            stale = self.items[0] if dropped else None
+            self.dropped += dropped
+            self.items.append(item)
+            self.ready.notify()
+        if dropped and self.on_drop is not None:
+            self.on_drop(stale)
+        return dropped
+
+    def get(self, timeout=None):
+        """
+        Waits for the oldest held item.
+        :param timeout: (float) seconds to wait, None waits until an item or close
+        :return: item, or None on timeout or when the queue is closed
+        """
+        with self.ready:
+            if not self.ready.wait_for(lambda: self.items or self.closed, timeout):
+                return None
+            return self.items.popleft() if self.items else None
+
+    def finished(self):
+        """
+        :return: (bool) True once the queue is closed and every held item was taken
+        """
+        with self.ready:
+            return self.closed and not self.items
+
+    def close(self):
+        """
+        Wakes every waiting consumer, later gets return None once the queue is empty.
+        """
+        with self.ready:
+            self.closed = True
+            self.ready.notify_all()
+
+
+class Stage(threading.Thread):
+    """
+    Runs one step of the frame loop in its own thread, connected to its neighbours by LatestQueues.
+    A stage without an inbox is a source and calls its function with no arguments. Raising StopIteration
+    from it ends the stream: later stages finish the items already queued, and the runtime stops once the
+    end reaches the last stage of the chain.
+    """
+
+    def __init__(self, name, func, inbox, outbox, runtime):
+        super().__init__(name=name, daemon=True)
+        self.func = func
+        self.inbox = inbox
+        self.outbox = outbox
+        self.runtime = runtime
+
+    def run(self):
+        try:
+            while not self.runtime.stopped.is_set():
+                if self.inbox is None:
+                    result = self.func()
+                else:
+                    item = self.inbox.get(timeout=0.1)
+                    if item is None:
+                        if self.inbox.finished():
+                            break  # upstream ended and every queued item is handled
+                        continue
+                    result = self.func(item)
+                if self.outbox is not None and result is not None:
+                    self.outbox.put(result)
+            else:
+                return  # runtime stopped
+        except StopIteration:
+            pass
+        except Exception as error:
+            self.runtime.fail(self.name, error)
+            return
+        self.end_stream()
+
+    def end_stream(self):
+        # pass the end on so the next stage drains its inbox, the last stage of a chain stops the runtime
+        if self.outbox is not None:
+            self.outbox.close()
+        else:
+            self.runtime.stop(join=False)
+
+
+class Runtime:
+    """
+    Pipelined frame loop, e.g. capture -> process -> actuate, each stage on its own thread
+    so camera waits, NumPy work and I2C writes overlap.
+    """
+
+    def __init__(self, queue_size=1, on_drop=None):
+        """
+        :param queue_size: (int > 0) items held between stages before stale ones are dropped
+        :param on_drop: (callable) called with every item dropped between stages
+        """
+        self.queue_size = queue_size
+        self.on_drop = on_drop
+        self.stages = []
+        self.queues = []
+        self.stopped = threading.Event()
+        self.error = None
+
+    def add_stage(self, name, func, source=False):
+        """
+        Appends a stage fed by the output of the previous stage.
+        :param name: (str) stage name
+        :param func: (callable) source stage takes no arguments, later stages take the previous result
+        :param source: (bool) start a new chain, e.g. one capture source per camera, the first stage always does
+        :return: None
+        """
+        inbox = None
+        if self.stages and not source:
+            inbox = LatestQueue(self.queue_size, self.on_drop)
+            self.stages[-1].outbox = inbox
+            self.queues.append(inbox)
+        self.stages.append(Stage(name, func, inbox, None, self))
+
+    def start(self):
+        if not self.stages:
+            raise ValueError("Runtime needs at least one stage")
+        for stage in self.stages:
+            stage.start()
+
+    def fail(self, name, error):
+        """
+        Records the first stage error and stops the runtime.
+        """
+        if self.error is None:
+            self.error = RuntimeError("Stage %s failed: %r" % (name, error))
+            self.error.__cause__ = error
+        self.stop(join=False)
+
+    def stop(self, join=True, timeout=1.0):
+        """
+        Signals every stage to finish its current item and exit.
+        :param join: (bool) wait for stage threads to exit
+        :param timeout: (float) seconds to wait per stage
+        :return: None
+        """
+        self.stopped.set()
+        for inbox in self.queues:
+            inbox.close()
+        if join:
+            for stage in self.stages:
+                if stage is not threading.current_thread() and stage.is_alive():
+                    stage.join(timeout)
+
+    def wait(self, interval=0.5):
+        """
+        Blocks until the runtime stops, interruptible by Ctrl+C. Raises the first stage error.
+        :param interval: (float) seconds between checks
+        :return: None
+        """
+        while not self.stopped.wait(interval):
+            pass
+        if self.error is not None:
+            raise self.error
+
+    def dropped(self):
+        """
+        :return: ({str: int}) stale items dropped in front of each stage
+        """
+        return {stage.name: stage.inbox.dropped for stage in self.stages if stage.inbox is not None}
@@ -0,0 +1,175 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+STEREO_MATCHERS = ("bm", "sgbm")
+DISPARITY_SCALE = 16  # OpenCV disparities are fixed point with 4 fractional bits
+
+
+def create_matcher(matcher="bm", num_disparities=64, block_size=15):
+    """
+    :param matcher: (str) "bm" block matching or "sgbm" semi-global block matching
+    :param num_disparities: (int) disparity search range in pixels, divisible by 16
+    :param block_size: (int) odd matched block size
+    :return: (cv2.StereoMatcher)
+    """
+    if matcher == "bm":
+        return cv2.StereoBM_create(numDisparities=num_disparities, blockSize=block_size)
+    if matcher == "sgbm":
+        return cv2.StereoSGBM_create(minDisparity=0, numDisparities=num_disparities, blockSize=block_size,
+                                     P1=8 * block_size ** 2, P2=32 * block_size ** 2,
+                                     mode=cv2.STEREO_SGBM_MODE_SGBM_3WAY)
+    raise ValueError("Stereo matcher must be one of %s" % (STEREO_MATCHERS,))
+
+
+class Rectifier:
+    """
+    Undistorts and rectifies stereo pairs with remap tables computed once from the stereo calibration.
+    """
+
+    def __init__(self, shape, left_matrix, left_distortion, right_matrix, right_distortion, rotation, translation):
+        """
+        :param shape: ((int, int)) HEIGHT, WIDTH of both images
+        :param left_matrix: (3x3 array) left camera matrix
+        :param left_distortion: (1D array) left distortion coefficients
+        :param right_matrix: (3x3 array) right camera matrix
+        :param right_distortion: (1D array) right distortion coefficients
+        :param rotation: (3x3 array) rotation from the left to the right camera
+        :param translation: (3 array) translation from the left to the right camera in millimetres
+        """
+        self.shape = tuple(shape)
+        size = (self.shape[1], self.shape[0])
+        translation = np.asarray(translation, np.float64).reshape(3, 1)
+        left_rotation, right_rotation, left_projection, right_projection = cv2.stereoRectify(
+            left_matrix, left_distortion, right_matrix, right_distortion, size, rotation, translation, alpha=0)[:4]
+        self.left_maps = cv2.initUndistortRectifyMap(left_matrix, left_distortion, left_rotation, left_projection,
+                                                     size, cv2.CV_16SC2)
+        self.right_maps = cv2.initUndistortRectifyMap(right_matrix, right_distortion, right_rotation,
+                                                      right_projection, size, cv2.CV_16SC2)
+        self.focal_length = float(left_projection[0, 0])  # pixels, after rectification
+        self.baseline = float(np.linalg.norm(translation))  # millimetres
+        self.left = np.empty(self.shape, np.uint8)
+        self.right = np.empty(self.shape, np.uint8)
+
+    @classmethod
+    def load(cls, path, shape):
+        """
+        :param path: (str) .npz calibration with left_matrix, left_distortion, right_matrix, right_distortion,
+                     rotation and translation arrays
+        :param shape: ((int, int)) HEIGHT, WIDTH of both images
+        :return: (Rectifier)
+        """
+        with np.load(path) as calibration:
+            return cls(shape, calibration["left_matrix"], calibration["left_distortion"],
+                       calibration["right_matrix"], calibration["right_distortion"],
+                       calibration["rotation"], calibration["translation"])
+
+    def rectify(self, left, right):
+        """
+        :param left: (2D uint8 array) left grayscale image
+        :param right: (2D uint8 array) right grayscale image
+        :return: ((2D array, 2D array)) rectified images, buffers overwritten by the next pair
+        """
+        cv2.remap(left, *self.left_maps, cv2.INTER_LINEAR, dst=self.left)
+        cv2.remap(right, *self.right_maps, cv2.INTER_LINEAR, dst=self.right)
+        return self.left, self.right
+
+
+class DisparityEngine:
+    """
+    Stereo disparity computed in horizontal bands on a thread pool, converted to uint16 millimetre depth maps.
+    Every band is matched with extra overlap rows above and below that are discarded, so band edges have the
+    full block and prefilter context. With the default overlap, block matching gives the same disparities as
+    one full image call; semi-global matching also aggregates costs along image columns, so its bands only
+    approximate a full image call near band edges.
+    """
+
+    def __init__(self, shape, focal_length=None, baseline=None, matcher="bm", num_disparities=64, block_size=15,
+                 bands=None, overlap=None):
+        """
+        :param shape: ((int, int)) HEIGHT, WIDTH of the stereo images
+        :param focal_length: (float) rectified focal length in pixels, or set later with calibrate
+        :param baseline: (float) distance between the cameras in millimetres, or set later with calibrate
+        :param matcher: (str) one of STEREO_MATCHERS
+        :param num_disparities: (int) disparity search range in pixels, divisible by 16
+        :param block_size: (int) odd matched block size
+        :param bands: (int > 0) horizontal bands matched in parallel, one per CPU by default
+        :param overlap: (int >= 0) extra rows matched above and below every band, twice the block size by default
+        """
+        if matcher not in STEREO_MATCHERS:
+            raise ValueError("Stereo matcher must be one of %s" % (STEREO_MATCHERS,))
+        self.shape = tuple(shape)
+        self.num_disparities = num_disparities
+        overlap = 2 * block_size if overlap is None else overlap
+        if bands is None:
+            bands = os.cpu_count() or 1
+        # bands too thin to hold their own block context are merged
+        bands = max(1, min(bands, self.shape[0] // max(block_size, 1)))
+
+        # (rows kept, rows matched) of every band
+        edges = np.linspace(0, self.shape[0], bands + 1).astype(int).tolist()
+        self.bands = [(slice(start, stop), slice(max(start - overlap, 0), min(stop + overlap, self.shape[0])))
+                      for start, stop in zip(edges[:-1], edges[1:])]
+
+        # matchers keep internal buffers, so every band has its own
+        self.matchers = [create_matcher(matcher, num_disparities, block_size) for _ in self.bands]
+        self.pool = ThreadPoolExecutor(len(self.bands), "disparity") if len(self.bands) > 1 else None
+
+        self.disparity = np.empty(self.shape, np.int16)
+        self.index = np.empty(self.shape, np.int16)
+        self.depth = np.empty(self.shape, np.uint16)
+        self.lut = None
+        if focal_length is not None and baseline is not None:
+            self.calibrate(focal_length, baseline)
+
+    def calibrate(self, focal_length, baseline):
+        """
+        Builds the disparity to depth table, depth = focal_length * baseline / disparity.
+        :param focal_length: (float) rectified focal length in pixels
+        :param baseline: (float) distance between the cameras in millimetres
+        :return: None
+        """
+        disparity = np.arange(self.num_disparities * DISPARITY_SCALE + 1, dtype=np.float64) / DISPARITY_SCALE
+        with np.errstate(divide="ignore"):
+            depth = focal_length * baseline / disparity
+        depth[0] = 0  # no match, a depth shadow
+        self.lut = np.minimum(depth, np.iinfo(np.uint16).max).round().astype(np.uint16)
+
+    def match_band(self, band, left, right):
+        kept, matched = self.bands[band]
+        disparity = self.matchers[band].compute(left[matched], right[matched])
+        offset = kept.start - matched.start
+        self.disparity[kept] = disparity[offset:offset + kept.stop - kept.start]
+
+    def compute(self, left, right):
+        """
+        :param left: (2D uint8 array) rectified left grayscale image
+        :param right: (2D uint8 array) rectified right grayscale image
+        :return: (2D int16 array) fixed point disparity, buffer overwritten by the next pair
+        """
+        if left.shape != self.shape or right.shape != self.shape:
+            raise ValueError("Stereo pair shape %s does not match engine shape %s" % (left.shape, self.shape))
+        if self.pool is None:
+            self.match_band(0, left, right)
+        else:
+            # OpenCV releases the GIL while matching, so bands run in parallel
+            for future in [self.pool.submit(self.match_band, band, left, right) for band in range(len(self.bands))]:
+                future.result()
+        return self.disparity
+
+    def depth_map(self, left, right):
+        """
+        :param left: (2D uint8 array) rectified left grayscale image
+        :param right: (2D uint8 array) rectified right grayscale image
+        :return: (2D uint16 array) millimetre depth map, 0 where no match, buffer overwritten by the next pair
+        """
+        if self.lut is None:
+            raise ValueError("Disparity engine needs a focal length and baseline")
+        np.clip(self.compute(left, right), 0, len(self.lut) - 1, out=self.index)
+        return np.take(self.lut, self.index, out=self.depth)
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
@@ -2,6 +2,11 @@ import cv2
 import numpy as np
 import math
 
+SHADOW_FILLS = ("mean", "valid_mean", "none")
+DECIMATIONS = ("nearest", "min", "median")
+GRID_TEMPLATES = {}  # grid line masks keyed by (shape, ver_cells, hor_cells)
+
+
 class StereoScene:
 
     def __init__(self, depth_map, color_map, ver_cells, hor_cells):
@@ -28,30 +33,17 @@ class StereoScene:
     StereoScene Modifiers - modifies the object
     =============================================================================== """
 
-    def scene_reduce(self):
+    def scene_reduce(self, reduce_color=True):
         """
         Reduce depth map shape radially until evenly divisible by cells.
-        :param ver_cells: (int) cells vertically
-        :param hor_cells: (int) cells horizontally
+        The reduced maps are views of the originals, no pixels are copied.
+        :param reduce_color: (bool) also reduce the color map, skip when it is not visualized
         :return: None
         """
-        height, width = self.dm_get_shape()
-        if self.ver_cells <= 0 or self.hor_cells <= 0 or (height, width) < (self.ver_cells, self.hor_cells):
-            raise ValueError("Cells count must be greater than 0, and less than shape")
-
-        lower = lambda l, f: math.ceil((l % f) / 2)  # calculates lower bound (length, factor)
-        upper = lambda l, f: math.floor((l % f) / 2) * -1  # calculates upper bound (length, factor)
-        check = lambda l, b: l if b == 0 else b  # catches upper bound if 0 (length, bound)
-        # recduce depth map
-        depth_map_out = []
-        for row in self.depth_map[lower(height, self.ver_cells): check(height, upper(height, self.ver_cells))]:
-            depth_map_out.append(row[lower(width, self.hor_cells): check(width, upper(width, self.hor_cells))])
-        self.depth_map = np.array(depth_map_out)
-        # reduce color map
-        color_map_out = []
-        for row in self.color_map[lower(height, self.ver_cells): check(height, upper(height, self.ver_cells))]:
-            color_map_out.append(row[lower(width, self.hor_cells): check(width, upper(width, self.hor_cells))])
-        self.color_map = np.array(color_map_out)
+        rows, cols = crop_bounds(self.dm_get_shape(), self.ver_cells, self.hor_cells)
+        self.depth_map = np.asanyarray(self.depth_map)[rows, cols]
+        if reduce_color and self.color_map is not None:
+            self.color_map = np.asanyarray(self.color_map)[rows, cols]
 
     def scene_compress(self, shape):
         """
@@ -61,6 +53,20 @@ class StereoScene:
         """
         self.depth_map = cv2.resize(self.depth_map, (shape[1], shape[0]), interpolation=cv2.INTER_NEAREST)
 
+    def scene_decimate(self, factor, method="min", shadow_threshold=200):
+        """
+        Shrink depth map by an integer factor, pooling every factor x factor block into one value.
+        The color map keeps the top left pixel of every block so both maps stay aligned.
+        :param factor: (int > 0) block size
+        :param method: (str) block pooling, one of DECIMATIONS
+        :param shadow_threshold: (int) depth values below threshold are ignored by min pooling
+        :return: None
+        """
+        self.depth_map = decimate(self.depth_map, factor, method, shadow_threshold)
+        if self.color_map is not None:
+            height, width = self.dm_get_shape()
+            self.color_map = np.asanyarray(self.color_map)[:height * factor:factor, :width * factor:factor]
+
     """ =============================================================================== 
     StereoScene Returns - returns an object
     =============================================================================== """
@@ -71,11 +77,25 @@ class StereoScene:
         """
         return np.shape(self.depth_map)
 
-    def get_cells(self):
+    def dm_get_max(self):
         """
-        Divides depth map into grid cells. Depth map shape must be divide cells evenly.
-        :param ver_cells: (int) cells vertically
-        :param hor_cells: (int) cells horizontally
+        :return: (int) farthest depth map value
+        """
+        return int(np.max(self.depth_map))
+
+    def dm_get_min(self):
+        """
+        :return: (int) closest depth map value
+        """
+        return int(np.min(self.depth_map))
+
+    def get_cells(self, shadow_threshold=200, shadow_fill="mean"):
+        """
+        Divides depth map into grid cells and fills depth shadows. Depth map shape must be divide cells evenly.
+        The depth map is only read, filled cells are written to a new (cells, height, width) array.
+        :param shadow_threshold: (int) depth values below threshold are shadows, .2 meters by default
+        :param shadow_fill: (str) shadow replacement - "mean" cell average, "valid_mean" average of the
+                            non shadow values in the cell, "none" keeps shadows
         """
         height, width = self.dm_get_shape()
         if height % self.ver_cells != 0 or width % self.hor_cells != 0:
@@ -85,41 +105,58 @@ class StereoScene:
         cell_width = width // self.hor_cells
 
         # create depth map cells
-        arr = np.array(self.depth_map)
-        self.dm_cells = (arr.reshape(height // cell_height, cell_height, -1, cell_width)
+        cells = (np.asarray(self.depth_map).reshape(self.ver_cells, cell_height, self.hor_cells, cell_width)
                  .swapaxes(1, 2)
                  .reshape(-1, cell_height, cell_width))
 
-        # remove depth shadows
-        bound_cells = []
-        for cell in self.dm_cells:
-            threshold = 200 # .2 meters
-            cell[cell < threshold] = np.average(cell)
-            bound_cells.append(cell)
-        self.dm_cells = bound_cells
-
-        # create color map cells
-        arr = np.array(self.color_map)
-        self.cm_cells = (arr.reshape(height // cell_height, cell_height, -1, cell_width, 3)
-                 .swapaxes(1, 2)
-                 .reshape(-1, cell_height, cell_width, 3))
+        # remove depth shadows on a contiguous copy, the depth map (camera frame buffer) is never written
+        self.dm_cells = np.array(cells, order="C")
+        fill_shadows(self.dm_cells, shadow_threshold, shadow_fill)
+
+        # color map cells are only built on demand by get_color_cells
+        self.cm_cells = None
 
-    def get_points(self):
+    def get_color_cells(self):
+        """
+        Divides the color map into the same cells as the depth map, on first use after get_cells, so frames
+        that are never visualized pay nothing for color.
+        :return: (4D array) CELLS, HEIGHT, WIDTH, 3 copy of the color map, None without a color map reduced
+                 with the depth map
+        """
+        if self.cm_cells is None and self.dm_cells is not None and self.color_map is not None:
+            height, width = self.dm_get_shape()
+            if np.shape(self.color_map)[:2] == (height, width):
+                cell_height, cell_width = self.dm_cells.shape[1:]
+                self.cm_cells = (np.array(self.color_map)
+                                 .reshape(self.ver_cells, cell_height, self.hor_cells, cell_width, 3)
+                                 .swapaxes(1, 2)
+                                 .reshape(-1, cell_height, cell_width, 3))
+        return self.cm_cells
+
+    def get_points(self, closest=0.05):
         """
         Finds closest prominent depth point in a cell
+        :param closest: (float 0-1) fraction of closest cell values averaged into the point
+        """
+        self.points = closest_points(self.dm_cells, closest)
+
+    def reduce_cells(self, reduction, overwrite=False):
         """
-        self.points = []
-        for cell in self.dm_cells:
-            cell = np.array(cell).flatten()
-            cell.sort()
-            self.points.append(round(np.mean(cell[:round(len(cell) * 0.05)])))
+        Computes several cell statistics together, e.g. reducers.CellReduction([ClosestMean(), Percentile(10)]).
+        :param reduction: (CellReduction) reducers sharing one pass over the cells
+        :param overwrite: (bool) let the reduction reorder dm_cells values in place instead of a copy
+        :return: (1D structured array) one field per reducer, one record per cell
+        """
+        return reduction.compute(self.dm_cells, overwrite)
 
     def template_match(self, prominence, threshold, step):
         """
-        Creates a template matrix from one depth value of shape determined by the percentage of depth map inputted.
-        Compares multiple template matrix's from max depth value to min depth value until match return value is
-        below threshold when compared to depth matrix. If no match is below threshold, returns -1.
-        The closer the match value is to zero, the more similarities there are between a template and depth map match.
+        Finds the first depth of a sweep from max depth to min depth at which a constant template, of shape
+        determined by the percentage of depth map inputted, matches the depth map with a squared difference
+        at or below threshold. If no depth matches, returns -1.
+        Instead of matching a template per depth, box filters give every window's mean and variance, and the
+        squared difference of a window to depth d is size * (variance + (mean - d) ** 2). The depths a window
+        matches form an interval around its mean, so the sweep result is found in one vectorized step.
         :param prominence: (float 0-1)percent of the depth map to create depth template
         :param threshold: (int >= 0) match threshold between depth template and depth map
         :param step: (int > 0) step size between max depth and min depth
@@ -127,55 +164,95 @@ class StereoScene:
                  template cords for visualization
         """
         height, width = self.dm_get_shape()
-        template_shape = (math.ceil(height * prominence), math.ceil(width * prominence))
+        template_height, template_width = math.ceil(height * prominence), math.ceil(width * prominence)
+        size = template_height * template_width
+        max_depth, min_depth = self.dm_get_max(), self.dm_get_min()
+
+        # window mean and variance at every template position, cropped to the cv2.matchTemplate result shape
+        depth_map = np.ascontiguousarray(self.depth_map)
+        kernel = (template_width, template_height)
+        rows, cols = height - template_height + 1, width - template_width + 1
+        mean = cv2.boxFilter(depth_map, cv2.CV_64F, kernel, anchor=(0, 0), borderType=cv2.BORDER_CONSTANT)
+        variance = cv2.sqrBoxFilter(depth_map, cv2.CV_64F, kernel, anchor=(0, 0), borderType=cv2.BORDER_CONSTANT)
+        mean, variance = mean[:rows, :cols], variance[:rows, :cols]
+        variance -= mean * mean
+
+        # only windows uniform enough to match at their own mean can match any depth
+        candidates = np.flatnonzero(variance <= threshold / size)
+        if len(candidates) == 0:
+            return (-1, (0, 0))
+        candidate_mean = mean.ravel()[candidates]
+        candidate_variance = variance.ravel()[candidates]
+        radius = np.sqrt(np.maximum(threshold / size - candidate_variance, 0))
+
+        # deepest sweep depth at or below every window's upper bound, kept if it is inside the window's interval
+        depths = max_depth - np.maximum(np.ceil((max_depth - (candidate_mean + radius)) / step), 0) * step
+        matches = (depths >= candidate_mean - radius) & (depths > min_depth)
+        if not matches.any():
+            return (-1, (0, 0))
+        depth = int(depths[matches].max())
 
-        for depth in range(self.dm_get_max(), self.dm_get_min(), -step):
-            template = np.full(template_shape, depth)
-            res = cv2.matchTemplate(self.depth_map.astype(np.float32), template.astype(np.float32), cv2.TM_SQDIFF)
-            min_val, max_val, min_loc, max_loc = cv2.minMaxLoc(res)
-            if min_val <= threshold:
-                return (depth, min_loc)
-        return (-1, (0,0))
+        # best match location at that depth, the first in raster order like cv2.minMaxLoc
+        best = candidates[np.argmin(candidate_variance + (candidate_mean - depth) ** 2)]
+        return (depth, (int(best % cols), int(best // cols)))
 
     """ ===============================================================================
     StereoScene Visualizers - visualizes StereoScene
     =============================================================================== """
 
     def visualize(self):
+        # Show maps
+        cv2.namedWindow("Visual", cv2.WINDOW_AUTOSIZE)
+        cv2.imshow("Visual", self.render())
+        cv2.waitKey(1)
+
+    def render(self):
+        """
+        :return: (3D array) color map with closest points and grid beside the colorized depth map
+        """
         # Apply colormap on depth image (image must be converted to 8-bit per pixel first)
         depth_colormap = cv2.applyColorMap(cv2.convertScaleAbs(self.depth_map, alpha=0.03), cv2.COLORMAP_JET)
 
+        color_cells = self.get_color_cells()
+        if color_cells is None:
+            raise ValueError("Rendering needs a color map reduced with the depth map")
+
         # recolor depth points on color map
-        for index in range(self.ver_cells * self.hor_cells):
-            for ir, row in enumerate(self.dm_cells[index]):
-                for ic, col in enumerate(row):
-                    if col <= self.points[index]:
-                        self.cm_cells[index][ir][ic] = [127, 0, 255] # b,g,r
-
-        # build first horizontal strip
-        recons_colormap = self.cm_cells[0]
-        for index in range(1, self.hor_cells):
-            recons_colormap = np.hstack((recons_colormap, self.cm_cells[index]))
-        # add continual horizontal strips
-        for start_cell in range(self.hor_cells, len(self.cm_cells), self.hor_cells):
-            tmp = self.cm_cells[start_cell]
-            for index in range(1, self.hor_cells):
-                tmp = np.hstack((tmp, self.cm_cells[start_cell + index]))
-            recons_colormap = np.vstack((recons_colormap, tmp))
+        closest = self.dm_cells <= np.asarray(self.points)[:, None, None]
+        color_cells[closest] = [127, 0, 255] # b,g,r
+
+        # reassemble cells into the reduced map shape
+        cell_height, cell_width = color_cells.shape[1:3]
+        recons_colormap = (color_cells.reshape(self.ver_cells, self.hor_cells, cell_height, cell_width, 3)
+                           .swapaxes(1, 2)
+                           .reshape(self.ver_cells * cell_height, self.hor_cells * cell_width, 3))
 
         # Draw grid
-        dim = (round(recons_colormap.shape[1]), recons_colormap.shape[0])
-        cell_dim = (round(dim[0] / self.hor_cells), round(dim[1] / self.ver_cells))
-        for x in range(self.hor_cells):
-            for y in range(self.ver_cells):
-                loc = (x * cell_dim[0], y * cell_dim[1])
-                cv2.rectangle(recons_colormap, loc, (loc[0] + cell_dim[0], loc[1] + cell_dim[1]), (220,220,220), thickness=1)
-                cv2.rectangle(depth_colormap, loc, (loc[0] + cell_dim[0], loc[1] + cell_dim[1]), (220,220,220), thickness=1)
+        grid = self.grid_template(recons_colormap.shape[:2], self.ver_cells, self.hor_cells)
+        recons_colormap[grid] = (220, 220, 220)
+        depth_colormap[grid] = (220, 220, 220)
 
-        # Show maps
-        cv2.namedWindow("Visual", cv2.WINDOW_AUTOSIZE)
-        cv2.imshow("Visual", np.hstack((recons_colormap, depth_colormap)))
-        cv2.waitKey(1)
+        return np.hstack((recons_colormap, depth_colormap))
+
+    @staticmethod
+    def grid_template(shape, ver_cells, hor_cells):
+        """
+        Grid line mask drawn once per map shape and cell count, then reused between frames.
+        :param shape: ((int, int)) HEIGHT, WIDTH
+        :param ver_cells: (int) vertical cells
+        :param hor_cells: (int) horizontal cells
+        :return: (2D bool array) True on grid line pixels
+        """
+        key = (tuple(shape), ver_cells, hor_cells)
+        if key not in GRID_TEMPLATES:
+            template = np.zeros(shape, np.uint8)
+            cell_dim = (round(shape[1] / hor_cells), round(shape[0] / ver_cells))
+            for x in range(hor_cells):
+                for y in range(ver_cells):
+                    loc = (x * cell_dim[0], y * cell_dim[1])
+                    cv2.rectangle(template, loc, (loc[0] + cell_dim[0], loc[1] + cell_dim[1]), 1, thickness=1)
+            GRID_TEMPLATES[key] = template.astype(bool)
+        return GRID_TEMPLATES[key]
 
     def print_ascii_map(self):
         remapped_points = []
@@ -204,7 +281,8 @@ class StereoScene:
         remapped_points = ['{:.1f}'.format(round(point/1000, 1)) for point in self.points]
         print(np.array(remapped_points).reshape(self.ver_cells, self.hor_cells))
 
-    def powermap(self, val):
+    @staticmethod
+    def powermap(val):
         if val < 200:
             return 65000
         if val < 400:
@@ -215,4 +293,478 @@ class StereoScene:
             return 35000
         if val < 1000:
             return 25000
-        return 0
\ No newline at end of file
+        return 0
+
+
+def crop_bounds(shape, ver_cells, hor_cells):
+    """
+    Centered crop making a depth map shape evenly divisible by cells. Extra rows/columns are split
+    between both sides with the odd one removed first.
+    :param shape: ((int, int)) HEIGHT, WIDTH
+    :param ver_cells: (int) vertical cells
+    :param hor_cells: (int) horizontal cells
+    :return: ((slice, slice)) rows, columns
+    """
+    height, width = shape
+    if ver_cells <= 0 or hor_cells <= 0 or (height, width) < (ver_cells, hor_cells):
+        raise ValueError("Cells count must be greater than 0, and less than shape")
+
+    top = math.ceil((height % ver_cells) / 2)
+    bottom = height - math.floor((height % ver_cells) / 2)
+    left = math.ceil((width % hor_cells) / 2)
+    right = width - math.floor((width % hor_cells) / 2)
+    return slice(top, bottom), slice(left, right)
+
+
+def decimate(depth_map, factor, method="min", shadow_threshold=200, out=None, scratch=None):
+    """
+    Shrinks a depth map by an integer factor, pooling every factor x factor block into one value.
+    Rows and columns that do not fill a whole block are dropped.
+    :param depth_map: (2D array) HEIGHT, WIDTH
+    :param factor: (int > 0) block size
+    :param method: (str) block pooling - "nearest" top left value, "min" closest non shadow value with shadow
+                   only blocks left as shadows, unsigned depth maps only, "median" the two middle values
+                   averaged and rounded down
+    :param shadow_threshold: (int) depth values below threshold are ignored by min pooling
+    :param out: (2D array) optional HEIGHT // factor, WIDTH // factor output buffer
+    :param scratch: (1D array) optional work buffer of out.size * factor ** 2 depth map values
+    :return: (2D array) decimated depth map, a strided view of the depth map for "nearest" without out
+    """
+    if method not in DECIMATIONS:
+        raise ValueError("Decimation method must be one of %s" % (DECIMATIONS,))
+    depth_map = np.asarray(depth_map)
+    if factor <= 0 or depth_map.shape[0] < factor or depth_map.shape[1] < factor:
+        raise ValueError("Decimation factor must be greater than 0, and at most shape")
+    height, width = depth_map.shape[0] // factor, depth_map.shape[1] // factor
+    if method == "nearest":
+        nearest = depth_map[:height * factor:factor, :width * factor:factor]
+        if out is None:
+            return nearest
+        np.copyto(out, nearest)
+        return out
+
+    if out is None:
+        out = np.empty((height, width), depth_map.dtype)
+    if scratch is None:
+        scratch = np.empty(height * width * factor * factor, depth_map.dtype)
+    blocks = depth_map[:height * factor, :width * factor].reshape(height, factor, width, factor)
+
+    if method == "min":
+        # shifting by the threshold wraps shadows above every valid depth, shifting back restores them
+        if not np.issubdtype(depth_map.dtype, np.unsignedinteger):
+            raise ValueError("Min pooling needs an unsigned depth map")
+        threshold = depth_map.dtype.type(shadow_threshold)
+        shifted = scratch.reshape(height, factor, width * factor)
+        np.subtract(blocks.reshape(height, factor, width * factor), threshold, out=shifted)
+
+        # block rows reduced into the first row of every block, then block columns into out
+        rows = shifted[:, 0]
+        for row in range(1, factor):
+            np.minimum(rows, shifted[:, row], out=rows)
+        columns = rows.reshape(height, width, factor)
+        np.copyto(out, columns[:, :, 0])
+        for column in range(1, factor):
+            np.minimum(out, columns[:, :, column], out=out)
+        np.add(out, threshold, out=out)
+        return out
+
+    if factor == 2:
+        # middle pair of four values from a comparator network: max of the pair minimums, min of the pair maximums
+        pairs = scratch.reshape(4, height, width)
+        np.minimum(blocks[:, 0, :, 0], blocks[:, 0, :, 1], out=pairs[0])
+        np.maximum(blocks[:, 0, :, 0], blocks[:, 0, :, 1], out=pairs[1])
+        np.minimum(blocks[:, 1, :, 0], blocks[:, 1, :, 1], out=pairs[2])
+        np.maximum(blocks[:, 1, :, 0], blocks[:, 1, :, 1], out=pairs[3])
+        np.maximum(pairs[0], pairs[2], out=pairs[0])
+        np.minimum(pairs[1], pairs[3], out=pairs[1])
+        lower, upper = pairs[2], pairs[3]
+        np.minimum(pairs[0], pairs[1], out=lower)
+        np.maximum(pairs[0], pairs[1], out=upper)
+    else:
+        # block pixels gathered on the last axis and sorted, faster than a two element partition of short rows
+        size = factor * factor
+        middle = size // 2
+        block_median = scratch.reshape(height, width, size)
+        np.copyto(block_median.reshape(height, width, factor, factor), blocks.swapaxes(1, 2))
+        block_median.sort(axis=2)
+        lower, upper = block_median[:, :, middle - 1], block_median[:, :, middle]
+
+    # lower + (upper - lower) / 2 stays in range of the depth type
+    np.subtract(upper, lower, out=out)
+    np.right_shift(out, 1, out=out)
+    np.add(out, lower, out=out)
+    return out
+
+
+def fill_shadows(cells, shadow_threshold=200, shadow_fill="mean", shadows=None, fill=None):
+    """
+    Replaces depth shadows in every cell at once, in place.
+    :param cells: (3D array) CELLS, HEIGHT, WIDTH
+    :param shadow_threshold: (int) depth values below threshold are shadows, .2 meters by default
+    :param shadow_fill: (str) shadow replacement - "mean" cell average, "valid_mean" average of the
+                        non shadow values in the cell, "none" keeps shadows
+    :param shadows: (3D bool array) optional mask buffer shaped like cells
+    :param fill: (1D float64 array) optional per cell fill buffer
+    :return: None
+    """
+    if shadow_fill not in SHADOW_FILLS:
+        raise ValueError("Shadow fill must be one of %s" % (SHADOW_FILLS,))
+    if shadow_fill == "none":
+        return
+
+    shadows = np.less(cells, shadow_threshold, out=shadows)
+    fill = np.mean(cells, axis=(1, 2), out=fill)
+    if shadow_fill == "valid_mean":
+        # valid sum is the cell sum without the shadow sum, no inverted mask is built
+        valid = cells[0].size - np.count_nonzero(shadows, axis=(1, 2))
+        valid_sum = cells.sum(axis=(1, 2), dtype=np.float64) - cells.sum(axis=(1, 2), where=shadows, dtype=np.float64)
+        np.divide(valid_sum, valid, out=fill, where=valid > 0)  # all shadow cells keep average
+    np.copyto(cells, fill.astype(cells.dtype)[:, None, None], where=shadows)
+
+
+def closest_points(cells, closest=0.05, out=None, overwrite=False):
+    """
+    Mean of the closest fraction of values in every cell, selected with a partition instead of a full sort.
+    The selected values are summed exactly, so the result matches averaging a sorted cell.
+    :param cells: (3D array) CELLS, HEIGHT, WIDTH
+    :param closest: (float 0-1) fraction of closest cell values averaged into the point
+    :param out: (1D int64 array) optional output buffer
+    :param overwrite: (bool) partition a contiguous cells array in place instead of a copy, reorders its values
+    :return: (1D int64 array) rounded point per cell
+    """
+    cells = np.asarray(cells)
+    count = max(1, round(cells[0].size * closest))
+
+    if overwrite and cells.flags.c_contiguous:
+        selected = cells.reshape(len(cells), -1)  # (cells, cell_pixels) view, partitioned in place
+        selected.partition(count - 1, axis=1)
+    else:
+        selected = np.partition(cells.reshape(len(cells), -1), count - 1, axis=1)
+    closest_values = selected[:, :count]
+    if out is None:
+        out = np.empty(len(cells), np.int64)
+    np.copyto(out, np.round(closest_values.mean(axis=1)), casting="unsafe")
+    return out
+
+
+class ScenePlan:
+    """
+    Crop, cell layout and work buffers for one depth map shape and grid. Built once per run and reused for
+    every frame, it produces the same points as StereoScene scene_reduce, get_cells and get_points.
+    After allocation, processing a frame allocates no frame sized arrays.
+    """
+
+    def __init__(self, shape, ver_cells, hor_cells, shadow_threshold=200, shadow_fill="mean", closest=0.05,
+                 dtype=np.uint16, change_threshold=None, refresh=30, summary_step=4, decimation=1,
+                 decimation_method="min"):
+        """
+        :param shape: ((int, int)) depth map HEIGHT, WIDTH
+        :param ver_cells: (int) vertical cells
+        :param hor_cells: (int) horizontal cells
+        :param shadow_threshold: (int) depth values below threshold are shadows
+        :param shadow_fill: (str) shadow replacement, one of SHADOW_FILLS
+        :param closest: (float 0-1) fraction of closest cell values averaged into the point
+        :param dtype: (numpy dtype) depth map type
+        :param change_threshold: (float) millimetres a cell summary must change by before update recomputes
+                                 its point, None recomputes every cell on every frame
+        :param refresh: (int > 0) update recomputes every cell at least once every refresh frames
+        :param summary_step: (int > 0) pixel step of the decimated cell mean compared between frames
+        :param decimation: (int > 0) depth maps are decimated by this factor before the crop, 1 disables
+        :param decimation_method: (str) block pooling, one of DECIMATIONS
+        """
+        if shadow_fill not in SHADOW_FILLS:
+            raise ValueError("Shadow fill must be one of %s" % (SHADOW_FILLS,))
+        if refresh <= 0 or summary_step <= 0:
+            raise ValueError("Refresh and summary step must be greater than 0")
+        if decimation_method not in DECIMATIONS:
+            raise ValueError("Decimation method must be one of %s" % (DECIMATIONS,))
+        if decimation <= 0:
+            raise ValueError("Decimation factor must be greater than 0")
+        self.shape = tuple(shape)
+        self.decimation = decimation
+        self.decimation_method = decimation_method
+        self.decimated_shape = (self.shape[0] // decimation, self.shape[1] // decimation)
+        self.ver_cells = ver_cells
+        self.hor_cells = hor_cells
+        self.shadow_threshold = shadow_threshold
+        self.shadow_fill = shadow_fill
+        self.closest = closest
+
+        self.rows, self.cols = crop_bounds(self.decimated_shape, ver_cells, hor_cells)
+        self.cell_height = (self.rows.stop - self.rows.start) // ver_cells
+        self.cell_width = (self.cols.stop - self.cols.start) // hor_cells
+        self.allocate(dtype)
+
+        # change detection state of update
+        self.change_threshold = change_threshold
+        self.refresh = refresh
+        self.summary_step = summary_step
+        cells = ver_cells * hor_cells
+        self.summary = np.empty(cells, np.float64)
+        self.summary_cached = np.empty(cells, np.float64)  # summary when each cached point was computed
+        self.change = np.empty(cells, np.float64)
+        self.changed = np.empty(cells, bool)
+        self.points = np.zeros(cells, np.int64)
+        self.changed_points = np.empty(cells, np.int64)
+        self.frames = 0
+        self.skipped = 0  # cells skipped in the last update
+        self.skipped_total = 0
+
+    def allocate(self, dtype):
+        """
+        (Re)allocates the work buffers for a depth map type.
+        """
+        cells = (self.ver_cells * self.hor_cells, self.cell_height, self.cell_width)
+        self.dm_cells = np.empty(cells, dtype)
+        self.shadows = np.empty(cells, bool)
+        self.fill = np.empty(cells[0], np.float64)
+        self.decimated = None
+        self.decimate_scratch = None
+        if self.decimation > 1 and self.decimation_method != "nearest":
+            self.decimated = np.empty(self.decimated_shape, dtype)
+            self.decimate_scratch = np.empty(self.decimated.size * self.decimation ** 2, dtype)
+
+    def scene_reduce(self, depth_map):
+        """
+        :param depth_map: (2D array) full depth map of the planned shape
+        :return: (2D array) centered crop view of the decimated depth map, evenly divisible by cells
+        """
+        if np.shape(depth_map) != self.shape:
+            raise ValueError("Depth map shape %s does not match plan shape %s" % (np.shape(depth_map), self.shape))
+        if self.decimation > 1:
+            if self.decimated is not None and depth_map.dtype != self.decimated.dtype:
+                self.allocate(depth_map.dtype)
+            depth_map = decimate(depth_map, self.decimation, self.decimation_method, self.shadow_threshold,
+                                 self.decimated, self.decimate_scratch)
+        return depth_map[self.rows, self.cols]
+
+    def get_cells(self, reduced):
+        """
+        Copies the reduced depth map into the cell buffer and fills shadows. The depth map is only read.
+        :param reduced: (2D array) reduced depth map
+        :return: (3D array) CELLS, HEIGHT, WIDTH, the plan's buffer, overwritten by the next frame
+        """
+        if reduced.dtype != self.dm_cells.dtype:
+            self.allocate(reduced.dtype)
+        np.copyto(self.dm_cells.reshape(self.ver_cells, self.hor_cells, self.cell_height, self.cell_width),
+                  reduced.reshape(self.ver_cells, self.cell_height, self.hor_cells, self.cell_width).swapaxes(1, 2))
+        fill_shadows(self.dm_cells, self.shadow_threshold, self.shadow_fill, self.shadows, self.fill)
+        return self.dm_cells
+
+    def get_points(self, cells, out=None):
+        """
+        Partitions the plan's cell buffer in place, other cell arrays are partitioned on a copy.
+        :param cells: (3D array) CELLS, HEIGHT, WIDTH
+        :param out: (1D int64 array) optional output buffer
+        :return: (1D int64 array) point per cell
+        """
+        return closest_points(cells, self.closest, out, overwrite=cells is self.dm_cells)
+
+    def process(self, depth_map, out=None):
+        """
+        :param depth_map: (2D array) full depth map of the planned shape
+        :param out: (1D int64 array) optional output buffer
+        :return: (1D int64 array) point per cell
+        """
+        return self.get_points(self.get_cells(self.scene_reduce(depth_map)), out)
+
+    def update(self, depth_map, out=None):
+        """
+        Incremental process for mostly static scenes. A decimated mean of every cell is compared with its
+        value when the cell's point was last computed, and only cells that changed by more than the change
+        threshold are copied, shadow filled and partitioned again. The others keep their cached point.
+        Every cell is recomputed on the first frame and every refresh frames, bounding drift below the threshold.
+        :param depth_map: (2D array) full depth map of the planned shape
+        :param out: (1D int64 array) optional output buffer
+        :return: (1D int64 array) point per cell
+        """
+        if self.change_threshold is None:
+            return self.process(depth_map, out)
+        reduced = self.scene_reduce(depth_map)
+        if reduced.dtype != self.dm_cells.dtype:
+            self.allocate(reduced.dtype)
+            self.frames = 0
+
+        # VER, HEIGHT, HOR, WIDTH view of the reduced map, indexed per cell without copying
+        grid = reduced.reshape(self.ver_cells, self.cell_height, self.hor_cells, self.cell_width)
+        step = self.summary_step
+        np.mean(grid[:, ::step, :, ::step], axis=(1, 3), out=self.summary.reshape(self.ver_cells, self.hor_cells))
+
+        if self.frames % self.refresh == 0:
+            self.changed.fill(True)
+        else:
+            np.subtract(self.summary, self.summary_cached, out=self.change)
+            np.greater(np.abs(self.change, out=self.change), self.change_threshold, out=self.changed)
+        self.frames += 1
+
+        # changed cells are packed to the front of the cell buffers and processed together
+        changed = np.flatnonzero(self.changed)
+        count = len(changed)
+        for slot, cell in enumerate(changed):
+            np.copyto(self.dm_cells[slot], grid[cell // self.hor_cells, :, cell % self.hor_cells, :])
+        if count:
+            fill_shadows(self.dm_cells[:count], self.shadow_threshold, self.shadow_fill, self.shadows[:count],
+                         self.fill[:count])
+            closest_points(self.dm_cells[:count], self.closest, self.changed_points[:count], overwrite=True)
+            self.points[changed] = self.changed_points[:count]
+            self.summary_cached[changed] = self.summary[changed]
+
+        self.skipped = len(self.points) - count
+        self.skipped_total += self.skipped
+        if out is None:
+            return self.points.copy()
+        np.copyto(out, self.points)
+        return out
+
+
+def cell_edges(length, cells):
+    """
+    Uneven cell edges covering every pixel, cell sizes differ by at most one pixel.
+    :param length: (int) HEIGHT or WIDTH
+    :param cells: (int) cells along the length
+    :return: (1D int array) cells + 1 edges from 0 to length
+    """
+    if cells <= 0 or length < cells:
+        raise ValueError("Cells count must be greater than 0, and less than shape")
+    return np.arange(cells + 1) * length // cells
+
+
+class GridAggregator:
+    """
+    Cell statistics for any depth map shape and grid without cropping or padding. Cells get uneven sizes from
+    precomputed edges. Sums, minimums and maximums reduce all cells at once with reduceat. Points and
+    percentiles copy the cells of each cell shape, at most four, into preallocated buffers and partition
+    every group in one call.
+    """
+
+    def __init__(self, shape, ver_cells, hor_cells, shadow_threshold=200, shadow_fill="mean", closest=0.05,
+                 dtype=np.uint16):
+        """
+        :param shape: ((int, int)) depth map HEIGHT, WIDTH
+        :param ver_cells: (int) vertical cells
+        :param hor_cells: (int) horizontal cells
+        :param shadow_threshold: (int) depth values below threshold are shadows
+        :param shadow_fill: (str) shadow replacement, one of SHADOW_FILLS
+        :param closest: (float 0-1) fraction of closest cell values averaged into the point
+        :param dtype: (numpy dtype) depth map type
+        """
+        if shadow_fill not in SHADOW_FILLS:
+            raise ValueError("Shadow fill must be one of %s" % (SHADOW_FILLS,))
+        self.shape = tuple(shape)
+        self.ver_cells = ver_cells
+        self.hor_cells = hor_cells
+        self.shadow_threshold = shadow_threshold
+        self.shadow_fill = shadow_fill
+        self.closest = closest
+
+        self.row_edges = cell_edges(self.shape[0], ver_cells)
+        self.col_edges = cell_edges(self.shape[1], hor_cells)
+        heights, widths = np.diff(self.row_edges), np.diff(self.col_edges)
+        self.sizes = heights[:, None] * widths[None, :]  # VER, HOR pixels per cell
+
+        # cells grouped by shape, CELLS, HEIGHT, WIDTH, with cell numbers in row major order
+        self.groups = []
+        for height in np.unique(heights):
+            for width in np.unique(widths):
+                rows, cols = np.flatnonzero(heights == height), np.flatnonzero(widths == width)
+                cells = (rows[:, None] * hor_cells + cols[None, :]).ravel()
+                self.groups.append((cells, (len(cells), int(height), int(width))))
+        self.allocate(dtype)
+
+    def allocate(self, dtype):
+        """
+        (Re)allocates the group buffers for a depth map type.
+        """
+        self.buffers = [np.empty(shape, dtype) for _, shape in self.groups]
+        self.shadows = [np.empty(shape, bool) for _, shape in self.groups]
+        self.fills = [np.empty(len(cells), np.float64) for cells, _ in self.groups]
+        self.group_points = [np.empty(len(cells), np.int64) for cells, _ in self.groups]
+
+        # every cell's slot in its group buffer and its pixels, copied block by block
+        self.copies = []
+        for (cells, _), buffer in zip(self.groups, self.buffers):
+            for slot, cell in enumerate(cells):
+                row, col = divmod(int(cell), self.hor_cells)
+                self.copies.append((buffer[slot], slice(self.row_edges[row], self.row_edges[row + 1]),
+                                    slice(self.col_edges[col], self.col_edges[col + 1])))
+
+    def check(self, depth_map):
+        if np.shape(depth_map) != self.shape:
+            raise ValueError("Depth map shape %s does not match grid shape %s" % (np.shape(depth_map), self.shape))
+        return np.asarray(depth_map)
+
+    def sum(self, depth_map):
+        """
+        :param depth_map: (2D array) depth map of the grid shape
+        :return: (2D float64 array) VER, HOR sum of every cell
+        """
+        depth_map = self.check(depth_map)
+        rows = np.add.reduceat(depth_map, self.row_edges[:-1], axis=0, dtype=np.float64)
+        return np.add.reduceat(rows, self.col_edges[:-1], axis=1)
+
+    def mean(self, depth_map):
+        """
+        :return: (2D float64 array) VER, HOR mean of every cell
+        """
+        return self.sum(depth_map) / self.sizes
+
+    def min(self, depth_map):
+        """
+        :return: (2D array) VER, HOR minimum of every cell
+        """
+        depth_map = self.check(depth_map)
+        return np.minimum.reduceat(np.minimum.reduceat(depth_map, self.row_edges[:-1], axis=0),
+                                   self.col_edges[:-1], axis=1)
+
+    def max(self, depth_map):
+        """
+        :return: (2D array) VER, HOR maximum of every cell
+        """
+        depth_map = self.check(depth_map)
+        return np.maximum.reduceat(np.maximum.reduceat(depth_map, self.row_edges[:-1], axis=0),
+                                   self.col_edges[:-1], axis=1)
+
+    def gather(self, depth_map):
+        """
+        Copies every cell into the buffer of its cell shape. The depth map is only read.
+        :param depth_map: (2D array) depth map of the grid shape
+        :return: ([(1D int array, 3D array)]) cell numbers in row major order and their CELLS, HEIGHT, WIDTH
+                 buffer for every cell shape, buffers are overwritten by the next frame
+        """
+        depth_map = self.check(depth_map)
+        if depth_map.dtype != self.buffers[0].dtype:
+            self.allocate(depth_map.dtype)
+        for slot, rows, cols in self.copies:
+            np.copyto(slot, depth_map[rows, cols])
+        return [(cells, buffer) for (cells, _), buffer in zip(self.groups, self.buffers)]
+
+    def percentile(self, depth_map, q, out=None):
+        """
+        :param depth_map: (2D array) depth map of the grid shape
+        :param q: (float 0-100) percentile, the lower value of every cell where it falls between two
+        :param out: (1D array) optional output buffer
+        :return: (1D array) percentile of every cell in row major order
+        """
+        if out is None:
+            out = np.empty(self.ver_cells * self.hor_cells, self.buffers[0].dtype)
+        for cells, buffer in self.gather(depth_map):
+            pixels = buffer.reshape(len(cells), -1)
+            kth = int((pixels.shape[1] - 1) * q / 100)
+            pixels.partition(kth, axis=1)
+            out[cells] = pixels[:, kth]
+        return out
+
+    def get_points(self, depth_map, out=None):
+        """
+        Same points as StereoScene get_cells and get_points, over uneven cells covering the whole depth map.
+        :param depth_map: (2D array) depth map of the grid shape
+        :param out: (1D int64 array) optional output buffer
+        :return: (1D int64 array) point per cell in row major order
+        """
+        if out is None:
+            out = np.empty(self.ver_cells * self.hor_cells, np.int64)
+        for (cells, buffer), shadows, fill, points in zip(self.gather(depth_map), self.shadows, self.fills,
+                                                         self.group_points):
+            fill_shadows(buffer, self.shadow_threshold, self.shadow_fill, shadows, fill)
+            out[cells] = closest_points(buffer, self.closest, points, overwrite=True)
+        return out
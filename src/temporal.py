@@ -0,0 +1,112 @@
+import numpy as np
+
+
+class EmaFilter:
+    """
+    Exponential moving average of every cell point.
+    """
+
+    def __init__(self, cells, alpha=0.5):
+        """
+        :param cells: (int) cells per frame
+        :param alpha: (float 0-1] weight of the newest frame, 1 disables smoothing
+        """
+        if not 0 < alpha <= 1:
+            raise ValueError("Alpha must be greater than 0 and at most 1")
+        self.alpha = alpha
+        self.state = np.zeros(cells, np.float64)
+        self.primed = False
+
+    def update(self, points):
+        """
+        :param points: (1D array) newest cell points
+        :return: (1D int64 array) filtered cell points
+        """
+        if not self.primed:
+            self.state[:] = points
+            self.primed = True
+        else:
+            # state += alpha * (points - state)
+            self.state += self.alpha * (np.asarray(points, np.float64) - self.state)
+        return np.round(self.state).astype(np.int64)
+
+
+class MedianFilter:
+    """
+    Sliding median of every cell point over the last frames, held in a fixed ring.
+    """
+
+    def __init__(self, cells, frames=5):
+        """
+        :param cells: (int) cells per frame
+        :param frames: (int > 0) frames in the window
+        """
+        if frames <= 0:
+            raise ValueError("Median window must be greater than 0")
+        self.ring = np.zeros((frames, cells), np.int64)
+        self.count = 0
+
+    def update(self, points):
+        """
+        :param points: (1D array) newest cell points
+        :return: (1D int64 array) median cell points of the window
+        """
+        self.ring[self.count % len(self.ring)] = points
+        self.count += 1
+        window = self.ring[:min(self.count, len(self.ring))]
+        return np.round(np.median(window, axis=0)).astype(np.int64)
+
+
+class BandHysteresis:
+    """
+    Holds every cell in its powermap band until its point leaves the band by more than a margin,
+    so points near a band edge do not toggle the motor intensity.
+    """
+
+    def __init__(self, cells, edges, margin=50):
+        """
+        :param cells: (int) cells per frame
+        :param edges: (1D array) ascending band edges in millimetres, e.g. Powermap.edges
+        :param margin: (int >= 0) millimetres a point must pass a band edge by to change band
+        """
+        if margin < 0:
+            raise ValueError("Margin must not be negative")
+        self.margin = margin
+        # band b spans lower[b] <= point < upper[b]
+        self.lower = np.concatenate(([np.iinfo(np.int64).min // 2], edges)).astype(np.int64)
+        self.upper = np.concatenate((edges, [np.iinfo(np.int64).max // 2])).astype(np.int64)
+        self.edges = np.asarray(edges)
+        self.bands = np.full(cells, -1, np.int64)  # unknown until first frame
+
+    def update(self, points):
+        """
+        :param points: (1D array) newest cell points
+        :return: (1D int64 array) points, clamped into the held band of cells that did not change band
+        """
+        points = np.asarray(points, np.int64)
+        bands = np.searchsorted(self.edges, points, side="right")
+
+        lower = self.lower[self.bands]
+        upper = self.upper[self.bands]
+        hold = (self.bands >= 0) & (points >= lower - self.margin) & (points < upper + self.margin)
+        self.bands = np.where(hold, self.bands, bands)
+        return np.where(hold, np.clip(points, lower, upper - 1), points)
+
+
+class FilterChain:
+    """
+    Applies filters in order, e.g. median then hysteresis.
+    """
+
+    def __init__(self, filters):
+        self.filters = list(filters)
+
+    def update(self, points):
+        """
+        :param points: (1D array) newest cell points
+        :return: (1D int64 array) filtered cell points
+        """
+        points = np.asarray(points, np.int64)
+        for point_filter in self.filters:
+            points = point_filter.update(points)
+        return points
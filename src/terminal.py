@@ -0,0 +1,68 @@
+import sys
+import time
+
+import numpy as np
+
+CURSOR_HOME = "\x1b[H"
+CLEAR_SCREEN = "\x1b[2J"
+CLEAR_TO_END = "\x1b[J"
+HIDE_CURSOR = "\x1b[?25l"
+SHOW_CURSOR = "\x1b[?25h"
+
+
+class StatusRenderer:
+    """
+    Terminal status display of the meter map and frame rate. Repaints in place with ANSI escapes
+    at a limited rate instead of clearing the screen on every frame.
+    """
+
+    def __init__(self, ver_cells, hor_cells, rate=10, headless=False, stream=None):
+        """
+        :param ver_cells: (int) vertical cells
+        :param hor_cells: (int) horizontal cells
+        :param rate: (float > 0) maximum redraws per second
+        :param headless: (bool) draw nothing
+        :param stream: (file) terminal output, stdout by default
+        """
+        if rate <= 0:
+            raise ValueError("Redraw rate must be greater than 0")
+        self.period = 1 / rate
+        self.headless = headless
+        self.stream = sys.stdout if stream is None else stream
+        self.last = None
+
+        # preallocated meter buffer and fixed width grid format
+        self.meters = np.zeros(ver_cells * hor_cells, np.float64)
+        self.template = CURSOR_HOME + ("%5.1f" * hor_cells + "\n") * ver_cells + \
+            "------ %5.1f fps ----- %5.1f average fps ------\n" + CLEAR_TO_END
+
+    def render(self, points, fps, average_fps):
+        """
+        Redraws the display unless headless or the last redraw is more recent than the redraw period.
+        :param points: (1D array) cell points in millimetres
+        :param fps: (float) current frame rate
+        :param average_fps: (float) session frame rate
+        :return: (bool) True if the display was redrawn
+        """
+        if self.headless:
+            return False
+        now = time.monotonic()
+        if self.last is not None and now - self.last < self.period:
+            return False
+        if self.last is None:
+            self.stream.write(HIDE_CURSOR + CLEAR_SCREEN)
+        self.last = now
+
+        np.divide(points, 1000, out=self.meters)
+        self.stream.write(self.template % (tuple(self.meters.tolist()) + (fps, average_fps)))
+        self.stream.flush()
+        return True
+
+    def close(self):
+        """
+        Restores the cursor.
+        :return: None
+        """
+        if not self.headless and self.last is not None:
+            self.stream.write(SHOW_CURSOR)
+            self.stream.flush()
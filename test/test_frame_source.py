@@ -0,0 +1,234 @@
+import functools
+import os
+import tempfile
+import threading
+import time
+import unittest
+import cv2
+import numpy as np
+from src.frame_source import (COMPRESSIONS, PROFILES, CaptureProfile, CompressedFrames, FrameRing, FrameSource,
+                              ProfileSource, ReplaySource, SessionRecorder, StereoSource, SyntheticSource,
+                              load_session, open_source, save_session)
+from src.stereo_depth import DisparityEngine
+from src.stereo_scene import decimate
+
+
+class TestSyntheticSource(unittest.TestCase):
+
+    def test_read(self):
+        source = SyntheticSource(48, 64)
+        depth_map, color_map = source.read()
+        self.assertEqual(depth_map.shape, (48, 64))
+        self.assertEqual(depth_map.dtype, np.uint16)
+        self.assertEqual(color_map.shape, (48, 64, 3))
+        self.assertTrue((depth_map == 0).any())  # depth shadows
+
+        np.testing.assert_array_equal(SyntheticSource(48, 64).read()[0], depth_map)  # seeded scenes repeat
+        self.assertIsNone(SyntheticSource(48, 64, color=False).read()[1])
+        self.assertIsNone(open_source("synthetic", realtime=False, height=48, width=64, color=False).read()[1])
+
+
+class TestReplaySource(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = directory.name
+        source = SyntheticSource(12, 16)
+        self.frames = [source.read() for _ in range(4)]
+        save_session(self.path, [frame[0] for frame in self.frames], np.arange(4) * 0.02,
+                     [frame[1] for frame in self.frames])
+
+    def test_load_session(self):
+        session = load_session(self.path)
+        self.assertIsInstance(session["depth"], np.memmap)
+        self.assertEqual(session["depth"].shape, (4, 12, 16))
+        self.assertEqual(session["color"].shape, (4, 12, 16, 3))
+        np.testing.assert_array_equal(session["timestamps"], np.arange(4) * 0.02)
+
+    def test_replay(self):
+        source = ReplaySource(self.path, realtime=False)
+        self.assertEqual(source.shape, (12, 16))
+        for depth_map, color_map in self.frames:
+            replayed = source.read()
+            np.testing.assert_array_equal(replayed[0], depth_map)
+            np.testing.assert_array_equal(replayed[1], color_map)
+        self.assertRaises(StopIteration, source.read)
+
+    def test_replay_loop(self):
+        source = ReplaySource(self.path, realtime=False, loop=True)
+        for _ in range(5):
+            depth_map, _ = source.read()
+        np.testing.assert_array_equal(depth_map, self.frames[0][0])
+
+    def test_replay_realtime(self):
+        source = ReplaySource(self.path, realtime=True)
+        start = time.monotonic()
+        for _ in range(4):
+            source.read()
+        self.assertGreaterEqual(time.monotonic() - start, 0.06)  # recorded 20 ms spacing
+
+
+class TestStereoSource(unittest.TestCase):
+
+    def test_still_pair(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = directory.name
+        texture = np.random.default_rng(0).integers(0, 256, (60, 88)).astype(np.uint8)
+        cv2.imwrite(os.path.join(path, "left.png"), texture[:, :-8])
+        cv2.imwrite(os.path.join(path, "right.png"), texture[:, 8:])
+
+        engine = functools.partial(DisparityEngine, focal_length=700, baseline=60, num_disparities=16, block_size=9)
+        source = StereoSource(os.path.join(path, "left.png"), os.path.join(path, "right.png"), engine)
+        self.addCleanup(source.close)
+        self.assertEqual(source.shape, (60, 80))
+        depth_map, color_map = source.read()
+        self.assertEqual(depth_map.dtype, np.uint16)
+        self.assertAlmostEqual(np.median(depth_map[:, 40:]), 700 * 60 / 8, delta=100)  # subpixel disparity
+        self.assertEqual(color_map.shape, (60, 80, 3))
+
+        self.assertRaises(ValueError, StereoSource, os.path.join(path, "none.png"), 99, engine)  # Missing inputs
+
+
+class TestSessionRecorder(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = directory.name
+        source = SyntheticSource(12, 16)
+        self.frames = [source.read() for _ in range(7)]
+
+    def test_compressions(self):
+        depth_frames = [frame[0] for frame in self.frames]
+        for compression in COMPRESSIONS:
+            path = os.path.join(self.path, compression)
+            recorder = SessionRecorder(path, (12, 16), compression=compression, keyframe=3)
+            for index, depth_map in enumerate(depth_frames):
+                self.assertTrue(recorder.record(depth_map, index * 0.02))
+            recorder.close()
+
+            session = load_session(path)
+            self.assertEqual(session["depth"].shape, (7, 12, 16))
+            self.assertIsInstance(session["depth"], np.memmap if compression == "none" else CompressedFrames)
+            np.testing.assert_array_equal(session["depth"][:], depth_frames)
+            for index in (5, 1, 6, 4):  # seeks back and forth across delta keyframes
+                np.testing.assert_array_equal(session["depth"][index], depth_frames[index])
+            np.testing.assert_array_equal(session["timestamps"], np.arange(7) * 0.02)
+            self.assertIsNone(session["color"])
+
+        self.assertRaises(ValueError, SessionRecorder, self.path, (12, 16), compression="lzma")
+
+    def test_color_replay(self):
+        recorder = SessionRecorder(self.path, (12, 16), color=True, compression="zlib", color_scale=4)
+        for index, (depth_map, color_map) in enumerate(self.frames):
+            recorder.record(depth_map, index / 30, color_map)
+        recorder.close()
+
+        self.assertEqual(load_session(self.path)["color"].shape, (7, 3, 4, 3))
+        source = ReplaySource(self.path, realtime=False)
+        depth_map, color_map = source.read()
+        np.testing.assert_array_equal(depth_map, self.frames[0][0])
+        self.assertEqual(color_map.shape, (12, 16, 3))  # scaled back to the depth shape
+        np.testing.assert_array_equal(color_map[::4, ::4], self.frames[0][1][::4, ::4])
+
+    def test_drops_when_behind(self):
+        recorder = SessionRecorder(self.path, (12, 16), slots=2)
+        writing = threading.Event()
+        write = recorder.write
+        recorder.write = lambda slot: (writing.wait(5), write(slot))  # a stalled disk
+        results = [recorder.record(depth_map, index) for index, (depth_map, _) in enumerate(self.frames)]
+        writing.set()
+        recorder.close()
+
+        self.assertEqual(results, [True, True] + [False] * 5)
+        self.assertEqual((recorder.frames, recorder.dropped), (2, 5))
+        np.testing.assert_array_equal(load_session(self.path)["depth"], [frame[0] for frame in self.frames[:2]])
+
+
+class FrameList(FrameSource):
+
+    def __init__(self, frames):
+        self.frames = iter(frames)
+
+    def read(self):
+        return next(self.frames)
+
+
+class TestProfileSource(unittest.TestCase):
+
+    def test_decimation(self):
+        depth_map = np.random.default_rng(0).integers(300, 5000, (48, 64)).astype(np.uint16)
+        color_map = np.zeros((48, 64, 3), np.uint8)
+        profile = CaptureProfile(64, 48, 30, decimation=2)
+        source = ProfileSource(FrameList([(depth_map, color_map)]), profile,
+                               functools.partial(decimate, method="median"))
+        self.assertEqual(source.shape, (24, 32))
+        filtered, color = source.read()
+        np.testing.assert_array_equal(filtered, decimate(depth_map, 2, "median"))
+        self.assertEqual(color.shape, (24, 32, 3))
+
+        self.assertRaises(ValueError, ProfileSource, FrameList([]), profile)  # Decimation without decimate
+        self.assertRaises(ValueError, CaptureProfile, 64, 48, 30, decimation=0)
+
+    def test_resize(self):
+        source = ProfileSource(SyntheticSource(48, 64), CaptureProfile(32, 24, 30))
+        depth_map, color_map = source.read()
+        self.assertEqual(depth_map.shape, (24, 32))
+        self.assertEqual(color_map.shape, (24, 32, 3))
+
+    def test_temporal(self):
+        frames = [np.full((4, 4), 1000, np.uint16), np.full((4, 4), 1010, np.uint16)]
+        frames[1][0, 0] = 2000  # moved, restarts averaging
+        frames[1][0, 1] = 0  # shadow
+        source = ProfileSource(FrameList([(frame, None) for frame in frames]), CaptureProfile(4, 4, 30, temporal=True))
+        np.testing.assert_array_equal(source.read()[0], frames[0])
+        depth_map = source.read()[0]
+        self.assertEqual(depth_map[1, 1], 1004)  # 1000 + 0.4 * 10
+        self.assertEqual(depth_map[0, 0], 2000)
+        self.assertEqual(depth_map[0, 1], 0)
+
+    def test_open_source(self):
+        source = open_source("synthetic", realtime=False, profile=PROFILES["fast_decimated"],
+                             decimate=functools.partial(decimate, method="median"))
+        self.assertEqual(source.shape, (240, 424))
+        self.assertEqual(source.read()[0].shape, (240, 424))
+
+
+class TestFrameRing(unittest.TestCase):
+
+    def test_store(self):
+        ring = FrameRing((2, 3), size=2)
+        depth_map = np.arange(6, dtype=np.uint16).reshape(2, 3)
+        first_slot, first, color = ring.store(depth_map)
+        self.assertIsNone(color)
+        np.testing.assert_array_equal(first, depth_map)
+        self.assertFalse(np.shares_memory(first, depth_map))
+
+        second_slot, second, color = ring.store(depth_map + 1, np.ones((4, 4, 3), np.uint8))  # color shape may differ
+        self.assertEqual(color.shape, (4, 4, 3))
+        self.assertIsNone(ring.store(depth_map + 2))  # every slot taken, the frame is dropped
+        self.assertEqual(ring.dropped, 1)
+        np.testing.assert_array_equal(first, depth_map)
+
+        ring.release(first_slot)
+        third_slot, third, _ = ring.store(depth_map + 2)
+        self.assertEqual(third_slot, first_slot)
+        self.assertTrue(np.shares_memory(first, third))  # released slot reused
+        np.testing.assert_array_equal(second, depth_map + 1)
+
+        self.assertRaises(ValueError, FrameRing, (2, 3), 0)  # Empty ring
+
+
+class TestOpenSource(unittest.TestCase):
+
+    def test_open_source(self):
+        self.assertIsInstance(open_source("synthetic", height=24, width=32), SyntheticSource)
+        self.assertRaises(ValueError, open_source, "replay")  # Replay without session
+        self.assertRaises(ValueError, open_source, "webcam")  # Unknown source
+        self.assertRaises(ValueError, open_source, "stereo")  # Stereo without inputs
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,166 @@
+import time
+import unittest
+import numpy as np
+from src.haptics import FakeI2C, HapticOutput, HapticScheduler, duty_registers
+from src.instrumentation import Instrumentation
+
+
+class FlakyI2C(FakeI2C):
+    """
+    Fails the given number of writes, like a bus glitch.
+    """
+
+    def __init__(self, failures):
+        super().__init__()
+        self.failures = failures
+
+    def write(self, register, data):
+        if self.failures:
+            self.failures -= 1
+            raise OSError(121, "Remote I/O error")
+        super().write(register, data)
+
+
+class TestDutyRegisters(unittest.TestCase):
+
+    def test_duty_registers(self):
+        registers = np.frombuffer(duty_registers([0, 25000, 65535]), dtype="<u2").reshape(3, 2)
+        np.testing.assert_array_equal(registers, [[0, 0x1000],  # fully off
+                                                  [0, 25000 >> 4],
+                                                  [0x1000, 0]])  # fully on
+
+
+class TestHapticOutput(unittest.TestCase):
+
+    def test_first_update_single_block(self):
+        bus = FakeI2C()
+        output = HapticOutput(bus, 15)
+        self.assertEqual(output.update(np.full(15, 45000)), 15)
+        self.assertEqual(bus.transactions, 1)
+        self.assertEqual(bus.bytes, 1 + 15 * 4)
+        self.assertEqual(bus.counts(14), (0, 45000 >> 4))
+
+    def test_only_changed_channels(self):
+        bus = FakeI2C()
+        output = HapticOutput(bus, 15)
+        duties = np.zeros(15)
+        output.update(duties)
+
+        self.assertEqual(output.update(duties), 0)  # unchanged frame writes nothing
+        self.assertEqual(bus.transactions, 1)
+
+        duties[4] = 65000
+        self.assertEqual(output.update(duties), 1)
+        self.assertEqual((bus.transactions, bus.bytes), (2, 61 + 5))
+        self.assertEqual(bus.counts(4), (0, 65000 >> 4))
+
+        duties[[2, 9]] = 35000
+        self.assertEqual(output.update(duties), 2)
+        self.assertEqual((bus.transactions, bus.bytes), (3, 66 + 1 + 8 * 4))  # one block, channels 2-9
+        self.assertEqual(bus.counts(4), (0, 65000 >> 4))
+
+        output.stop()
+        self.assertTrue(all(bus.counts(channel) == (0, 0x1000) for channel in range(15)))
+
+    def test_failed_write_retries(self):
+        bus = FlakyI2C(1)
+        stats = Instrumentation()
+        output = HapticOutput(bus, 3, stats)
+        self.assertEqual(output.update([100, 200, 300]), 0)  # write failed, nothing raised
+        self.assertEqual((output.errors, output.failures, stats.counters["i2c_errors"]), (1, 1, 1))
+        np.testing.assert_array_equal(output.duty, [-1, -1, -1])
+
+        self.assertEqual(output.update([100, 200, 300]), 3)  # same frame retried in full
+        self.assertEqual(output.failures, 0)
+        self.assertEqual(bus.counts(2), (0, 300 >> 4))
+
+    def test_channel_count(self):
+        self.assertRaises(ValueError, HapticOutput, FakeI2C(), 17)  # PCA9685 has 16 channels
+        self.assertRaises(ValueError, HapticOutput(FakeI2C(), 15).update, np.zeros(16))
+
+
+
+class TestHapticScheduler(unittest.TestCase):
+
+    def test_ramp(self):
+        output = HapticOutput(FakeI2C(), 3)
+        scheduler = HapticScheduler(output, rate=100, slew=100000)  # 1000 per tick
+        scheduler.set_target([2500, 0, 500])
+        for _ in range(2):
+            scheduler.tick()
+        np.testing.assert_array_equal(output.duty, [2000, 0, 500])
+        scheduler.tick()
+        np.testing.assert_array_equal(output.duty, [2500, 0, 500])
+
+        scheduler.set_target([0, 0, 500])  # ramps down as smoothly
+        self.assertEqual(scheduler.tick(), 1)
+        np.testing.assert_array_equal(output.duty, [1500, 0, 500])
+        self.assertEqual(scheduler.ticks, 4)
+
+        self.assertRaises(ValueError, HapticScheduler, output, 0)
+
+    def test_double_buffer(self):
+        output = HapticOutput(FakeI2C(), 2)
+        scheduler = HapticScheduler(output, slew=None)
+        target = np.array([1000, 2000])
+        scheduler.set_target(target)
+        target[0] = 0  # the scheduler holds its own copy
+        scheduler.tick()
+        np.testing.assert_array_equal(output.duty, [1000, 2000])
+
+        scheduler.set_target([3000, 4000])
+        self.assertEqual(scheduler.front, 0)
+        np.testing.assert_array_equal(scheduler.targets[1], [1000, 2000])  # previous buffer untouched
+        scheduler.tick()
+        np.testing.assert_array_equal(output.duty, [3000, 4000])
+
+    def test_stale_target_ramps_off(self):
+        now = [0.0]
+        output = HapticOutput(FakeI2C(), 1)
+        scheduler = HapticScheduler(output, slew=None, stale=0.5, clock=lambda: now[0])
+        scheduler.set_target([30000])
+        scheduler.tick()
+        self.assertEqual(output.duty[0], 30000)
+        now[0] = 1.0  # no frame for a second
+        scheduler.tick()
+        self.assertEqual(output.duty[0], 0)
+
+    def test_thread_ticks(self):
+        output = HapticOutput(FakeI2C(), 2)
+        scheduler = HapticScheduler(output, rate=200, slew=None)
+        scheduler.set_target([1000, 1000])
+        scheduler.start()
+        deadline = time.perf_counter() + 5
+        while scheduler.ticks < 5 and time.perf_counter() < deadline:
+            time.sleep(0.01)
+        scheduler.stop()
+        self.assertGreaterEqual(scheduler.ticks, 5)
+        self.assertFalse(scheduler.is_alive())
+        np.testing.assert_array_equal(output.duty, [1000, 1000])
+
+    def test_thread_survives_write_errors(self):
+        output = HapticOutput(FlakyI2C(2), 2)
+        scheduler = HapticScheduler(output, rate=200, slew=None)
+        scheduler.set_target([1000, 1000])
+        scheduler.start()
+        deadline = time.perf_counter() + 5
+        while scheduler.ticks < 5 and time.perf_counter() < deadline:
+            time.sleep(0.01)
+        scheduler.stop()
+        self.assertEqual(output.errors, 2)
+        np.testing.assert_array_equal(output.duty, [1000, 1000])  # written on the third tick
+
+    def test_persistent_errors_reported(self):
+        errors = []
+        output = HapticOutput(FlakyI2C(1000), 2)
+        scheduler = HapticScheduler(output, rate=200, slew=None, max_failures=3, on_error=errors.append)
+        scheduler.set_target([1000, 1000])
+        scheduler.start()
+        scheduler.join(5)
+        self.assertFalse(scheduler.is_alive())
+        self.assertEqual(len(errors), 1)
+        self.assertIsInstance(errors[0].__cause__, OSError)
+
+
+if __name__ == '__main__':
+    unittest.main()
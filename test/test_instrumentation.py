@@ -0,0 +1,116 @@
+import csv
+import json
+import os
+import tempfile
+import threading
+import time
+import tracemalloc
+import unittest
+import numpy as np
+from src.instrumentation import AllocationGuard, Instrumentation, LatencyRing
+
+
+class TestLatencyRing(unittest.TestCase):
+
+    def test_fixed_memory(self):
+        ring = LatencyRing(4)
+        for seconds in range(10):
+            ring.record(seconds)
+        self.assertEqual(ring.count, 10)
+        self.assertEqual(sorted(ring.window()), [6, 7, 8, 9])  # oldest samples overwritten
+        self.assertEqual(ring.peak, 9)
+
+        self.assertRaises(ValueError, LatencyRing, 0)  # Empty ring
+
+
+class TestInstrumentation(unittest.TestCase):
+
+    def test_summary(self):
+        stats = Instrumentation(size=100)
+        for milliseconds in range(1, 101):
+            stats.record("get_points", milliseconds / 1000)
+        summary = stats.summary()["get_points"]
+        self.assertEqual(summary["count"], 100)
+        self.assertAlmostEqual(summary["p50_ms"], np.percentile(np.arange(1, 101), 50))
+        self.assertAlmostEqual(summary["p99_ms"], np.percentile(np.arange(1, 101), 99))
+        self.assertAlmostEqual(summary["max_ms"], 100)
+
+    def test_timer(self):
+        stats = Instrumentation()
+        with stats.time("capture"):
+            time.sleep(0.01)
+        self.assertEqual(stats.count("capture"), 1)
+        self.assertEqual(stats.count("display"), 0)
+        self.assertGreaterEqual(stats.summary()["capture"]["max_ms"], 10)
+
+    def test_export_csv(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, "stats.csv")
+        stats = Instrumentation(path=path, interval=0)
+        stats.record("pwm", 0.002)
+        stats.tick()
+        stats.tick()
+        with open(path) as file:
+            rows = list(csv.DictReader(file))
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(rows[0]["stage"], "pwm")
+        self.assertEqual(float(rows[0]["p95_ms"]), 2.0)
+
+    def test_export_json(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, "stats.jsonl")
+        stats = Instrumentation(path=path, interval=3600)
+        stats.record("pwm", 0.002)
+        stats.tick()  # interval not reached
+        self.assertFalse(os.path.exists(path))
+        stats.export()
+        with open(path) as file:
+            line = json.loads(file.readline())
+        self.assertEqual(line["stages"]["pwm"]["count"], 1)
+
+    def test_counters(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, "stats.csv")
+        stats = Instrumentation(path=path)
+        stats.add("skipped_cells", 12)
+        stats.add("skipped_cells", 3)
+        stats.export()
+        with open(path) as file:
+            rows = list(csv.DictReader(file))
+        self.assertEqual(rows[0]["stage"], "skipped_cells")
+        self.assertEqual(int(rows[0]["count"]), 15)
+
+    def test_counters_threads(self):
+        stats = Instrumentation()
+
+        def add():
+            for _ in range(10000):
+                stats.add("dropped_frames")
+
+        threads = [threading.Thread(target=add) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(stats.counters["dropped_frames"], 40000)
+
+
+class TestAllocationGuard(unittest.TestCase):
+
+    def test_guard(self):
+        guard = AllocationGuard(limit=100000, warmup=1)
+        self.addCleanup(tracemalloc.stop)
+        with guard:
+            np.zeros(1000000)  # warmup block is not checked
+        with guard:
+            np.zeros(1000)
+        with self.assertRaises(AssertionError):
+            with guard:
+                np.zeros(1000000)  # freed temporaries count at their peak
+
+
+if __name__ == '__main__':
+    unittest.main()
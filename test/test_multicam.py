@@ -0,0 +1,88 @@
+import functools
+import unittest
+import numpy as np
+from src.multicam import FAR_POINT, CameraWorker, MultiCamera
+from src.stereo_scene import ScenePlan
+
+PLAN = functools.partial(ScenePlan, ver_cells=3, hor_cells=5)
+
+
+def collect(cameras, frames):
+    results = []
+    while len(results) < frames:
+        result = cameras.collect(timeout=5)
+        if result is None:
+            raise AssertionError("No processed frame within the timeout")
+        results.append(result)
+    return results
+
+
+class TestMultiCamera(unittest.TestCase):
+
+    def test_matches_plan(self):
+        rng = np.random.default_rng(0)
+        depth_map = rng.integers(300, 5000, (120, 160), dtype=np.uint16)
+        cameras = MultiCamera([depth_map.shape], PLAN, 15)
+        try:
+            cameras.start()
+            self.assertTrue(cameras.submit(0, depth_map, captured=1.5))
+            [(captured, points)] = collect(cameras, 1)
+        finally:
+            cameras.close()
+        self.assertEqual(captured, 1.5)
+        np.testing.assert_array_equal(points, ScenePlan(depth_map.shape, 3, 5).process(depth_map))
+
+    def test_merge_closest(self):
+        near = np.full((120, 160), 500, np.uint16)
+        far = np.full((60, 80), 3000, np.uint16)
+        far[:20, :16] = 300  # top left cell of the second camera is closest
+        cameras = MultiCamera([near.shape, far.shape], PLAN, 15, depth_limit=2000)
+        try:
+            cameras.start()
+            cameras.submit(1, far)
+            collect(cameras, 1)
+            cameras.submit(0, near)
+            [(_, points)] = collect(cameras, 1)
+        finally:
+            cameras.close()
+        expected = np.full(15, 500)
+        expected[0] = 300
+        np.testing.assert_array_equal(points, expected)
+
+    def test_channel_maps(self):
+        depth_map = np.full((60, 80), 800, np.uint16)
+        channels = np.full(15, -1)
+        channels[:5] = np.arange(5)  # only the top row drives motors
+        cameras = MultiCamera([depth_map.shape], PLAN, 15, channel_maps=[channels], motors=6)
+        try:
+            cameras.start()
+            cameras.submit(0, depth_map)
+            [(_, points)] = collect(cameras, 1)
+        finally:
+            cameras.close()
+        np.testing.assert_array_equal(points, [800] * 5 + [FAR_POINT])
+
+        self.assertRaises(ValueError, MultiCamera, [(60, 80)], PLAN, 15, channel_maps=[np.arange(14)])
+        self.assertRaises(ValueError, MultiCamera, [(60, 80)], PLAN, 15, motors=10)
+
+
+class TestCameraWorker(unittest.TestCase):
+
+    def test_drops_when_ring_full(self):
+        worker = CameraWorker(0, (60, 80), PLAN, 15, done=None, ring_size=2)
+        try:
+            depth_map = np.zeros((60, 80), np.uint16)
+            self.assertTrue(worker.submit(depth_map))
+            self.assertTrue(worker.submit(depth_map))
+            self.assertFalse(worker.submit(depth_map))  # worker never started, every slot in use
+            self.assertEqual(worker.dropped, 1)
+            worker.release(0)
+            self.assertTrue(worker.submit(depth_map))
+        finally:
+            worker.close()
+
+        self.assertRaises(ValueError, CameraWorker, 0, (60, 80), PLAN, 15, None, ring_size=0)
+
+
+if __name__ == '__main__':
+    unittest.main()
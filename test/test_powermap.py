@@ -0,0 +1,78 @@
+import json
+import os
+import tempfile
+import unittest
+import numpy as np
+from src.powermap import (DEPTH_RANGE, STEPPED_EDGES, Powermap, linear_curve, log_curve, response_curve,
+                          stepped_curve)
+from src.stereo_scene import StereoScene
+
+
+class TestCurves(unittest.TestCase):
+
+    def test_stepped_matches_scene_powermap(self):
+        curve = stepped_curve()
+        self.assertEqual(curve.shape, (DEPTH_RANGE,))
+        for depth in (0, 199, 200, 399, 400, 799, 999, 1000, 9999, DEPTH_RANGE - 1):
+            self.assertEqual(curve[depth], StereoScene.powermap(depth))
+
+        self.assertRaises(ValueError, stepped_curve, (200, 400), (1, 2))  # Missing a band duty
+        self.assertRaises(ValueError, stepped_curve, (400, 200), (1, 2, 3))  # Decreasing edges
+
+    def test_linear(self):
+        curve = linear_curve(near=200, far=1000, max_duty=65000, min_duty=25000)
+        np.testing.assert_array_equal(curve[[0, 200, 600, 1000, 5000]], [65000, 65000, 45000, 0, 0])
+        self.assertTrue(np.all(np.diff(curve[200:1000].astype(np.int64)) <= 0))
+
+        self.assertRaises(ValueError, linear_curve, 1000, 200)  # Near beyond far
+
+    def test_log(self):
+        curve = log_curve(near=200, far=1000, max_duty=65000, min_duty=25000)
+        self.assertEqual(curve[100], 65000)
+        self.assertAlmostEqual(int(curve[447]), 45000, delta=50)  # geometric middle of the range
+        self.assertEqual(curve[1000], 0)
+        self.assertLess(curve[600], linear_curve()[600])  # most of the fall is at close range
+
+        self.assertRaises(ValueError, log_curve, 0)
+        self.assertRaises(ValueError, response_curve, "cubic")
+
+
+class TestPowermap(unittest.TestCase):
+
+    def test_map(self):
+        powermap = Powermap(4)
+        np.testing.assert_array_equal(powermap.map(np.array([150, 450, 999, 65535])), [65000, 45000, 25000, 0])
+
+    def test_edges(self):
+        np.testing.assert_array_equal(Powermap(2).edges, STEPPED_EDGES)
+        powermap = Powermap(2, stepped_curve((300, 900), (9, 5, 0)), edges=(300, 900))
+        np.testing.assert_array_equal(powermap.edges, [300, 900])
+        self.assertIsNone(Powermap(2, linear_curve()).edges)  # no bands to hold
+
+    def test_gains(self):
+        powermap = Powermap(3, gains=[1, 0.5, 2])
+        np.testing.assert_array_equal(powermap.map(np.array([100, 100, 100])), [65000, 32500, 65535])
+
+        self.assertRaises(ValueError, Powermap, 3, gains=[1, 1])
+        self.assertRaises(ValueError, Powermap, 3, np.zeros(10))  # Curve not covering every depth
+
+    def test_load(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "curve.json")
+            with open(path, "w") as file:
+                json.dump({"curve": "linear", "near": 500, "far": 2000, "gains": [1, 0]}, file)
+            powermap = Powermap.load(path, 2)
+            np.testing.assert_array_equal(powermap.map(np.array([500, 500])), [65000, 0])
+            np.testing.assert_array_equal(powermap.table[0], linear_curve(500, 2000))
+
+            powermap = Powermap.load(path, 2, gains=[1, 1])  # explicit gains replace the file's
+            np.testing.assert_array_equal(powermap.map(np.array([500, 1999])), [65000, 25027])
+            self.assertIsNone(powermap.edges)
+
+            with open(path, "w") as file:
+                json.dump({"curve": "stepped", "edges": [300, 900], "duties": [9, 5, 0]}, file)
+            np.testing.assert_array_equal(Powermap.load(path, 2).edges, [300, 900])
+
+
+if __name__ == '__main__':
+    unittest.main()
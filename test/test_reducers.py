@@ -0,0 +1,67 @@
+import unittest
+import numpy as np
+from src.reducers import (CellReduction, ClosestMean, HistogramMode, Mean, Percentile, SharedCells, TrimmedMean,
+                          named_reducer)
+from src.stereo_scene import StereoScene, closest_points
+
+
+class TestSharedCells(unittest.TestCase):
+
+    def test_partition(self):
+        cells = np.random.default_rng(9).integers(0, 10000, (4, 10, 12)).astype(np.uint16)
+        shared = SharedCells(cells, kth=(0, 11, 60, 119, 60))
+        ordered = np.sort(cells.reshape(4, -1), axis=1)
+        for k in (0, 11, 60, 119):
+            np.testing.assert_array_equal(shared.order(k), ordered[:, k])
+        np.testing.assert_array_equal(np.sort(shared.partition()[:, 12:60], axis=1), ordered[:, 12:60])
+        self.assertFalse(np.shares_memory(shared.pixels, cells))  # copied unless overwritten
+
+    def test_histogram(self):
+        cells = np.array([[[100, 120], [130, 900]], [[400, 420], [0, 0]]], np.uint16)
+        shared = SharedCells(cells)
+        histogram = shared.histogram(100)
+        np.testing.assert_array_equal(histogram[0, :2], [0, 3])
+        np.testing.assert_array_equal(histogram[1, [0, 4]], [2, 2])
+        self.assertIs(shared.histogram(100), histogram)  # computed once
+
+
+class TestCellReduction(unittest.TestCase):
+
+    def setUp(self):
+        self.cells = np.random.default_rng(10).integers(200, 10000, (6, 20, 30)).astype(np.uint16)
+        self.ordered = np.sort(self.cells.reshape(6, -1), axis=1)
+
+    def test_compute(self):
+        reduction = CellReduction([ClosestMean(), Percentile(0, "min"), Percentile(10), TrimmedMean(0.1, 0.2),
+                                   Mean(), HistogramMode(1000)])
+        results = reduction.compute(self.cells)
+        self.assertEqual(results.dtype.names, ("closest", "min", "p10", "trimmed", "mean", "mode"))
+        self.assertEqual(results.shape, (6,))
+        np.testing.assert_array_equal(results["closest"], closest_points(self.cells))
+        np.testing.assert_array_equal(results["min"], self.ordered[:, 0])
+        np.testing.assert_array_equal(results["p10"], self.ordered[:, int(599 * 0.1)])
+        np.testing.assert_allclose(results["trimmed"], self.ordered[:, 60:480].mean(axis=1))
+        np.testing.assert_allclose(results["mean"], self.cells.mean(axis=(1, 2)))
+        self.assertTrue(((results["mode"] - 500) % 1000 == 0).all())  # bin centers
+
+    def test_overwrite(self):
+        cells = self.cells.copy()
+        results = CellReduction([Percentile(50)]).compute(cells, overwrite=True)
+        np.testing.assert_array_equal(results["p50"], self.ordered[:, 299])
+        self.assertFalse((cells == self.cells).all())  # reordered in place
+
+    def test_scene(self):
+        scene = StereoScene(self.cells[0], None, 2, 3)
+        scene.get_cells()
+        scene.get_points()
+        results = scene.reduce_cells(CellReduction([named_reducer("closest"), named_reducer("p5")]))
+        np.testing.assert_array_equal(results["closest"], scene.points)
+
+    def test_errors(self):
+        self.assertRaises(ValueError, CellReduction, [Mean(), Mean()])  # Duplicate names
+        self.assertRaises(ValueError, TrimmedMean, 0.5, 0.5)  # Nothing left
+        self.assertRaises(ValueError, named_reducer, "max")  # Unknown reducer
+
+
+if __name__ == '__main__':
+    unittest.main()
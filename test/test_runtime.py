@@ -0,0 +1,172 @@
+import itertools
+import threading
+import time
+import unittest
+
+import numpy as np
+
+from src.frame_source import FrameRing
+from src.runtime import LatestQueue, Runtime
+
+
+class TestLatestQueue(unittest.TestCase):
+
+    def test_latest_value_wins(self):
+        queue = LatestQueue(1)
+        self.assertFalse(queue.put(1))
+        self.assertTrue(queue.put(2))  # stale value dropped
+        self.assertEqual(queue.get(timeout=0), 2)
+        self.assertEqual(queue.dropped, 1)
+        self.assertIsNone(queue.get(timeout=0))
+
+    def test_bounded_size(self):
+        queue = LatestQueue(2)
+        for item in range(5):
+            queue.put(item)
+        self.assertEqual([queue.get(timeout=0), queue.get(timeout=0)], [3, 4])
+        self.assertEqual(queue.dropped, 3)
+
+        self.assertRaises(ValueError, LatestQueue, 0)  # Zero size queue
+
+    def test_on_drop(self):
+        dropped = []
+        queue = LatestQueue(1, dropped.append)
+        queue.put(1)
+        queue.put(2)
+        self.assertEqual(dropped, [1])
+        self.assertEqual(queue.get(timeout=0), 2)
+
+    def test_close_wakes_consumer(self):
+        queue = LatestQueue()
+        threading.Timer(0.05, queue.close).start()
+        self.assertIsNone(queue.get(timeout=5))
+
+
+class TestRuntime(unittest.TestCase):
+
+    def test_stages_pass_results(self):
+        counter = itertools.count()
+        received = []
+        done = threading.Event()
+
+        def actuate(value):
+            received.append(value)
+            if len(received) >= 10:
+                done.set()
+
+        runtime = Runtime()
+        runtime.add_stage("capture", lambda: next(counter))
+        runtime.add_stage("process", lambda value: value * 2)
+        runtime.add_stage("actuate", actuate)
+        runtime.start()
+        self.assertTrue(done.wait(5))
+        runtime.stop()
+
+        self.assertTrue(all(value % 2 == 0 for value in received))
+        self.assertEqual(received, sorted(received))  # frames never arrive out of order
+        self.assertFalse(any(stage.is_alive() for stage in runtime.stages))
+
+    def test_stage_error_stops_runtime(self):
+        def process(value):
+            raise ValueError("bad frame")
+
+        runtime = Runtime()
+        runtime.add_stage("capture", lambda: 1)
+        runtime.add_stage("process", process)
+        runtime.start()
+        self.assertRaises(RuntimeError, runtime.wait, 0.01)
+        runtime.stop()
+        self.assertIsInstance(runtime.error.__cause__, ValueError)
+
+    def test_source_end_stops_runtime(self):
+        frames = iter(range(3))
+        received = []
+
+        runtime = Runtime(queue_size=3)
+        runtime.add_stage("capture", lambda: next(frames))
+        runtime.add_stage("actuate", received.append)
+        runtime.start()
+        runtime.wait(0.01)  # returns without error once frames run out
+        runtime.stop()
+        self.assertIsNone(runtime.error)
+        self.assertEqual(received, [0, 1, 2])
+
+    def test_source_end_drains_stages(self):
+        frames = iter(range(3))
+        received = []
+
+        def process(value):
+            time.sleep(0.02)  # slower than the source, frames are still queued when it ends
+            return value
+
+        runtime = Runtime(queue_size=3)
+        runtime.add_stage("capture", lambda: next(frames))
+        runtime.add_stage("process", process)
+        runtime.add_stage("actuate", received.append)
+        runtime.start()
+        runtime.wait(0.01)
+        runtime.stop()
+        self.assertEqual(received, [0, 1, 2])
+
+    def test_slow_consumer_keeps_its_frame(self):
+        frames = iter(range(45))
+        ring = FrameRing((4, 4), size=5)
+        overwritten = []
+        received = []
+
+        def capture():
+            index = next(frames)
+            time.sleep(0.0005)  # a fast camera
+            stored = ring.store(np.full((4, 4), index, np.uint16))
+            return None if stored is None else (stored[0], stored[1], index)
+
+        def process(frame):
+            slot, depth_map, index = frame
+            time.sleep(0.003)  # a slow stage still reading the frame while later frames are captured
+            if np.any(depth_map != index):
+                overwritten.append(index)
+            return frame
+
+        def actuate(frame):
+            received.append(frame[2])
+            ring.release(frame[0])
+
+        runtime = Runtime(on_drop=lambda frame: ring.release(frame[0]))
+        runtime.add_stage("capture", capture)
+        runtime.add_stage("process", process)
+        runtime.add_stage("actuate", actuate)
+        runtime.start()
+        runtime.wait(0.01)
+        runtime.stop()
+
+        self.assertEqual(overwritten, [])
+        self.assertLess(len(received), 45)  # frames were dropped instead
+        self.assertEqual(received, sorted(received))
+        self.assertEqual(ring.free.qsize(), 5)  # every slot returned
+
+    def test_source_stages(self):
+        counter = itertools.count()
+        submitted = []
+        received = []
+        done = threading.Event()
+
+        def actuate(value):
+            received.append(value)
+            if len(received) >= 10 and submitted:
+                done.set()
+
+        runtime = Runtime()
+        runtime.add_stage("submit", lambda: submitted.append(1))  # side effect only, like a camera feeding a worker
+        runtime.add_stage("merge", lambda: next(counter), source=True)  # a new chain, not fed by submit
+        runtime.add_stage("actuate", actuate)
+        runtime.start()
+        self.assertTrue(done.wait(5))
+        runtime.stop()
+
+        self.assertIsNone(runtime.stages[1].inbox)
+        self.assertIsNone(runtime.stages[0].outbox)
+        self.assertEqual(received, sorted(received))
+
+
+if __name__ == '__main__':
+    unittest.main()
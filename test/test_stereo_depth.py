@@ -0,0 +1,73 @@
+import os
+import tempfile
+import unittest
+import cv2
+import numpy as np
+from src.stereo_depth import DisparityEngine, Rectifier, create_matcher
+
+
+def stereo_pair(shape=(120, 160), shift=8, seed=0):
+    """
+    Random texture seen by a right camera shifted by a constant disparity.
+    """
+    texture = np.random.default_rng(seed).integers(0, 256, (shape[0], shape[1] + shift)).astype(np.uint8)
+    texture = cv2.GaussianBlur(texture, (3, 3), 0)
+    return np.ascontiguousarray(texture[:, :-shift]), np.ascontiguousarray(texture[:, shift:])
+
+
+class TestDisparityEngine(unittest.TestCase):
+
+    def test_bands_match_full_image(self):
+        left = cv2.imread(os.path.join(os.path.dirname(__file__), "..", "assets", "captures", "roomL.png"), 0)
+        right = cv2.imread(os.path.join(os.path.dirname(__file__), "..", "assets", "captures", "roomR.png"), 0)
+        full = create_matcher("bm", 64, 15).compute(left, right)
+        engine = DisparityEngine(left.shape, matcher="bm", bands=4)
+        self.addCleanup(engine.close)
+        self.assertEqual(len(engine.bands), 4)
+        np.testing.assert_array_equal(engine.compute(left, right), full)
+
+    def test_depth_map(self):
+        left, right = stereo_pair(shift=8)
+        engine = DisparityEngine(left.shape, focal_length=700, baseline=60, num_disparities=16, block_size=9,
+                                 bands=2)
+        self.addCleanup(engine.close)
+        depth_map = engine.depth_map(left, right)
+        self.assertEqual(depth_map.dtype, np.uint16)
+        self.assertAlmostEqual(np.median(depth_map[:, 40:]), 700 * 60 / 8, delta=100)  # subpixel disparity
+        self.assertTrue((depth_map[:, :16] == 0).all())  # no match left of the search range is a shadow
+
+    def test_sgbm(self):
+        left, right = stereo_pair(shift=8)
+        engine = DisparityEngine(left.shape, 700, 60, matcher="sgbm", num_disparities=16, block_size=5, bands=3)
+        self.addCleanup(engine.close)
+        self.assertAlmostEqual(np.median(engine.depth_map(left, right)[:, 40:]), 700 * 60 / 8, delta=100)
+
+    def test_errors(self):
+        left, right = stereo_pair()
+        engine = DisparityEngine(left.shape, bands=1)
+        self.assertRaises(ValueError, engine.depth_map, left, right)  # Not calibrated
+        self.assertRaises(ValueError, engine.compute, left[1:], right[1:])  # Shape changed
+        self.assertRaises(ValueError, DisparityEngine, left.shape, matcher="census")  # Unknown matcher
+
+
+class TestRectifier(unittest.TestCase):
+
+    def test_load(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, "calibration.npz")
+        camera = np.array([[700, 0, 80], [0, 700, 60], [0, 0, 1]], np.float64)
+        np.savez(path, left_matrix=camera, left_distortion=np.zeros(5), right_matrix=camera,
+                 right_distortion=np.zeros(5), rotation=np.eye(3), translation=np.array([-60.0, 0, 0]))
+        rectifier = Rectifier.load(path, (120, 160))
+        self.assertAlmostEqual(rectifier.baseline, 60)
+        self.assertGreater(rectifier.focal_length, 0)
+
+        left, right = stereo_pair()
+        rectified = rectifier.rectify(left, right)
+        self.assertIs(rectified[0], rectifier.left)  # buffers reused between pairs
+        self.assertEqual(rectified[1].shape, (120, 160))
+
+
+if __name__ == '__main__':
+    unittest.main()
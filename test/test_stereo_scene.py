@@ -1,57 +1,363 @@
+import math
+import tracemalloc
 import unittest
-from src.stereo_scene import StereoScene
+from src.stereo_scene import StereoScene, ScenePlan, GridAggregator, cell_edges, decimate
+from src.instrumentation import AllocationGuard
 import numpy as np
 
 
-def init_StereoScene(rows, cols, captures):
+def init_StereoScene(rows, cols, ver_cells=1, hor_cells=1):
     """
     :param rows: (int) rows in depth map
     :param cols: (int) columns in depth map
-    :param captures: (cv2.imread()) tuple of cv2 reads
-    :return: (StereoScene) StereoScene object with mock depth map
+    :param ver_cells: (int) vertical cells
+    :param hor_cells: (int) horizontal cells
+    :return: (StereoScene) StereoScene object with mock depth and color maps
     """
-    return StereoScene(np.arange(rows * cols).reshape(rows, cols), captures)
+    return StereoScene(np.arange(rows * cols).reshape(rows, cols), np.zeros((rows, cols, 3), np.uint8),
+                       ver_cells, hor_cells)
 
 
 class TestDepthMap(unittest.TestCase):
 
     def test_dm_get_shape(self):
-        scene = init_StereoScene(6, 6, None)
+        scene = init_StereoScene(6, 6)
         self.assertEqual(scene.dm_get_shape(), (6, 6))
 
-        scene = init_StereoScene(8, 3, None)
+        scene = init_StereoScene(8, 3)
         self.assertEqual(scene.dm_get_shape(), (8, 3))
 
-        scene = init_StereoScene(3, 8, None)
+        scene = init_StereoScene(3, 8)
         self.assertEqual(scene.dm_get_shape(), (3, 8))
 
         # Minimum depth map 2D array condition
-        scene = init_StereoScene(1, 1, None)
+        scene = init_StereoScene(1, 1)
         self.assertEqual(scene.dm_get_shape(), (1, 1))
 
-        self.assertRaises(ValueError, StereoScene, [[]], None)  # Depth map not 2D array
-        self.assertRaises(ValueError, StereoScene, None, None)  # No depth map
+        self.assertRaises(ValueError, StereoScene, [[]], None, 1, 1)  # Depth map not 2D array
+        self.assertRaises(ValueError, StereoScene, None, None, 1, 1)  # No depth map
 
-    def test_dm_reduce(self):
-        scene = init_StereoScene(8, 6, None)
-        scene.dm_reduce(5, 2)
+    def test_dm_get_max_min(self):
+        scene = init_StereoScene(4, 5)
+        self.assertEqual((scene.dm_get_max(), scene.dm_get_min()), (19, 0))
+
+    def test_scene_reduce(self):
+        scene = init_StereoScene(8, 6, 5, 2)
+        scene.scene_reduce()
         self.assertEqual(scene.dm_get_shape(), (5, 6))
 
-        scene = init_StereoScene(8, 6, None)
-        scene.dm_reduce(2, 5)
+        scene = init_StereoScene(8, 6, 2, 5)
+        scene.scene_reduce()
         self.assertEqual(scene.dm_get_shape(), (8, 5))
 
-        scene = init_StereoScene(14, 29, None)
-        scene.dm_reduce(5, 7)
+        scene = init_StereoScene(14, 29, 5, 7)
+        scene.scene_reduce()
         self.assertEqual(scene.dm_get_shape(), (10, 28))
 
-        scene = init_StereoScene(15, 15, None)
-        scene.dm_reduce(5, 5)
+        scene = init_StereoScene(15, 15, 5, 5)
+        scene.scene_reduce()
         self.assertEqual(scene.dm_get_shape(), (15, 15))
 
-        scene = init_StereoScene(8, 6, None)
-        self.assertRaises(ValueError, scene.dm_reduce, 0, 0)  # Reduce for 0 cells
-        self.assertRaises(ValueError, scene.dm_reduce, -1, -1)  # Reduce for negative cells
+        scene = init_StereoScene(8, 6, 0, 0)
+        self.assertRaises(ValueError, scene.scene_reduce)  # Reduce for 0 cells
+        scene = init_StereoScene(8, 6, -1, -1)
+        self.assertRaises(ValueError, scene.scene_reduce)  # Reduce for negative cells
+
+class TestSceneReduce(unittest.TestCase):
+
+    def test_scene_reduce_view(self):
+        depth_map = np.arange(14 * 29).reshape(14, 29)
+        color_map = np.zeros((14, 29, 3), np.uint8)
+        scene = StereoScene(depth_map, color_map, 5, 7)
+        scene.scene_reduce()
+        self.assertEqual(scene.dm_get_shape(), (10, 28))
+        self.assertEqual(scene.color_map.shape, (10, 28, 3))
+        self.assertTrue(np.shares_memory(scene.depth_map, depth_map))
+        self.assertEqual(scene.depth_map[0, 0], depth_map[2, 1])
+
+    def test_scene_reduce_skip_color(self):
+        color_map = np.zeros((14, 29, 3), np.uint8)
+        scene = StereoScene(np.arange(200, 200 + 14 * 29).reshape(14, 29), color_map, 5, 7)
+        scene.scene_reduce(reduce_color=False)
+        self.assertIs(scene.color_map, color_map)
+        scene.get_cells()
+        self.assertIsNone(scene.get_color_cells())  # color map not reduced with the depth map
+
+    def test_color_cells_on_demand(self):
+        color_map = np.arange(4 * 6 * 3, dtype=np.uint8).reshape(4, 6, 3)
+        scene = StereoScene(np.full((4, 6), 1000, np.uint16), color_map, 2, 3)
+        scene.get_cells()
+        self.assertIsNone(scene.cm_cells)  # no color work until asked for
+        cells = scene.get_color_cells()
+        self.assertIs(scene.get_color_cells(), cells)
+        self.assertEqual(cells.shape, (6, 2, 2, 3))
+        np.testing.assert_array_equal(cells[4], color_map[2:, 2:4])
+        self.assertFalse(np.shares_memory(cells, color_map))
+
+
+class TestCells(unittest.TestCase):
+
+    def test_get_cells_shadow_fill(self):
+        depth_map = np.array([[100, 300, 1000, 1000],
+                              [500, 100, 1000, 0]], np.uint16)
+        original = depth_map.copy()
+        scene = StereoScene(depth_map, None, 1, 2)
+        scene.get_cells()
+        self.assertEqual(scene.dm_cells.shape, (2, 2, 2))
+        self.assertTrue(scene.dm_cells.flags.c_contiguous)
+        np.testing.assert_array_equal(scene.dm_cells[0], [[250, 300], [500, 250]])
+        np.testing.assert_array_equal(scene.dm_cells[1], [[1000, 1000], [1000, 750]])
+        np.testing.assert_array_equal(depth_map, original)  # frame buffer untouched
+
+    def test_get_cells_shadow_policies(self):
+        depth_map = np.array([[100, 300, 1000, 1000],
+                              [500, 100, 1000, 0]], np.uint16)
+        scene = StereoScene(depth_map, None, 1, 2)
+        scene.get_cells(shadow_fill="valid_mean")
+        np.testing.assert_array_equal(scene.dm_cells[0], [[400, 300], [500, 400]])
+        np.testing.assert_array_equal(scene.dm_cells[1], [[1000, 1000], [1000, 1000]])
+
+        scene.get_cells(shadow_threshold=400, shadow_fill="none")
+        np.testing.assert_array_equal(scene.dm_cells[0], [[100, 300], [500, 100]])
+
+        self.assertRaises(ValueError, scene.get_cells, 200, "zero")  # Unknown shadow fill
+
+
+class TestPoints(unittest.TestCase):
+
+    def test_get_points(self):
+        depth_map = np.random.default_rng(0).integers(0, 10000, (12, 20)).astype(np.uint16)
+        scene = StereoScene(depth_map, np.zeros((12, 20, 3), np.uint8), 3, 5)
+        scene.get_cells()
+        scene.get_points()
+
+        # reference: mean of the closest 5% of each sorted cell
+        expected = []
+        for cell in scene.dm_cells:
+            cell = np.sort(np.array(cell).flatten())
+            expected.append(round(np.mean(cell[:max(1, round(len(cell) * 0.05))])))
+        self.assertEqual(list(scene.points), expected)
+
+    def test_get_points_closest(self):
+        scene = StereoScene(np.arange(200, 240).reshape(4, 10), np.zeros((4, 10, 3), np.uint8), 1, 2)
+        scene.get_cells()
+        scene.get_points(closest=0.5)
+        self.assertEqual(list(scene.points), [207, 212])
+
+
+class TestTemplateMatch(unittest.TestCase):
+
+    @staticmethod
+    def sweep(depth_map, prominence, threshold, step):
+        """
+        Reference depth sweep with exact integer squared differences.
+        """
+        height, width = depth_map.shape
+        template_height, template_width = math.ceil(height * prominence), math.ceil(width * prominence)
+        windows = np.lib.stride_tricks.sliding_window_view(depth_map.astype(np.int64),
+                                                           (template_height, template_width))
+        for depth in range(int(depth_map.max()), int(depth_map.min()), -step):
+            sqdiff = ((windows - depth) ** 2).sum(axis=(2, 3))
+            if sqdiff.min() <= threshold:
+                row, col = np.unravel_index(np.argmin(sqdiff), sqdiff.shape)
+                return (depth, (col, row))
+        return (-1, (0, 0))
+
+    def test_matches_sweep(self):
+        rng = np.random.default_rng(6)
+        for threshold, step in ((10, 1), (100, 7), (10000, 50), (1000000, 7)):
+            depth_map = rng.integers(0, 3000, (20, 24)).astype(np.uint16)
+            depth_map[5:9, 10:15] = 1200 + rng.integers(0, 3, (4, 5))  # nearly uniform region
+            scene = StereoScene(depth_map, None, 1, 1)
+            self.assertEqual(scene.template_match(0.2, threshold, step), self.sweep(depth_map, 0.2, threshold, step))
+
+    def test_no_match(self):
+        depth_map = np.random.default_rng(7).integers(0, 3000, (20, 24)).astype(np.uint16)
+        self.assertEqual(StereoScene(depth_map, None, 1, 1).template_match(0.2, 0, 1), (-1, (0, 0)))
+
+
+class TestVisualize(unittest.TestCase):
+
+    def test_render(self):
+        scene = StereoScene(np.full((6, 8), 1000, np.uint16), np.zeros((6, 8, 3), np.uint8), 2, 2)
+        scene.get_cells()
+        scene.get_points()
+        image = scene.render()
+        self.assertEqual(image.shape, (6, 16, 3))
+        np.testing.assert_array_equal(image[0, 0], [220, 220, 220])  # grid line
+        np.testing.assert_array_equal(image[1, 1], [127, 0, 255])  # closest point overlay
+
+        scene = StereoScene(np.full((6, 8), 1000, np.uint16), None, 2, 2)  # depth only
+        scene.get_cells()
+        scene.get_points()
+        self.assertRaises(ValueError, scene.render)
+
+    def test_grid_template(self):
+        grid = StereoScene.grid_template((6, 8), 2, 2)
+        self.assertIs(grid, StereoScene.grid_template((6, 8), 2, 2))  # cached between frames
+        self.assertEqual(grid.shape, (6, 8))
+        self.assertTrue(grid[0].all() and grid[3].all() and grid[:, 0].all() and grid[:, 4].all())
+        self.assertFalse(grid[1:3, 1:4].any())
+
+
+class TestDecimate(unittest.TestCase):
+
+    def setUp(self):
+        self.depth_map = np.array([[0, 300, 500, 600, 7],
+                                   [250, 100, 700, 800, 7],
+                                   [900, 900, 0, 0, 7],
+                                   [900, 1000, 0, 150, 7],
+                                   [7, 7, 7, 7, 7]], np.uint16)
+
+    def test_methods(self):
+        np.testing.assert_array_equal(decimate(self.depth_map, 2, "nearest"), [[0, 500], [900, 0]])
+        np.testing.assert_array_equal(decimate(self.depth_map, 2, "min"), [[250, 500], [900, 0]])  # shadows skipped
+        np.testing.assert_array_equal(decimate(self.depth_map, 2, "median"), [[175, 650], [900, 0]])
+
+    def test_large_blocks(self):
+        depth_map = np.random.default_rng(4).integers(0, 10000, (17, 33)).astype(np.uint16)
+        blocks = depth_map[:16, :32].reshape(2, 8, 4, 8).swapaxes(1, 2).reshape(2, 4, 64)
+        ordered = np.sort(blocks, axis=2).astype(np.int64)
+        np.testing.assert_array_equal(decimate(depth_map, 8, "median"), (ordered[..., 31] + ordered[..., 32]) // 2)
+        valid = np.where(blocks < 200, np.iinfo(np.uint16).max, blocks)
+        np.testing.assert_array_equal(decimate(depth_map, 8, "min"), valid.min(axis=2))
+
+    def test_errors(self):
+        self.assertRaises(ValueError, decimate, self.depth_map, 0)  # Zero factor
+        self.assertRaises(ValueError, decimate, self.depth_map, 6)  # Factor larger than shape
+        self.assertRaises(ValueError, decimate, self.depth_map, 2, "max")  # Unknown method
+        self.assertRaises(ValueError, decimate, self.depth_map.astype(np.int32), 2, "min")  # Signed
+
+    def test_scene_decimate(self):
+        scene = StereoScene(self.depth_map, np.zeros((5, 5, 3), np.uint8), 1, 1)
+        scene.scene_decimate(2)
+        self.assertEqual(scene.dm_get_shape(), (2, 2))
+        self.assertEqual(scene.color_map.shape, (2, 2, 3))
+
+
+class TestScenePlan(unittest.TestCase):
+
+    def test_process_matches_scene(self):
+        rng = np.random.default_rng(1)
+        plan = ScenePlan((50, 73), 3, 5)
+        for _ in range(3):
+            depth_map = rng.integers(0, 10000, (50, 73)).astype(np.uint16)
+            original = depth_map.copy()
+            scene = StereoScene(depth_map.copy(), None, 3, 5)
+            scene.scene_reduce()
+            scene.get_cells()
+            scene.get_points()
+            np.testing.assert_array_equal(plan.process(depth_map), scene.points)
+            np.testing.assert_array_equal(depth_map, original)
+
+    def test_buffers_reused(self):
+        plan = ScenePlan((12, 20), 3, 5)
+        depth_map = np.full((12, 20), 500, np.uint16)
+        cells = plan.get_cells(plan.scene_reduce(depth_map))
+        self.assertIs(plan.get_cells(plan.scene_reduce(depth_map)), cells)
+
+        out = np.empty(15, np.int64)
+        self.assertIs(plan.process(depth_map, out=out), out)
+        self.assertTrue((out == 500).all())
+
+    def test_process_allocation_free(self):
+        depth_map = np.random.default_rng(2).integers(0, 10000, (480, 640)).astype(np.uint16)
+        plan = ScenePlan(depth_map.shape, 3, 5)
+        out = np.empty(15, np.int64)
+        guard = AllocationGuard(limit=depth_map.nbytes // 2, warmup=1)
+        self.addCleanup(tracemalloc.stop)
+        for _ in range(3):
+            with guard:
+                plan.process(depth_map, out=out)
+
+        with self.assertRaises(AssertionError):
+            with guard:
+                scene = StereoScene(depth_map, None, 3, 5)
+                scene.get_cells()
+
+    def test_update_changed_cells(self):
+        depth_map = np.full((12, 20), 500, np.uint16)
+        plan = ScenePlan((12, 20), 3, 5, change_threshold=50, refresh=3)
+        np.testing.assert_array_equal(plan.update(depth_map), np.full(15, 500))
+        self.assertEqual(plan.skipped, 0)  # first frame computes every cell
+
+        depth_map[:4, :4] = 300  # first cell
+        depth_map[4:8, 4:8] += 20  # seventh cell, below threshold
+        points = plan.update(depth_map)
+        self.assertEqual(plan.skipped, 14)
+        self.assertEqual(points[0], 300)
+        self.assertEqual(points[6], 500)  # cached point kept
+        np.testing.assert_array_equal(plan.update(depth_map), points)
+        self.assertEqual(plan.skipped, 15)
+
+        self.assertEqual(plan.update(depth_map)[6], 520)  # periodic full refresh
+        self.assertEqual(plan.skipped, 0)
+        self.assertEqual(plan.skipped_total, 29)
+
+    def test_update_full(self):
+        depth_map = np.random.default_rng(3).integers(0, 10000, (50, 73)).astype(np.uint16)
+        expected = ScenePlan((50, 73), 3, 5).process(depth_map)
+        np.testing.assert_array_equal(ScenePlan((50, 73), 3, 5).update(depth_map), expected)  # no change detection
+        np.testing.assert_array_equal(ScenePlan((50, 73), 3, 5, change_threshold=0).update(depth_map), expected)
+        self.assertRaises(ValueError, ScenePlan, (12, 20), 3, 5, refresh=0)  # Never refreshed
+
+    def test_decimation(self):
+        depth_map = np.random.default_rng(5).integers(0, 10000, (50, 73)).astype(np.uint16)
+        for method in ("nearest", "min", "median"):
+            plan = ScenePlan((50, 73), 3, 5, decimation=4, decimation_method=method)
+            expected = ScenePlan((12, 18), 3, 5).process(decimate(depth_map, 4, method))
+            np.testing.assert_array_equal(plan.process(depth_map), expected)
+        self.assertRaises(ValueError, ScenePlan, (50, 73), 3, 5, decimation=0)  # Zero factor
+
+    def test_plan_shape(self):
+        plan = ScenePlan((12, 20), 3, 5)
+        self.assertRaises(ValueError, plan.process, np.zeros((12, 21), np.uint16))  # Shape changed
+        self.assertRaises(ValueError, ScenePlan, (12, 20), 0, 5)  # Zero cells
+        self.assertRaises(ValueError, ScenePlan, (12, 20), 3, 5, 200, "zero")  # Unknown shadow fill
+
+
+class TestGridAggregator(unittest.TestCase):
+
+    def setUp(self):
+        self.depth_map = np.random.default_rng(8).integers(0, 10000, (50, 73)).astype(np.uint16)
+        self.grid = GridAggregator((50, 73), 3, 7)
+
+    def cells(self):
+        for row in range(3):
+            for col in range(7):
+                yield self.depth_map[self.grid.row_edges[row]:self.grid.row_edges[row + 1],
+                                     self.grid.col_edges[col]:self.grid.col_edges[col + 1]]
+
+    def test_cell_edges(self):
+        np.testing.assert_array_equal(cell_edges(50, 3), [0, 16, 33, 50])
+        self.assertRaises(ValueError, cell_edges, 2, 3)  # More cells than pixels
+
+    def test_reductions(self):
+        self.assertEqual(self.grid.sum(self.depth_map).sum(), self.depth_map.sum())  # no pixel dropped
+        np.testing.assert_allclose(self.grid.mean(self.depth_map).ravel(), [cell.mean() for cell in self.cells()])
+        np.testing.assert_array_equal(self.grid.min(self.depth_map).ravel(), [cell.min() for cell in self.cells()])
+        np.testing.assert_array_equal(self.grid.max(self.depth_map).ravel(), [cell.max() for cell in self.cells()])
+
+    def test_percentile(self):
+        expected = [np.sort(cell.ravel())[int((cell.size - 1) * 0.1)] for cell in self.cells()]
+        np.testing.assert_array_equal(self.grid.percentile(self.depth_map, 10), expected)
+
+    def test_get_points(self):
+        expected = []
+        for cell in self.cells():
+            scene = StereoScene(cell.copy(), None, 1, 1)
+            scene.get_cells()
+            scene.get_points()
+            expected.append(scene.points[0])
+        np.testing.assert_array_equal(self.grid.get_points(self.depth_map), expected)
+
+        depth_map = self.depth_map[:48, :70]  # divisible shapes match the cropping plan
+        np.testing.assert_array_equal(GridAggregator((48, 70), 3, 7).get_points(depth_map),
+                                      ScenePlan((48, 70), 3, 7).process(depth_map))
+
+    def test_grid_shape(self):
+        self.assertRaises(ValueError, self.grid.min, np.zeros((50, 72), np.uint16))  # Shape changed
+        self.assertRaises(ValueError, GridAggregator, (50, 73), 0, 7)  # Zero cells
 
 
 if __name__ == '__main__':
@@ -0,0 +1,59 @@
+import unittest
+import numpy as np
+from src.powermap import STEPPED_EDGES
+from src.temporal import BandHysteresis, EmaFilter, FilterChain, MedianFilter
+
+
+class TestEmaFilter(unittest.TestCase):
+
+    def test_update(self):
+        ema = EmaFilter(2, alpha=0.5)
+        np.testing.assert_array_equal(ema.update([1000, 400]), [1000, 400])  # first frame passes through
+        np.testing.assert_array_equal(ema.update([600, 400]), [800, 400])
+        np.testing.assert_array_equal(ema.update([600, 400]), [700, 400])
+
+        self.assertRaises(ValueError, EmaFilter, 2, 0)  # Never updates
+
+
+class TestMedianFilter(unittest.TestCase):
+
+    def test_update(self):
+        median = MedianFilter(2, frames=3)
+        median.update([500, 300])
+        np.testing.assert_array_equal(median.update([600, 300]), [550, 300])  # partial window
+        np.testing.assert_array_equal(median.update([5000, 0]), [600, 300])  # outlier rejected
+        median.update([700, 300])
+        np.testing.assert_array_equal(median.update([800, 300]), [800, 300])  # oldest frames overwritten
+
+        self.assertRaises(ValueError, MedianFilter, 2, 0)  # Empty window
+
+
+class TestBandHysteresis(unittest.TestCase):
+
+    def test_update(self):
+        hysteresis = BandHysteresis(1, STEPPED_EDGES, margin=50)
+        np.testing.assert_array_equal(hysteresis.update([390]), [390])
+        np.testing.assert_array_equal(hysteresis.update([420]), [399])  # held in its band
+        np.testing.assert_array_equal(hysteresis.update([449]), [399])
+        np.testing.assert_array_equal(hysteresis.update([450]), [450])  # past the margin
+        np.testing.assert_array_equal(hysteresis.update([380]), [400])
+        np.testing.assert_array_equal(hysteresis.update([100]), [100])  # large jumps change band at once
+
+    def test_vectorized(self):
+        hysteresis = BandHysteresis(3, STEPPED_EDGES, margin=20)
+        hysteresis.update([190, 610, 1500])
+        np.testing.assert_array_equal(hysteresis.update([205, 590, 30000]), [199, 600, 30000])
+
+
+class TestFilterChain(unittest.TestCase):
+
+    def test_update(self):
+        chain = FilterChain([MedianFilter(1, 3), BandHysteresis(1, STEPPED_EDGES, 50)])
+        for point in (390, 390, 420, 5000):
+            points = chain.update([point])
+        np.testing.assert_array_equal(points, [399])  # median 420, held below the 400 edge
+        np.testing.assert_array_equal(FilterChain([]).update([7]), [7])
+
+
+if __name__ == '__main__':
+    unittest.main()
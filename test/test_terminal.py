@@ -0,0 +1,36 @@
+import io
+import unittest
+import numpy as np
+from src.terminal import CURSOR_HOME, StatusRenderer
+
+
+class TestStatusRenderer(unittest.TestCase):
+
+    def test_render(self):
+        stream = io.StringIO()
+        renderer = StatusRenderer(2, 3, rate=1000, stream=stream)
+        self.assertTrue(renderer.render(np.array([250, 1000, 9999, 420, 0, 1550]), 29.94, 30.0))
+        lines = stream.getvalue().split(CURSOR_HOME)[-1].splitlines()
+        self.assertEqual(lines[0].split(), ["0.2", "1.0", "10.0"])
+        self.assertEqual(lines[1].split(), ["0.4", "0.0", "1.6"])
+        self.assertIn("29.9 fps", lines[2])
+
+    def test_rate_limit(self):
+        stream = io.StringIO()
+        renderer = StatusRenderer(1, 2, rate=0.001, stream=stream)
+        self.assertTrue(renderer.render(np.zeros(2), 30, 30))
+        self.assertFalse(renderer.render(np.zeros(2), 30, 30))  # within redraw period
+        self.assertEqual(stream.getvalue().count(CURSOR_HOME), 1)
+
+        self.assertRaises(ValueError, StatusRenderer, 1, 2, 0)  # Zero redraw rate
+
+    def test_headless(self):
+        stream = io.StringIO()
+        renderer = StatusRenderer(1, 2, headless=True, stream=stream)
+        self.assertFalse(renderer.render(np.zeros(2), 30, 30))
+        renderer.close()
+        self.assertEqual(stream.getvalue(), "")
+
+
+if __name__ == '__main__':
+    unittest.main()